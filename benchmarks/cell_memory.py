@@ -0,0 +1,81 @@
+# -*- coding: UTF-8 -*-
+#
+# Copyright 2011-2019 by Dirk Gorissen, Stephen Rauch and Contributors
+# All rights reserved.
+# This file is part of the Pycel Library, Licensed under GPLv3 (the 'License')
+# You may not use this work except in compliance with the License.
+# You may obtain a copy of the Licence at:
+#   https://www.gnu.org/licenses/gpl-3.0.en.html
+
+"""
+Measure the memory used per cell, by the cells, formulas, compiled code
+and dependency graph built to evaluate a workbook
+
+The workbook is columns of input values and copied formulas.  The memory
+is measured after the evaluation, so it includes the compiled formulas,
+but not the workbook.  Usage:
+
+    python benchmarks/cell_memory.py [number of rows]
+"""
+import gc
+import sys
+import tracemalloc
+
+from openpyxl import Workbook
+
+from pycel import ExcelCompiler
+from pycel.excelcompiler import _Cell
+
+
+FORMULAS = (
+    '=A{row}*B{row}+1',
+    '=C{row}*(1+$H$1)',
+    '=IF(D{row}>100,D{row}*0.9,D{row})',
+    '=SQRT(ABS(E{row}-C{row}))',
+)
+
+
+def build_workbook(rows):
+    wb = Workbook()
+    ws = wb.active
+    ws['H1'] = 0.1
+    for row in range(1, rows + 1):
+        ws[f'A{row}'] = row % 17
+        ws[f'B{row}'] = row % 23 + 0.5
+        for col, formula in zip('CDEF', FORMULAS):
+            ws[f'{col}{row}'] = formula.format(row=row)
+    ws['G1'] = f'=SUM(F1:F{rows})'
+    return wb
+
+
+def bytes_per_cell(rows):
+    """Bytes allocated per cell to build and evaluate the workbook"""
+    # import the lib functions before measuring
+    ExcelCompiler(excel=build_workbook(1)).evaluate('Sheet!G1')
+
+    excel_compiler = ExcelCompiler(excel=build_workbook(rows))
+    gc.collect()
+    tracemalloc.start()
+    excel_compiler.evaluate('Sheet!G1')
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return size / len(excel_compiler.cell_map)
+
+
+def object_sizes():
+    """Bytes of a cell and its formula, including any instance dict"""
+    cell = _Cell('Sheet!A1', value=1.0, formula='=B1+1')
+    sizes = {}
+    for obj in (cell, cell.formula):
+        sizes[type(obj).__name__] = sys.getsizeof(obj) + sys.getsizeof(
+            getattr(obj, '__dict__', None) or ())
+    return sizes
+
+
+if __name__ == '__main__':
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    for name, size in object_sizes().items():
+        print(f'{name}: {size} bytes per object')
+    print(f'{rows * (len(FORMULAS) + 2)} cells: '
+          f'{bytes_per_cell(rows):.0f} bytes per cell')
@@ -0,0 +1,65 @@
+# -*- coding: UTF-8 -*-
+#
+# Copyright 2011-2019 by Dirk Gorissen, Stephen Rauch and Contributors
+# All rights reserved.
+# This file is part of the Pycel Library, Licensed under GPLv3 (the 'License')
+# You may not use this work except in compliance with the License.
+# You may obtain a copy of the Licence at:
+#   https://www.gnu.org/licenses/gpl-3.0.en.html
+
+"""
+Compare the memory and time to evaluate aggregates of a large data sheet,
+with its constants built as cells, and kept in columnar blocks
+
+Usage:
+
+    python benchmarks/constant_blocks.py [number of rows]
+"""
+import gc
+import sys
+import time
+import tracemalloc
+
+from openpyxl import Workbook
+
+from pycel import ExcelCompiler
+
+COLUMNS = 'ABCDEFGH'
+
+
+def build_workbook(rows):
+    wb = Workbook()
+    ws = wb.active
+    ws.title = 'Data'
+    for row in range(1, rows + 1):
+        ws.append([row % 13 + col for col in range(len(COLUMNS))])
+    out = wb.create_sheet('Out')
+    out['A1'] = f'=SUM(Data!A1:{COLUMNS[-1]}{rows})'
+    out['A2'] = f'=AVERAGE(Data!B1:B{rows})'
+    out['A3'] = '=Data!C7*2'
+    return wb
+
+
+def evaluate(wb, min_size):
+    """Seconds, bytes allocated and cell count to evaluate the outputs"""
+    ExcelCompiler.constant_block_min_size = min_size
+    excel_compiler = ExcelCompiler(excel=wb)
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    excel_compiler.evaluate(('Out!A1', 'Out!A2', 'Out!A3'))
+    elapsed = time.perf_counter() - start
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return elapsed, size, len(excel_compiler.cell_map)
+
+
+if __name__ == '__main__':
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    wb = build_workbook(rows)
+    print(f'{rows * len(COLUMNS)} data cells')
+    for name, min_size in (('cells', float('inf')), ('blocks', 1024)):
+        elapsed, size, cells = evaluate(wb, min_size)
+        print(f'{name:>6}: {elapsed:.2f} s, {size / 2 ** 20:.1f} MiB, '
+              f'{cells} cell_map entries')
@@ -0,0 +1,75 @@
+# -*- coding: UTF-8 -*-
+#
+# Copyright 2011-2019 by Dirk Gorissen, Stephen Rauch and Contributors
+# All rights reserved.
+# This file is part of the Pycel Library, Licensed under GPLv3 (the 'License')
+# You may not use this work except in compliance with the License.
+# You may obtain a copy of the Licence at:
+#   https://www.gnu.org/licenses/gpl-3.0.en.html
+
+"""
+Measure the formula evaluations and time to evaluate a workbook with a
+small cycle inside a large acyclic model
+
+The model is columns of copied formulas, feeding a cycle of 40 cells, which
+is summed by the output.  Only the cycle is iterated, so the rest of the
+model is evaluated once, whatever the number of iterations.  Usage:
+
+    python benchmarks/cycles.py [number of rows]
+"""
+import collections
+import sys
+import time
+
+from openpyxl import Workbook
+
+from pycel import ExcelCompiler
+
+CYCLE_LENGTH = 40
+
+
+def build_workbook(rows):
+    wb = Workbook()
+    wb.calculation.iterate = True
+    wb.calculation.iterateCount = 100
+    wb.calculation.iterateDelta = 0.000001
+    ws = wb.active
+    for row in range(1, rows + 1):
+        ws[f'A{row}'] = row % 17
+        ws[f'B{row}'] = f'=A{row}*1.01'
+        ws[f'C{row}'] = f'=B{row}+A{row}'
+    ws['D1'] = f'=SUM(C1:C{rows})'
+
+    # interest on the closing balance, which depends on the interest
+    ws['E1'] = f'=D1+F{CYCLE_LENGTH}'
+    for row in range(2, CYCLE_LENGTH + 1):
+        ws[f'E{row}'] = f'=E{row - 1}*1.001'
+    for row in range(1, CYCLE_LENGTH + 1):
+        ws[f'F{row}'] = f'=E{row}*0.0001'
+    ws['G1'] = f'=SUM(E1:E{CYCLE_LENGTH})+SUM(C1:C{rows})'
+    return wb
+
+
+def evaluate(rows):
+    excel_compiler = ExcelCompiler(excel=build_workbook(rows))
+    evals = collections.Counter()
+    eval_cell = excel_compiler.eval
+
+    def counting_eval(cell, cse_array_address=None):
+        evals[cell.address.address] += 1
+        return eval_cell(cell, cse_array_address)
+
+    excel_compiler._eval = counting_eval
+    start = time.perf_counter()
+    result = excel_compiler.evaluate('Sheet!G1')
+    return result, time.perf_counter() - start, evals
+
+
+if __name__ == '__main__':
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    result, elapsed, evals = evaluate(rows)
+    cycle_evals = evals['Sheet!E1']
+    print(f'{rows * 2 + 2 * CYCLE_LENGTH + 2} formulas, G1 = {result:.4f}, '
+          f'{elapsed:.2f} s')
+    print(f'{sum(evals.values())} formula evaluations, '
+          f'{cycle_evals} iterations of the cycle')
@@ -0,0 +1,101 @@
+# -*- coding: UTF-8 -*-
+#
+# Copyright 2011-2019 by Dirk Gorissen, Stephen Rauch and Contributors
+# All rights reserved.
+# This file is part of the Pycel Library, Licensed under GPLv3 (the 'License')
+# You may not use this work except in compliance with the License.
+# You may obtain a copy of the Licence at:
+#   https://www.gnu.org/licenses/gpl-3.0.en.html
+
+"""
+Compare the memory and traversal times of the compact dependency graph
+with a networkx DiGraph
+
+The graph is a sheet of columns of formulas, each referring to two cells
+in the column before it, and to one shared cell.  Usage:
+
+    python benchmarks/dependency_graph.py [number of rows]
+"""
+import gc
+import sys
+import time
+import tracemalloc
+
+import networkx as nx
+
+from pycel.excelcompiler import _Cell
+from pycel.excelgraph import DependencyGraph
+
+COLUMNS = 'BCDEFGHI'
+
+
+def build_cells(rows):
+    shared = _Cell('Sheet!A1', value=1)
+    cells = {}
+    edges = []
+    for col, prev_col in zip(COLUMNS, 'A' + COLUMNS):
+        for row in range(1, rows + 1):
+            cell = cells[col, row] = _Cell(f'Sheet!{col}{row}', value=None)
+            edges.append((shared, cell))
+            for precedent_row in {row, max(1, row - 1)}:
+                precedent = cells.get((prev_col, precedent_row))
+                if precedent is not None:
+                    edges.append((precedent, cell))
+    return cells, edges
+
+
+def build_graph(graph, edges):
+    """Seconds to build, and bytes used, by the graph"""
+    tracemalloc.start()
+    start = time.perf_counter()
+    for precedent, dependent in edges:
+        graph.add_edge(precedent, dependent)
+    elapsed = time.perf_counter() - start
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return elapsed, size
+
+
+def timed(func, *args):
+    gc.collect()
+    start = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - start
+
+
+def walk_precedents(graph, cells):
+    for cell in cells:
+        tuple(graph.predecessors(cell))
+
+
+def traversals(cells, graph, is_networkx):
+    """Seconds for each of the traversals used by the compiler"""
+    last = cells[COLUMNS[-1], len(cells) // len(COLUMNS)]
+    shared = min(graph.predecessors(last), key=lambda c: c.address.column)
+    if is_networkx:
+        return dict(
+            ancestors=timed(nx.ancestors, graph, last),
+            descendants=timed(nx.descendants, graph, shared),
+            topological_sort=timed(
+                lambda: tuple(nx.topological_sort(graph))),
+            predecessors=timed(walk_precedents, graph, cells.values()),
+        )
+    return dict(
+        ancestors=timed(graph.ancestors, last),
+        descendants=timed(graph.descendants, shared),
+        topological_sort=timed(graph.topological_sort),
+        predecessors=timed(walk_precedents, graph, cells.values()),
+    )
+
+
+if __name__ == '__main__':
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    cells, edges = build_cells(rows)
+    print(f'{len(cells)} cells, {len(edges)} edges')
+    for name, graph in (('networkx', nx.DiGraph()),
+                        ('compact', DependencyGraph())):
+        elapsed, size = build_graph(graph, edges)
+        print(f'{name:>8}: build {elapsed:.2f} s, {size / 2 ** 20:.1f} MiB')
+        for traversal, elapsed in traversals(
+                cells, graph, name == 'networkx').items():
+            print(f'{name:>8}: {traversal} {elapsed * 1000:.0f} ms')
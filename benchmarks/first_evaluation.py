@@ -0,0 +1,71 @@
+# -*- coding: UTF-8 -*-
+#
+# Copyright 2011-2019 by Dirk Gorissen, Stephen Rauch and Contributors
+# All rights reserved.
+# This file is part of the Pycel Library, Licensed under GPLv3 (the 'License')
+# You may not use this work except in compliance with the License.
+# You may obtain a copy of the Licence at:
+#   https://www.gnu.org/licenses/gpl-3.0.en.html
+
+"""
+Time the first evaluation of a workbook with many formulas
+
+The first evaluation of each formula compiles it and loads the functions
+it uses.  Usage:
+
+    python benchmarks/first_evaluation.py [number of rows]
+"""
+import sys
+import time
+import tracemalloc
+
+from openpyxl import Workbook
+
+from pycel import ExcelCompiler
+
+
+FORMULAS = (
+    '=A{row}*2+1',
+    '=IF(A{row}>50,SUM(A{row},B{row}),MAX(A{row},B{row}))',
+    '=ROUND(SQRT(ABS(B{row}-C{row})),2)',
+    '=IFERROR(C{row}/(A{row}-50),0)+MIN(B{row}:D{row})',
+    '=AND(A{row}>10,E{row}<100)',
+)
+
+
+def build_workbook(rows):
+    wb = Workbook()
+    ws = wb.active
+    for row in range(1, rows + 1):
+        ws[f'A{row}'] = row % 100
+        for col, formula in zip('BCDEF', FORMULAS):
+            ws[f'{col}{row}'] = formula.format(row=row)
+    return wb
+
+
+def first_evaluation(rows):
+    """Seconds for the first evaluation"""
+    excel_compiler = ExcelCompiler(excel=build_workbook(rows))
+    addrs = [f'Sheet!F{row}' for row in range(1, rows + 1)]
+
+    start = time.perf_counter()
+    excel_compiler.evaluate(addrs)
+    return time.perf_counter() - start
+
+
+def first_evaluation_memory(rows):
+    """Peak bytes allocated during the first evaluation"""
+    tracemalloc.start()
+    try:
+        first_evaluation(rows)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+if __name__ == '__main__':
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    elapsed = first_evaluation(rows)
+    peak = first_evaluation_memory(rows)
+    print(f'{rows * len(FORMULAS)} formulas: first evaluation '
+          f'{elapsed:.2f} s, peak memory {peak / 2 ** 20:.1f} MiB')
@@ -0,0 +1,93 @@
+# -*- coding: UTF-8 -*-
+#
+# Copyright 2011-2019 by Dirk Gorissen, Stephen Rauch and Contributors
+# All rights reserved.
+# This file is part of the Pycel Library, Licensed under GPLv3 (the 'License')
+# You may not use this work except in compliance with the License.
+# You may obtain a copy of the Licence at:
+#   https://www.gnu.org/licenses/gpl-3.0.en.html
+
+"""
+Compare the time of the operators in formulas, with the fast paths for
+numbers and with the generic fixup
+
+Each operator is timed with int and float operands, and with a column of
+numbers, then a workbook of arithmetic formulas is evaluated.  Usage:
+
+    python benchmarks/operators.py [number of rows]
+"""
+import sys
+import time
+import timeit
+from unittest import mock
+
+from openpyxl import Workbook
+
+from pycel import ExcelCompiler
+from pycel.excelutil import build_operator_operand_fixup, RangeValue
+
+OPERATORS = ('Add', 'Sub', 'Mult', 'Div', 'Pow', 'Lt', 'Eq', 'USub')
+NUMBER = 200000
+ARRAY_ROWS = 10000
+
+
+def time_operators():
+    """Nanoseconds per call of the fixup, for each operator"""
+    fixup = build_operator_operand_fixup(lambda *args: None)
+    times = {}
+    for op in OPERATORS:
+        left_op = '' if op == 'USub' else 7
+        times[op] = timeit.timeit(
+            lambda: fixup(left_op, op, 2.5), number=NUMBER) / NUMBER * 1e9
+    return times
+
+
+def time_arrays():
+    """Milliseconds per call of the fixup, for a column and a number"""
+    fixup = build_operator_operand_fixup(lambda *args: None)
+    times = {}
+    rows = tuple((row % 17 + 0.5, ) for row in range(ARRAY_ROWS))
+    for op in OPERATORS[:-1]:
+        times[op] = timeit.timeit(
+            lambda: fixup(RangeValue(rows), op, 2.5), number=10) / 10 * 1e3
+    return times
+
+
+def build_workbook(rows):
+    wb = Workbook()
+    ws = wb.active
+    for row in range(1, rows + 1):
+        ws[f'A{row}'] = row % 17 + 0.5
+        ws[f'B{row}'] = f'=A{row}*1.01-A{row}/3'
+        ws[f'C{row}'] = f'=IF(B{row}>5,B{row}^2,-B{row})+A{row}'
+    ws['D1'] = f'=SUM(C1:C{rows})'
+    return wb
+
+
+def time_workbook(rows):
+    excel_compiler = ExcelCompiler(excel=build_workbook(rows))
+    excel_compiler.evaluate('Sheet!D1')
+    excel_compiler.set_value('Sheet!A1', 3)
+    start = time.perf_counter()
+    excel_compiler.recalculate()
+    return time.perf_counter() - start
+
+
+def report(rows):
+    times = time_operators()
+    print(' '.join(f'{op} {ns:.0f}' for op, ns in times.items()), 'ns')
+    times = time_arrays()
+    print(f'{ARRAY_ROWS} rows:',
+          ' '.join(f'{op} {ms:.1f}' for op, ms in times.items()), 'ms')
+    print(f'{rows * 2} formulas recalculated in {time_workbook(rows):.2f} s')
+
+
+if __name__ == '__main__':
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+
+    print('fast path:')
+    report(rows)
+    print('generic fixup:')
+    with mock.patch('pycel.excelutil.NUMBER_OPERAND_TYPES', ()), \
+            mock.patch('pycel.excelutil.NUMBER_UFUNCS', {}):
+        report(rows)
@@ -0,0 +1,45 @@
+# -*- coding: UTF-8 -*-
+#
+# Copyright 2011-2019 by Dirk Gorissen, Stephen Rauch and Contributors
+# All rights reserved.
+# This file is part of the Pycel Library, Licensed under GPLv3 (the 'License')
+# You may not use this work except in compliance with the License.
+# You may obtain a copy of the Licence at:
+#   https://www.gnu.org/licenses/gpl-3.0.en.html
+
+"""
+Time aggregates over a large range, with the range value as nested tuples
+and as a RangeValue, which keeps its numbers as a float64 array
+
+The first RangeValue call includes building the arrays, which happens
+once per recalculation of the range.  Usage:
+
+    python benchmarks/range_sum.py [number of rows]
+"""
+import sys
+import time
+
+from pycel.excellib import sum_, sumproduct
+from pycel.excelutil import RangeValue
+from pycel.lib.stats import average, max_
+
+
+FUNCTIONS = (sum_, average, max_, sumproduct)
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - start
+
+
+if __name__ == '__main__':
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    data = tuple((row % 97 + 0.5, ) for row in range(rows))
+    range_value = RangeValue(data)
+    print(f'{rows} rows, build arrays: '
+          f'{timed(lambda: range_value.numbers) * 1000:.1f} ms')
+    for func in FUNCTIONS:
+        print(f'{func.__name__:>10}: '
+              f'tuples {timed(func, data) * 1000:.1f} ms, '
+              f'arrays {timed(func, range_value) * 1000:.2f} ms')
@@ -0,0 +1,72 @@
+# -*- coding: UTF-8 -*-
+#
+# Copyright 2011-2019 by Dirk Gorissen, Stephen Rauch and Contributors
+# All rights reserved.
+# This file is part of the Pycel Library, Licensed under GPLv3 (the 'License')
+# You may not use this work except in compliance with the License.
+# You may obtain a copy of the Licence at:
+#   https://www.gnu.org/licenses/gpl-3.0.en.html
+
+"""
+Compare the time and memory to evaluate aggregates of whole columns,
+read sparsely and read as dense ranges
+
+The column has a few populated cells at the top, and one stray cell far
+down the sheet, so the bounded column is mostly empty.  Usage:
+
+    python benchmarks/sparse_ranges.py [row of the stray cell]
+"""
+import gc
+import sys
+import time
+import tracemalloc
+from unittest import mock
+
+from openpyxl import Workbook
+
+from pycel import ExcelCompiler
+from pycel.excelwrapper import ExcelOpxWrapper
+
+FORMULAS = (
+    '=SUM(A:A)',
+    '=COUNT(A:A)',
+    '=COUNTIF(A:A,">5")',
+    '=MATCH(-1,A:A,0)',
+)
+
+
+def build_workbook(stray_row):
+    wb = Workbook()
+    ws = wb.active
+    for row in range(1, 1001):
+        ws[f'A{row}'] = row % 10
+    ws[f'A{stray_row}'] = -1
+    for row, formula in enumerate(FORMULAS, start=1):
+        ws[f'B{row}'] = formula
+    return wb
+
+
+def evaluate(stray_row):
+    """Seconds, and peak memory, to evaluate the formulas"""
+    wb = build_workbook(stray_row)
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    results = ExcelCompiler(excel=wb).evaluate(
+        tuple(f'Sheet!B{row}' for row in range(1, len(FORMULAS) + 1)))
+    elapsed = time.perf_counter() - start
+    size = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return (f'{elapsed:.2f} s, peak {size / 2 ** 20:.1f} MiB, '
+            f'results {results}')
+
+
+if __name__ == '__main__':
+    stray_row = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+
+    # import the lib functions before measuring
+    evaluate(10)
+    print(f'sparse: {evaluate(stray_row)}')
+    with mock.patch.object(ExcelOpxWrapper, 'get_sparse_range',
+                           lambda self, address: None):
+        print(f' dense: {evaluate(stray_row)}')
@@ -0,0 +1,65 @@
+# -*- coding: UTF-8 -*-
+#
+# Copyright 2011-2019 by Dirk Gorissen, Stephen Rauch and Contributors
+# All rights reserved.
+# This file is part of the Pycel Library, Licensed under GPLv3 (the 'License')
+# You may not use this work except in compliance with the License.
+# You may obtain a copy of the Licence at:
+#   https://www.gnu.org/licenses/gpl-3.0.en.html
+
+"""
+Time the evaluation of columns of copied formulas, with and without
+vectorized runs
+
+Each iteration changes an input, and evaluates the total of the last
+column.  Usage:
+
+    python benchmarks/vector_runs.py [number of rows]
+"""
+import sys
+import time
+
+from openpyxl import Workbook
+
+from pycel import ExcelCompiler
+
+
+FORMULAS = (
+    '=A{row}*B{row}+1',
+    '=C{row}*(1+$H$1)',
+    '=IF(D{row}>100,D{row}*0.9,D{row})',
+    '=SQRT(ABS(E{row}-C{row}))',
+)
+
+
+def build_workbook(rows):
+    wb = Workbook()
+    ws = wb.active
+    ws['H1'] = 0.1
+    for row in range(1, rows + 1):
+        ws[f'A{row}'] = row % 17
+        ws[f'B{row}'] = row % 23 + 0.5
+        for col, formula in zip('CDEF', FORMULAS):
+            ws[f'{col}{row}'] = formula.format(row=row)
+    ws['G1'] = f'=SUM(F1:F{rows})'
+    return wb
+
+
+def evaluation(rows, iterations=3, **kwargs):
+    """Seconds per evaluation after an input is changed"""
+    excel_compiler = ExcelCompiler(excel=build_workbook(rows), **kwargs)
+    excel_compiler.evaluate('Sheet!G1')
+
+    start = time.perf_counter()
+    for i in range(iterations):
+        excel_compiler.set_value('Sheet!H1', i / 10)
+        excel_compiler.evaluate('Sheet!G1')
+    return (time.perf_counter() - start) / iterations
+
+
+if __name__ == '__main__':
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    for kwargs in (dict(topological=True), dict(vectorize=True)):
+        elapsed = evaluation(rows, **kwargs)
+        print(f'{rows * len(FORMULAS)} formulas, {kwargs}: '
+              f'{elapsed * 1000:.1f} ms per evaluation')
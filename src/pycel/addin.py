@@ -61,7 +61,7 @@ def compile_selection_menu():
     sp = do_compilation(curfile, seed)
     win32api.MessageBox(
         0, "Compilation done, graph has %s nodes and %s edges" % (
-            len(sp.dep_graph.nodes()), len(sp.dep_graph.edges())), "Pycel")
+            sp.dep_graph.number_of_nodes(), sp.dep_graph.number_of_edges()), "Pycel")
 
 
 def do_compilation(fname, seed, sheet=None):
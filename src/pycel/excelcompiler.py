@@ -7,21 +7,35 @@
 # You may obtain a copy of the Licence at:
 #   https://www.gnu.org/licenses/gpl-3.0.en.html
 
+import ast
 import collections
 import hashlib
+import importlib
 import itertools as it
 import json
 import logging
 import math
 import os
 import pickle
+import re
 from numbers import Number
 
 import networkx as nx
 import numpy as np
+from openpyxl.utils import get_column_letter
 from ruamel.yaml import YAML
 
-from pycel.excelformula import ExcelFormula
+from pycel.excelformula import (
+    CommonSubexpressions,
+    DeadBranchEliminator,
+    ExcelFormula,
+    FunctionNode,
+    OperatorWrapper,
+    python_code_from_ast,
+    python_code_template,
+    UnknownFunction,
+)
+from pycel.excelgraph import CycleError, DependencyGraph, NodeNotFound
 from pycel.excelutil import (
     AddressCell,
     AddressRange,
@@ -30,17 +44,88 @@ from pycel.excelutil import (
     is_address,
     iterative_eval_tracker,
     list_like,
+    RangeValue,
+    slots_getstate,
+    slots_setstate,
+)
+from pycel.excelvector import (
+    build_vector_lambda,
+    finite_mask,
+    NotVectorizable,
+    to_vector,
 )
 from pycel.excelwrapper import ExcelOpxWrapper, ExcelOpxWrapperNoData
+from pycel.lib.function_helpers import volatile_names
+from pycel.lib.function_info import func_status_msg
 
 REF_START = '=_REF_("'
 REF_END = '")'
 REF_FORMAT = REF_START + '{}' + REF_END
 
 Mismatch = collections.namedtuple('Mismatch', 'original calced formula')
+CycleConvergence = collections.namedtuple(
+    'CycleConvergence', 'iterations residual converged')
+DynamicReferences = collections.namedtuple(
+    'DynamicReferences', 'resolved runtime')
+
+# the functions returning references
+DYNAMIC_FUNCTIONS = frozenset(('offset', 'indirect'))
 
 pycel_logger = logging.getLogger('pycel')
 
+PYTHON_MODULE_TEMPLATE = '''\
+"""
+{function_name}() for {filename}, exported by pycel
+
+Arguments:
+{arguments_doc}
+
+Returns a tuple of:
+{returns_doc}
+"""
+import math
+{imports}
+from pycel.excelutil import (
+    AddressRange,
+    build_operator_operand_fixup,
+    EMPTY,
+    list_like,
+)
+from pycel.lib.function_helpers import load_functions
+
+INPUTS = {inputs!r}
+OUTPUTS = {outputs!r}
+
+
+def _cell_value(value):
+    if value in (None, EMPTY):
+        return 0
+    elif list_like(value):
+        return value[0][0] if list_like(value[0]) else value[0]
+    return value
+
+
+_name_space = {{}}
+load_functions({function_names!r}, _name_space, ({modules}))
+{functions}
+excel_operator_operand_fixup = build_operator_operand_fixup(
+    lambda is_exception, msg: None)
+_REF_ = AddressRange.create
+pi = math.pi
+
+
+def {function_name}({arguments}):
+{body}
+    return {returns}
+'''
+
+
+def _called_functions(python_code):
+    """The names of the functions called in the python code, by call"""
+    return [node.func.id
+            for node in ast.walk(ast.parse(python_code, mode='eval'))
+            if isinstance(node, ast.Call) and isinstance(node.func, ast.Name)]
+
 
 class ExcelCompiler:
     """Class responsible for taking an Excel spreadsheet and compiling it
@@ -50,13 +135,51 @@ class ExcelCompiler:
 
     save_file_extensions = ('pkl', 'pickle', 'yml', 'yaml', 'json')
 
-    def __init__(self, filename=None, excel=None, plugins=None, cycles=None):
+    # the constants of ranges with at least this many cells are kept in
+    # columns, and are only built as cells when referenced on their own
+    constant_block_min_size = 1024
+
+    # the sheet of the cells added by `hoist_subexpressions`
+    subexpression_sheet = '_subexpressions'
+
+    # the ways to iterate the cycles, selected by the 'method' of `cycles`
+    cycle_methods = (
+        'fixed_point', 'gauss_seidel', 'aitken', 'anderson', 'secant', 'linear')
+
+    def __init__(self, filename=None, excel=None, plugins=None, cycles=None,
+                 topological=False, vectorize=False):
         """ Build a compiler instance to organize the formula for a workbook
 
         :param filename: Excel filename to load from (xlsx or `to_file`)
         :param excel: Opened instance of ExcelWrapper or openpyxl workbook
         :param plugins: module paths for plugin lib functions
-        :param cycles: Override workbook iterative calculation settings
+        :param cycles: Override workbook iterative calculation settings.
+            A dict of `iterations`, `tolerance` and optionally the `method`
+            to converge the cycles, one of `cycle_methods`:
+
+            - fixed_point: evaluate each cycle until it stops changing,
+              as Excel does (default)
+            - gauss_seidel: evaluate the cells of each cycle once per
+              iteration, in a fixed order, without recursing
+            - aitken: extrapolate every second iteration with Aitken's
+              delta-squared
+            - anderson: extrapolate from the last few iterations, by
+              Anderson acceleration
+            - secant: update each cell by the secant of its last two
+              iterations
+            - linear: solve the cycles which are linear in their cells
+              in one step, iterate the others as fixed_point
+
+            The iterations used and the final residual of each cycle are
+            reported in `cycle_convergence`, by the first address of the
+            cycle.
+        :param topological: Evaluate the precedents of a cell iteratively in
+            topological order, instead of recursively from the cell.  In this
+            mode `set_value` marks cells dirty, and the dependents are
+            recalculated incrementally by `recalculate_dirty`.
+        :param vectorize: Evaluate topologically, and evaluate runs of a
+            formula copied down a column, which do not depend on each other,
+            as NumPy arrays.
         """
 
         self._eval = None
@@ -79,15 +202,35 @@ class ExcelCompiler:
         self.log = pycel_logger
 
         # directed graph for cell dependencies
-        self.dep_graph = nx.DiGraph()
+        self.dep_graph = DependencyGraph()
 
         # cell address to Cell mapping, cells and ranges already built
         self.cell_map = {}
 
+        # constant cells of large ranges, which are not in the cell_map
+        self._constants = _ConstantColumns()
+
         # cells, ranges and graph_edges that need to be built
         self.graph_todos = []
         self.range_todos = []
 
+        # evaluation order for the precedents of a cell, keyed by address
+        self.topological = topological or vectorize
+        self._topological_orders = {}
+
+        # evaluation order, with runs of copied formulas, keyed by address
+        self.vectorize = vectorize
+        self._vector_orders = {}
+
+        # cells changed by set_value, whose dependents need recalculation
+        self._dirty_cells = set()
+
+        # cells calling volatile functions, see `recalculate_volatile`, and
+        # the references returned by them while evaluating one of these
+        self._volatile_cells = set()
+        self._volatile_names = None
+        self._references = None
+
         self.extra_data = None
         self.conditional_formats = {}
         self._formula_cells_dict = {}
@@ -107,14 +250,20 @@ class ExcelCompiler:
                     f"Initialized with cycles: {self.cycles}, while workbook says: {wb_cycles}")
 
             if self.cycles:
-                self.cycles = dict(
-                    iterations=self.excel.workbook.calculation.iterateCount,
-                    tolerance=self.excel.workbook.calculation.iterateDelta,
-                )
+                self.cycles = {
+                    'iterations': self.excel.workbook.calculation.iterateCount,
+                    'tolerance': self.excel.workbook.calculation.iterateDelta,
+                    **(self.cycles if isinstance(self.cycles, dict) else {}),
+                }
 
-        elif self.cycles:
+        if self.cycles:
             assert isinstance(self.cycles, dict)
-            assert self.cycles.keys() == {'iterations', 'tolerance'}
+            assert self.cycles.keys() - {'method'} == {'iterations', 'tolerance'}
+            assert self.cycles.get('method', 'fixed_point') in self.cycle_methods
+
+        # iterations and residual of the latest iteration of each cycle,
+        # by the first address of the cycle, see `_iterate_cycle`
+        self.cycle_convergence = {}
 
         self.Cell = _CycleCell if self.cycles else _Cell
         self.evaluate = (self._evaluate_iterative if self.cycles else
@@ -124,7 +273,8 @@ class ExcelCompiler:
         # code objects are not serializable
         state = dict(self.__dict__)
         to_removes = '_eval excel log graph_todos range_todos ' \
-                     'conditional_formats'.split()
+                     'conditional_formats _topological_orders ' \
+                     '_vector_orders _volatile_names'.split()
         for to_remove in to_removes:
             if to_remove in state:    # pragma: no branch
                 state[to_remove] = None
@@ -133,6 +283,18 @@ class ExcelCompiler:
     def __setstate__(self, d):
         self.__dict__.update(d)
         self.log = pycel_logger
+        self.topological = d.get('topological', False)
+        self._topological_orders = {}
+        self.vectorize = d.get('vectorize', False)
+        self._vector_orders = {}
+        self._dirty_cells = d.get('_dirty_cells', set())
+        self._volatile_cells = d.get('_volatile_cells', set())
+        self._volatile_names = None
+        self._references = None
+        self._constants = d.get('_constants', _ConstantColumns())
+        self.cycle_convergence = d.get('cycle_convergence', {})
+        if isinstance(self.dep_graph, nx.DiGraph):
+            self.dep_graph = DependencyGraph.from_networkx(self.dep_graph)
 
     @staticmethod
     def _compute_file_md5_digest(filename):
@@ -157,18 +319,27 @@ class ExcelCompiler:
     @property
     def eval(self):
         if self._eval is None:
+            # cycles need the evaluator to track each reference
             eval_ctx = ExcelFormula.build_eval_context(
                 self._evaluate, self._evaluate_range,
-                self.log, plugins=self._plugin_modules)
+                self.log, plugins=self._plugin_modules,
+                cell_map=None if self.cycles else self.cell_map,
+                referenced=self._referenced)
 
             if self.cycles:
                 def _eval(cell, cse_array_address=None):
                     cell.start_calcs()
+                    if cell in self._volatile_cells:
+                        return self._eval_volatile(
+                            eval_ctx, cell, cse_array_address)
                     return eval_ctx(
                         cell.formula, cse_array_address=cse_array_address)
 
             else:
                 def _eval(cell, cse_array_address=None):
+                    if cell in self._volatile_cells:
+                        return self._eval_volatile(
+                            eval_ctx, cell, cse_array_address)
                     return eval_ctx(
                         cell.formula, cse_array_address=cse_array_address)
 
@@ -176,29 +347,84 @@ class ExcelCompiler:
 
         return self._eval
 
+    def _eval_volatile(self, eval_ctx, cell, cse_array_address):
+        """ Evaluate a cell calling volatile functions
+
+        The references returned by the volatile functions, eg: OFFSET(), are
+        recorded as runtime edges in the graph, replacing those from the
+        previous evaluation, so changing a referenced cell resets the cell.
+        """
+        references, self._references = self._references, []
+        try:
+            return eval_ctx(cell.formula, cse_array_address=cse_array_address)
+        finally:
+            references, self._references = self._references, references
+            self._set_runtime_precedents(cell, references)
+
+    def _referenced(self, address):
+        """Record an address returned by a volatile function"""
+        if self._references is not None:
+            self._references.append(address)
+
+    def _set_runtime_precedents(self, cell, references):
+        """Replace the runtime edges to a cell, from the addresses it referenced"""
+        needed = {address.address for address in cell.needed_addresses}
+        precedents = []
+        for address in references:
+            address = address.address
+            if address not in needed:
+                if address not in self.cell_map and getattr(self, 'excel', None):
+                    self._gen_graph(address)
+                if address in self.cell_map:
+                    precedents.append(self.cell_map[address])
+
+        if self.dep_graph.set_runtime_precedents(cell, precedents):
+            # the new edges invalidate the evaluation orders
+            self._topological_orders.clear()
+            self._vector_orders.clear()
+
     @classmethod
     def _filename_has_extension(cls, filename):
         return next((extension for extension in cls.save_file_extensions
                      if filename.endswith(extension)), None)
 
-    def _to_text(self, filename=None, is_json=False):
+    def _to_text(self, filename=None, is_json=False,
+                 include_subexpressions=False):
         """Serialize to a json/yaml file"""
         extra_data = {} if self.extra_data is None else self.extra_data
+        prefix = self.subexpression_sheet + '!'
+        inline = not include_subexpressions and any(
+            addr.startswith(prefix) for addr in self.cell_map)
 
         def cell_value(a_cell):
             if a_cell.formula and a_cell.formula.python_code:
+                if inline:
+                    return '=' + self._expand_subexpressions(
+                        a_cell.formula.python_code)
                 return '=' + a_cell.formula.python_code
             elif isinstance(a_cell.value, np.float64):
                 return float(a_cell.value)
             else:
                 return a_cell.value
 
+        def constants():
+            for block_range in self._constants.all_ranges():
+                for addr, value in self._constants.items(block_range):
+                    if addr not in self.cell_map:
+                        yield addr, (float(value) if isinstance(
+                            value, np.float64) else value)
+
         extra_data.update(dict(
             cycles=self.cycles,
             excel_hash=self._excel_file_md5_digest,
             cell_map=dict(sorted(
-                ((addr, cell_value(cell))
-                 for addr, cell in self.cell_map.items() if cell.serialize),
+                it.chain(
+                    ((addr, cell_value(cell))
+                     for addr, cell in self.cell_map.items()
+                     if cell.serialize and not (
+                         inline and addr.startswith(prefix))),
+                    constants(),
+                ),
                 key=lambda x: AddressRange(x[0]).sort_key
             )),
             # serialize the workbook filename (not the serialization path)
@@ -251,16 +477,19 @@ class ExcelCompiler:
                 formula.lineno = line_number
                 formula.filename = filename
 
-        # populate the cells
+        # populate the formula cells
         range_todos = []
+        constant_todos = []
         for address, python_code in data['cell_map'].items():
             lineno = data['cell_map'].lc.data[address][0] + 1
             address = AddressRange(address)
             if address.is_range:
                 range_todos.append((address, lineno))
-            else:
+            elif isinstance(python_code, str) and python_code.startswith('='):
                 excel_compiler._make_cells(address)
                 add_line_numbers(address.address, lineno)
+            else:
+                constant_todos.append(address)
 
         # populate the ranges and dependant graph
         for address, lineno in range_todos:
@@ -268,6 +497,12 @@ class ExcelCompiler:
             add_line_numbers(address.address, lineno)
 
         excel_compiler._process_gen_graph()
+
+        # the constants which are not in the blocks of large ranges
+        for address in constant_todos:
+            if address.address not in excel_compiler.cell_map and not (
+                    excel_compiler._constants.ranges_containing(address)):
+                excel_compiler._make_cells(address)
         del data['cell_map']
 
         # process the rest of the data from the file
@@ -279,7 +514,8 @@ class ExcelCompiler:
         excel_compiler.excel = None
         return excel_compiler
 
-    def to_file(self, filename=None, file_types=('pkl', 'yml')):
+    def to_file(self, filename=None, file_types=('pkl', 'yml'),
+                include_subexpressions=False):
         """ Save the spreadsheet to a file so it can be loaded later w/o excel
 
         :param filename: filename to save as, defaults to xlsx_name + file_type
@@ -288,6 +524,10 @@ class ExcelCompiler:
         If the filename has one of the expected extensions, then this
         parameter is ignored.
 
+        :param include_subexpressions: if True, save the cells added by
+            `hoist_subexpressions`, else their calls are put back in the
+            formulas
+
         The text file formats (yaml and json) provide the benefits of:
             1. Can `diff` subsequent version of xlsx to monitor changes.
             2. Can "debug" the generated code.
@@ -330,7 +570,9 @@ class ExcelCompiler:
         text_name = filename
         if not text_name.endswith(non_pickle_extension or '.yml'):
             text_name += '.' + (non_pickle_extension or 'yml')
-        text_changed = self._to_text(text_name, is_json=is_json)
+        text_changed = self._to_text(
+            text_name, is_json=is_json,
+            include_subexpressions=include_subexpressions)
 
         # save pickle file if requested and has changed
         if pickle_extension:
@@ -389,12 +631,12 @@ class ExcelCompiler:
 
         from networkx.drawing.nx_pydot import write_dot
         filename = filename or (self.filename + '.dot')
-        write_dot(self.dep_graph, filename)
+        write_dot(self.dep_graph.to_networkx(), filename)
 
     def export_to_gexf(self, filename=None):
         from networkx.readwrite.gexf import write_gexf
         filename = filename or (self.filename + '.gexf')
-        write_gexf(self.dep_graph, filename)
+        write_gexf(self.dep_graph.to_networkx(), filename)
 
     def plot_graph(self, layout_type='spring_layout'):
         try:
@@ -403,10 +645,11 @@ class ExcelCompiler:
         except ImportError:
             raise ImportError("Package 'matplotlib' is not installed")
 
-        pos = getattr(nx, layout_type)(self.dep_graph, iterations=2000)
-        nx.draw_networkx_nodes(self.dep_graph, pos)
-        nx.draw_networkx_edges(self.dep_graph, pos, arrows=True)
-        nx.draw_networkx_labels(self.dep_graph, pos)
+        graph = self.dep_graph.to_networkx()
+        pos = getattr(nx, layout_type)(graph, iterations=2000)
+        nx.draw_networkx_nodes(graph, pos)
+        nx.draw_networkx_edges(graph, pos, arrows=True)
+        nx.draw_networkx_labels(graph, pos)
         plt.show()
 
     def set_value(self, address, value, set_as_range=False):
@@ -434,6 +677,8 @@ class ExcelCompiler:
 
         elif address not in self.cell_map:
             address = AddressRange.create(address).address
+            if not AddressRange(address).is_range:
+                self._build_constant_cell(address)
             assert address in self.cell_map, (
                 f'Address "{address}" not found in the cell map. Evaluate the '
                 'address, or an address that references it, to place it in the cell map.')
@@ -449,22 +694,445 @@ class ExcelCompiler:
             cell_or_range.value = value
 
             # reset the node + its dependencies
-            if not self.cycles:
+            if self.topological and not self.cycles:
+                self._dirty_cells.add(cell_or_range)
+            elif not self.cycles:
                 self._reset(cell_or_range)
 
             # set the value
             cell_or_range.value = value
 
     def _reset(self, cell):
-        if cell.needs_calc:
+        # the cell may have been set to None, still reset its dependents
+        start, to_reset = cell, [cell]
+        while to_reset:
+            cell = to_reset.pop()
+            if cell.needs_calc and cell is not start:
+                continue
+            self.log.info(f"Resetting {cell.address}")
+            cell.value = None
+
+            if cell in self.dep_graph:
+                to_reset.extend(child_cell for child_cell in self.dep_graph.successors(cell)
+                                if child_cell.value is not None)
+
+    def recalculate_dirty(self):
+        """Recalculate the dependents of the cells changed by `set_value`
+
+        The dependents are recalculated in topological order.  If a
+        recalculated value is unchanged, the cells which depend on it are
+        not recalculated.  Cells which have not yet been evaluated are left
+        to be evaluated when needed.
+
+        Cells are only marked dirty with `topological=True` (or `vectorize`)
+        and without cycles.  Otherwise `set_value` resets the dependents,
+        which are recalculated when evaluated, and this logs a warning.
+        """
+        if not self.topological or self.cycles:
+            self.log.warning(
+                'recalculate_dirty() does nothing without topological=True, '
+                'or with cycles, the dependents were reset by set_value()')
             return
-        self.log.info(f"Resetting {cell.address}")
-        cell.value = None
+        dirty_cells, self._dirty_cells = self._dirty_cells, set()
+        self._recalculate_dependents(dirty_cells)
 
-        if cell in self.dep_graph:
-            for child_cell in self.dep_graph.successors(cell):
-                if child_cell.value is not None:
-                    self._reset(child_cell)
+    def recalculate_volatile(self):
+        """Recalculate the cells calling volatile functions, and their dependents
+
+        Volatile functions, eg: NOW() and OFFSET(), are marked by
+        `excel_helper(volatile=True)`.  Only the cells which have been
+        evaluated are recalculated.  The dependents of a volatile cell are
+        recalculated only if its value changed.
+        """
+        volatile = [cell for cell in self._volatile_cells
+                    if cell.value is not None]
+        if not volatile:
+            return
+
+        if self.cycles:
+            # with cycles, evaluate recalculates all of the needed cells
+            needed = set(volatile).union(self.dep_graph.descendants(*volatile))
+            self.evaluate(tuple(cell.address.address for cell in needed
+                                if cell.value is not None))
+            return
+
+        changed = set()
+        for cell in volatile:
+            old_value = cell.value
+            cell.value = None
+            value = self._evaluate(cell.address.address)
+            if value != old_value or type(value) is not type(old_value):
+                changed.add(cell)
+        self._recalculate_dependents(changed)
+
+    def _recalculate_dependents(self, dirty_cells):
+        """Recalculate the dependents of changed cells, in topological order"""
+        dirty_nodes = [cell for cell in dirty_cells if cell in self.dep_graph]
+        if not dirty_nodes:
+            return
+
+        dependents = self.dep_graph.descendants(*dirty_nodes)
+        try:
+            order = tuple(self.dep_graph.topological_sort(dependents))
+        except CycleError:
+            # circular reference, fall back to resetting the dependents
+            self._reset_dirty(dirty_cells)
+            return
+
+        if self.vectorize:
+            order = self._order_with_runs(order)
+
+        def needs_recalc(cell):
+            return cell.value is not None and any(
+                precedent in changed
+                for precedent in self.dep_graph.predecessors(cell))
+
+        changed = dirty_cells
+        for step in order:
+            cells = step.cells if isinstance(step, _VectorRun) else (step, )
+            cells = [cell for cell in cells if needs_recalc(cell)]
+            if not cells:
+                continue
+
+            old_values = [cell.value for cell in cells]
+            for cell in cells:
+                cell.value = None
+            if isinstance(step, _VectorRun):
+                self._evaluate_vector_run(step, cells)
+            else:
+                self._evaluate(step.address.address)
+
+            for cell, old_value in zip(cells, old_values):
+                value = cell.value
+                if value != old_value or type(value) is not type(old_value):
+                    changed.add(cell)
+
+    def _reset_dirty(self, dirty_cells):
+        """Reset the dependents of dirty cells, for lazy recalculation"""
+        for cell in dirty_cells:
+            value = cell.value
+            self._reset(cell)
+            cell.value = value
+
+    def evaluate_batch(self, inputs, outputs):
+        """ Evaluate the outputs for many sets of input values at once
+
+        The input values are carried through the graph as NumPy arrays.
+        Formulas which can not be evaluated as arrays, and elements which
+        do not evaluate to a finite number, are evaluated one scenario
+        at a time with the scalar evaluator.  With cycles, all of the
+        scenarios are evaluated with the scalar evaluator.  The values in
+        the cell map are left unchanged.
+
+        :param inputs: dict of cell address to a 1d array of values.  All
+            arrays must be the same length, one element per scenario.
+        :param outputs: cell addresses to evaluate
+        :return: dict of output address to a 1d array of values
+        """
+        inputs = {self._cell_address(addr): np.asarray(values)
+                  for addr, values in inputs.items()}
+        sizes = {values.shape for values in inputs.values()}
+        if len(sizes) != 1 or len(next(iter(sizes))) != 1:
+            raise ValueError(
+                'evaluate_batch() inputs must be 1d arrays of the same length')
+        size = len(next(iter(inputs.values())))
+        output_addrs = {addr: self._cell_address(addr) for addr in outputs}
+
+        # evaluate the base scenario, which also builds the graph
+        self.evaluate(tuple(output_addrs.values()))
+        for addr in inputs:
+            self._build_constant_cell(addr)
+
+        if self.cycles:
+            return self._evaluate_scenarios(inputs, output_addrs, size)
+
+        batch = {self.cell_map[addr]: values
+                 for addr, values in inputs.items() if addr in self.cell_map}
+        dependents = self.dep_graph.descendants(
+            *(cell for cell in batch if cell in self.dep_graph))
+        outputs = [self.cell_map[addr] for addr in output_addrs.values()]
+        needed = self.dep_graph.ancestors(
+            *(cell for cell in outputs if cell in self.dep_graph))
+        needed.update(outputs)
+        dependents &= needed
+        dependents.difference_update(batch)
+
+        for cell in self.dep_graph.topological_sort(dependents):
+            batch[cell] = self._evaluate_vector(cell, batch, size)
+
+        results = {}
+        for addr, address in output_addrs.items():
+            cell = self.cell_map[address]
+            if cell in batch:
+                results[addr] = batch[cell]
+            else:
+                results[addr] = to_vector((cell.value, ) * size)
+        return results
+
+    def _evaluate_scenarios(self, inputs, output_addrs, size):
+        """Evaluate the outputs one scenario at a time, eg: with cycles"""
+        addresses = tuple(output_addrs.values())
+        saved = [(addr, self.cell_map[addr].value) for addr in inputs]
+        scenarios = []
+        try:
+            for i in range(size):
+                for addr, values in inputs.items():
+                    value = values[i]
+                    self.set_value(addr, value.item() if isinstance(
+                        value, np.generic) else value)
+                scenarios.append(self.evaluate(addresses))
+        finally:
+            for addr, value in saved:
+                self.set_value(addr, value)
+            self.evaluate(addresses)
+
+        return {addr: to_vector([values[i] for values in scenarios])
+                for i, addr in enumerate(output_addrs)}
+
+    def _evaluate_vector(self, cell, batch, size):
+        """Evaluate a cell for each scenario, as arrays when possible"""
+        values = None
+        indices = range(size)
+        if isinstance(cell, _Cell) and not cell.address.is_unbounded_range and (
+                cell.python_code):
+            try:
+                vector_lambda = build_vector_lambda(cell.python_code)
+
+                def resolve_cell(addr):
+                    precedent = self.cell_map.get(addr)
+                    if precedent in batch:
+                        return batch[precedent]
+                    return self._evaluate(addr)
+
+                result = vector_lambda(resolve_cell)
+                if not isinstance(result, np.ndarray):
+                    result = np.asarray(result)
+                if result.dtype.kind not in 'biuf':
+                    raise NotVectorizable(f'Result of {result.dtype}')
+                result = np.broadcast_to(result, (size, ))
+            except NotVectorizable as exc:
+                self.log.debug(f"Not vectorized: {cell.address}: {exc}")
+            else:
+                mask = finite_mask(result)
+                if mask.all():
+                    return result
+                values = result.tolist()
+                indices = np.flatnonzero(~mask)
+
+        if values is None:
+            values = [None] * size
+
+        # evaluate the remaining scenarios one at a time
+        precedents = [precedent for precedent in self.dep_graph.predecessors(cell)
+                      if precedent in batch]
+        saved = [(c, c.value) for c in precedents + [cell]]
+        try:
+            for i in indices:
+                for precedent in precedents:
+                    value = batch[precedent][i]
+                    precedent.value = value.item() if isinstance(
+                        value, np.generic) else value
+                cell.value = None
+                values[i] = self._evaluate(cell.address.address)
+        finally:
+            for c, value in saved:
+                c.value = value
+        return to_vector(values)
+
+    def _cell_address(self, addr):
+        """Address str for a cell, on the active sheet if no sheet given"""
+        address = AddressCell(addr)
+        if not address.has_sheet:
+            address = AddressCell(
+                address, sheet=self.excel.get_active_sheet_name())
+        return address.address
+
+    def export_python_module(self, path, inputs, outputs,
+                             function_name='evaluate'):
+        """ Write a python module which calculates the outputs from the inputs
+
+        The module has a single function whose arguments are the inputs, and
+        which returns a tuple of the outputs.  Each needed cell is computed
+        once, as a local variable, in topological order.  Cells which do not
+        depend on the inputs are computed the same way, and cells without
+        formulas are inlined as constants.  Only the lib functions which are
+        used are loaded.
+
+        Dynamic references (OFFSET, INDIRECT) and CSE array formulas can not
+        be exported.  Use `trim_graph` first to trim the cells which are not
+        needed.
+
+        :param path: filename for the python module
+        :param inputs: cell addresses, which become the function arguments
+        :param outputs: cell addresses, which the function returns
+        :param function_name: name of the function in the module
+        """
+        inputs = tuple(self._cell_address(addr) for addr in inputs)
+        outputs = tuple(self._cell_address(addr) for addr in outputs)
+        self._gen_graph(tuple(AddressRange(addr) for addr in outputs))
+
+        local_names = {}
+        constants = {}
+        formulas = {}
+
+        def local_name(address):
+            if address not in local_names:
+                name = re.sub(r'\W+', '_', address).strip('_')
+                if not name.isidentifier() or name in local_names.values():
+                    name = f'cell_{len(local_names)}'
+                local_names[address] = name
+            return local_names[address]
+
+        def precedents(address):
+            """The addresses needed to compute an address"""
+            if address in inputs:
+                local_name(address)
+                return ()
+
+            if address not in self.cell_map:
+                self._gen_graph(address)
+            cell = self.cell_map[address]
+
+            if isinstance(cell, _CellRange):
+                if cell.formula:
+                    raise NotImplementedError(
+                        f'{address}: CSE array formulas can not be exported')
+                return tuple(addr.address for addr in flatten(cell.addresses))
+
+            elif cell.python_code:
+                if cell.address.is_range:
+                    # unbounded range, use the bounded range
+                    bounded_address = cell.formula.needed_addresses[0].address
+                    local_names[address] = local_name(bounded_address)
+                    return (bounded_address, )
+
+                tree = ast.parse(cell.python_code, mode='eval')
+                formulas[address] = tree
+                static_refs = set()
+                needed = []
+                for node in ast.walk(tree):
+                    func = getattr(getattr(node, 'func', None), 'id', None)
+                    if func in ('row', 'column'):
+                        static_refs.update(node.args)
+                    elif func in ('offset', 'indirect') or (
+                            func == '_REF_' and node not in static_refs):
+                        raise NotImplementedError(
+                            f'{address}: dynamic references can not be '
+                            f'exported: {cell.formula}')
+                    elif func in ('_C_', '_R_'):
+                        needed.append(node.args[0].s)
+                return tuple(needed)
+
+            else:
+                value = cell.value
+                if isinstance(value, np.generic):
+                    value = value.item()
+                constants[address] = repr(value)
+                return ()
+
+        # depth first search from the outputs for the needed cells
+        order = []
+        visited = {}
+        to_visit = [(address, False) for address in reversed(outputs)]
+        while to_visit:
+            address, expanded = to_visit.pop()
+            if expanded:
+                visited[address] = True
+                order.append(address)
+            elif address not in visited:
+                visited[address] = False
+                to_visit.append((address, True))
+                to_visit.extend((addr, False)
+                                for addr in reversed(precedents(address))
+                                if not visited.get(addr))
+            elif not visited[address]:
+                raise ValueError(
+                    f'{address}: circular references can not be exported')
+
+        unexported = set()
+
+        def reference(address):
+            if address in constants:
+                return ast.parse(constants[address], mode='eval').body
+            if address not in visited and address not in inputs:
+                unexported.add(address)
+            return ast.Name(id=local_name(address), ctx=ast.Load())
+
+        class ReferenceBinder(ast.NodeTransformer):
+            """Replace cell and range references with locals or constants"""
+
+            def visit_Call(self, node):
+                if getattr(node.func, 'id', None) in ('_C_', '_R_'):
+                    return reference(node.args[0].s)
+                return ast.NodeTransformer.generic_visit(self, node)
+
+        operator_wrapper = OperatorWrapper()
+        body = []
+        for address in order:
+            cell = self.cell_map.get(address)
+            if address in formulas:
+                tree = ReferenceBinder().visit(formulas[address])
+                tree = ast.fix_missing_locations(operator_wrapper.visit(tree))
+                body.append(f'    {local_name(address)} = '
+                            f'_cell_value({python_code_from_ast(tree)})')
+
+            elif isinstance(cell, _CellRange) and address not in inputs:
+                rows = ', '.join(python_code_from_ast(ast.Tuple(
+                    elts=[reference(addr.address) for addr in row],
+                    ctx=ast.Load())) for row in cell.addresses)
+                body.append(f'    {local_name(address)} = ({rows},)')
+
+        if unexported:
+            raise ValueError('References to cells which were not exported: ' +
+                             ', '.join(sorted(unexported)))
+
+        # find the modules which implement the needed functions
+        function_names = operator_wrapper.names - set(local_names.values()) - {
+            'excel_operator_operand_fixup', 'pi', '_REF_'}
+        plugins = self._plugin_modules or ()
+        if isinstance(plugins, str):
+            plugins = (plugins, )
+        modules = {}
+        for name in sorted(function_names):
+            module_name = next((
+                module_name for module_name in
+                tuple(plugins) + ExcelFormula.default_modules
+                if hasattr(importlib.import_module(module_name), name)), None)
+            if module_name is None:
+                raise UnknownFunction(
+                    f'Function {name.upper()} is not implemented. ' +
+                    func_status_msg(name)[1])
+            modules[name] = module_name
+        module_names = tuple(
+            module_name
+            for module_name in tuple(plugins) + ExcelFormula.default_modules
+            if module_name in modules.values())
+
+        arguments = ', '.join(local_name(address) for address in inputs)
+        returns = ''.join(f'{reference(address).id}, '
+                          if address not in constants else
+                          f'{constants[address]}, ' for address in outputs)
+        source = PYTHON_MODULE_TEMPLATE.format(
+            filename=os.path.basename(self.filename or ''),
+            function_name=function_name,
+            arguments_doc='\n'.join(
+                f'    {local_name(address)}: {address}' for address in inputs),
+            returns_doc='\n'.join(f'    {address}' for address in outputs),
+            imports=''.join(f'import {module_name}\n'
+                            for module_name in sorted(module_names)
+                            if module_name != 'math'),
+            inputs=inputs,
+            outputs=outputs,
+            function_names=tuple(sorted(function_names)),
+            modules=''.join(f'{module_name}, ' for module_name in module_names),
+            functions=''.join(f"{name} = _name_space['{name}']\n"
+                              for name in sorted(function_names)),
+            arguments=arguments,
+            body='\n'.join(body),
+            returns=returns.strip(),
+        )
+        with open(path, 'w') as f:
+            f.write(source)
 
     def value_tree_str(self, address, indent=0):
         iterative_eval_tracker.inc_iteration_number()
@@ -486,20 +1154,35 @@ class ExcelCompiler:
 
     def recalculate(self):
         """Recalculate all of the known cells"""
+        self._dirty_cells = set()
         for cell in self.cell_map.values():
             if isinstance(cell, _CellRange) or cell.formula:
                 cell.value = None
 
-        for cell in self.cell_map.values():
+        if self.topological and not self.cycles:
+            self._evaluate_in_order(None)
+
+        for cell in tuple(self.cell_map.values()):
             self.evaluate(cell.address.address)
 
-    def trim_graph(self, input_addrs, output_addrs):
-        """Remove unneeded cells from the graph"""
+    def trim_graph(self, input_addrs, output_addrs, freeze=False):
+        """ Remove unneeded cells from the graph
+
+        :param input_addrs: addresses of the cells which may be changed
+        :param output_addrs: addresses of the cells which will be evaluated
+        :param freeze: if True, the formulas which do not depend on the
+            inputs are evaluated and replaced with their values, and the
+            params of IF(), CHOOSE() and friends which are not needed,
+            given those values, are dropped from the other formulas
+        """
         input_addrs = tuple(AddressRange(addr).address for addr in input_addrs)
         output_addrs = tuple(AddressRange(addr) for addr in output_addrs)
 
         # 1) build graph for all needed outputs
         self._gen_graph(output_addrs)
+        for addr in input_addrs:
+            if not AddressRange(addr).is_range:
+                self._build_constant_cell(addr)
 
         # 2) walk the dependant tree (from the inputs) and find needed cells
         needed_cells = set()
@@ -520,7 +1203,7 @@ class ExcelCompiler:
                     msg = ''
                 else:
                     msg = 'warning', f'Address {addr} not found in cell_map'
-            except nx.exception.NetworkXError as exc:
+            except NodeNotFound as exc:
                 if AddressRange(addr) not in output_addrs:
                     msg = 'error', f'{exc}: which usually means no outputs are dependant on it.'
                 else:
@@ -535,10 +1218,28 @@ class ExcelCompiler:
             raise ValueError('\n' + '\n'.join(
                 map(str, sorted(missing_dependants, key=lambda x: x[2]))))
 
+        # the cells which depend on the inputs, the others are constant
+        variable_cells = needed_cells | {
+            addr.address for addr in flatten(
+                AddressRange(addr).resolve_range for addr in input_addrs)}
+
         # even unconnected output addresses are needed
         for addr in output_addrs:
             needed_cells.add(addr.address)
 
+        simplified = ()
+        if freeze:
+            simplified = self._eliminate_dead_branches(
+                tuple(self.cell_map[addr] for addr in needed_cells
+                      if addr in variable_cells), variable_cells)
+
+            for addr in output_addrs:
+                cell = self.cell_map[addr.address]
+                if addr.address not in variable_cells and not isinstance(
+                        cell, _CellRange) and cell.formula:
+                    self._evaluate(addr.address)
+                    cell.formula = None
+
         # 3) walk the precedent tree (from the output) and trim unneeded cells
         processed_cells = set()
 
@@ -548,10 +1249,15 @@ class ExcelCompiler:
                     processed_cells.add(child_address)
                     child_cell = self.cell_map[child_address]
                     if child_address in needed_cells or ':' in child_address:
+                        if isinstance(child_cell, _ConstantBlockRange):
+                            # keep the range, which has the constants
+                            needed_cells.add(child_address)
                         walk_precedents(child_cell)
                     else:
                         # trim this cell, now we will need only its value
                         needed_cells.add(child_address)
+                        if freeze:
+                            self._evaluate(child_address)
                         child_cell.formula = None
                         self.log.debug(f'Trimming {child_address}')
 
@@ -565,10 +1271,152 @@ class ExcelCompiler:
                 self.log.info(f"{addr} is not a leaf node")
 
         # 5) remove unneeded cells
+        if freeze:
+            # the dropped params may leave cells not needed for the outputs
+            needed_cells &= processed_cells | {
+                addr.address for addr in output_addrs}
         cells_to_remove = tuple(addr for addr in self.cell_map
                                 if addr not in needed_cells)
         for addr in cells_to_remove:
             del self.cell_map[addr]
+        self.dep_graph = self.dep_graph.subgraph(
+            cell for cell in self.cell_map.values() if cell in self.dep_graph)
+        if simplified:
+            # the edges from the params which were dropped
+            self.dep_graph.remove_edges(
+                (precedent, cell) for cell in simplified
+                if cell in self.dep_graph
+                for precedent in tuple(self.dep_graph.predecessors(cell))
+                if precedent.address.address not in {
+                    addr.address for addr in cell.needed_addresses})
+        self._constants = self._constants.subset(
+            cell for cell in self._constants.all_ranges()
+            if self.cell_map.get(cell.address.address) is cell)
+        self._volatile_cells = {
+            cell for cell in self._volatile_cells
+            if self.cell_map.get(cell.address.address) is cell and
+            cell.formula and self._is_volatile(cell)}
+        self._topological_orders.clear()
+        self._vector_orders.clear()
+
+    def _eliminate_dead_branches(self, cells, variable_cells):
+        """ Drop the params of IF() and friends which are not needed
+
+        :param cells: the cells with the formulas to simplify
+        :param variable_cells: addresses of the cells which are not constant
+        :return: tuple of the cells which were simplified
+        """
+        def constant_value(address):
+            if address in variable_cells or address not in self.cell_map:
+                raise KeyError(address)
+            return self._evaluate(address)
+
+        eliminator = DeadBranchEliminator(constant_value, self._plugin_modules)
+        simplified = []
+        for cell in cells:
+            if isinstance(cell, _CellRange) or cell.address.is_range or (
+                    not cell.python_code):
+                continue
+            eliminated = eliminator.eliminated
+            tree = eliminator.visit(ast.parse(cell.python_code, mode='eval'))
+            if eliminator.eliminated != eliminated:
+                cell.formula = ExcelFormula(
+                    '=' + python_code_from_ast(tree), cell=cell,
+                    formula_is_python_code=True)
+                simplified.append(cell)
+                self.log.debug(f'Simplified {cell.address}: {cell.formula}')
+        return tuple(simplified)
+
+    def hoist_subexpressions(self, min_count=2):
+        """ Evaluate the calls repeated across formulas once per recalculation
+
+        The calls of SUMIFS(), VLOOKUP() and friends which are repeated with
+        the same params in the formulas of the cells in the graph are moved
+        into cells on `subexpression_sheet`, which the formulas then refer to.
+        These cells are not saved by `to_file`, unless it is asked to.
+
+        :param min_count: the number of times a call must be repeated
+        :return: dict of the address of each cell added to its python code
+        """
+        prefix = self.subexpression_sheet + '!'
+        cells, subexpression_cells = [], []
+        for addr, cell in self.cell_map.items():
+            if isinstance(cell, _Cell) and addr == cell.address.address and (
+                    not cell.address.is_range and cell.python_code):
+                (subexpression_cells if addr.startswith(prefix)
+                 else cells).append(cell)
+
+        def parse(cell):
+            return ast.parse(self._expand_subexpressions(cell.python_code),
+                             mode='eval').body
+
+        finder = CommonSubexpressions(
+            volatile_names(ExcelFormula.lib_modules(self._plugin_modules)))
+        trees = {cell: parse(cell) for cell in cells}
+        subexpressions = {python_code_from_ast(parse(cell)): cell.address.address
+                          for cell in subexpression_cells}
+        row = max((cell.address.row for cell in subexpression_cells), default=0)
+        added = {}
+        for python_code in sorted(
+                finder.repeated(tuple(trees.values()), min_count) -
+                set(subexpressions), key=lambda code: (len(code), code)):
+            row += 1
+            subexpressions[python_code] = f'{prefix}A{row}'
+            added[subexpressions[python_code]] = None
+        references = {
+            python_code: ast.parse(f'_C_({address!r})', mode='eval').body
+            for python_code, address in subexpressions.items()}
+
+        changed = []
+        for python_code, address in subexpressions.items():
+            python_code = python_code_from_ast(finder.replace(
+                ast.parse(python_code, mode='eval').body, references,
+                root=False))
+            if address in added:
+                self.cell_map[address] = self.Cell(
+                    address, formula='=' + python_code)
+                added[address] = python_code
+                self.graph_todos.append(self.cell_map[address])
+            elif python_code != self.cell_map[address].python_code:
+                changed.append((self.cell_map[address], python_code))
+        for cell, tree in trees.items():
+            replaced = finder.replaced
+            tree = finder.replace(tree, references)
+            if finder.replaced != replaced:
+                python_code = python_code_from_ast(tree)
+                if python_code != cell.python_code:
+                    changed.append((cell, python_code))
+
+        for cell, python_code in changed:
+            cell.formula = ExcelFormula(
+                '=' + python_code, cell=cell, formula_is_python_code=True)
+            self.graph_todos.append(cell)
+        self._process_gen_graph()
+
+        # the edges from the calls which were moved
+        self.dep_graph.remove_edges(
+            (precedent, cell) for cell, _ in changed
+            for precedent in tuple(self.dep_graph.predecessors(cell))
+            if precedent.address.address not in {
+                addr.address for addr in cell.needed_addresses})
+        self._topological_orders.clear()
+        self._vector_orders.clear()
+
+        # the evaluated formulas need the values they refer to, for resets
+        for address in added:
+            if any(cell.value is not None for cell in
+                   self.dep_graph.successors(self.cell_map[address])):
+                self._evaluate(address)
+        return added
+
+    def _expand_subexpressions(self, python_code):
+        """The python code with the cells of `hoist_subexpressions` inlined"""
+        def expand(match):
+            return self._expand_subexpressions(
+                self.cell_map[match.group(2)].python_code)
+
+        return re.sub(r"""_C_\((['"])({}![A-Z]+\d+)\1\)""".format(
+            re.escape(self.subexpression_sheet)), expand, python_code)
 
     def validate_serialized(self, **kwargs):
         assert self.excel, "validate_serialized() needs to be run on the compiler"
@@ -700,6 +1548,33 @@ class ExcelCompiler:
 
         return self._formula_cells_dict[sheet]
 
+    def dynamic_references(self):
+        """ Report the OFFSET() and INDIRECT() calls in the compiled formulas
+
+        Calls whose arguments are all constant are resolved to static
+        references when the formula is compiled.  The rest are evaluated,
+        and their references followed, at runtime.
+
+        :return: `DynamicReferences` with the number of calls resolved, and
+            a tuple of the addresses of the cells with runtime calls
+        """
+        resolved = 0
+        runtime = []
+        for address, cell in self.cell_map.items():
+            formula = getattr(cell, 'formula', None)
+            if not formula:
+                continue
+            calls = sum(name in DYNAMIC_FUNCTIONS
+                        for name in _called_functions(formula.python_code))
+            if formula.base_formula:
+                resolved += sum(
+                    isinstance(node, FunctionNode) and
+                    node.value.lower().strip('(') in DYNAMIC_FUNCTIONS
+                    for node in formula.rpn) - calls
+            if calls:
+                runtime.append(address)
+        return DynamicReferences(resolved, tuple(sorted(runtime)))
+
     def _make_cells(self, address):
         """Given an AddressRange or AddressCell generate compiler Cells"""
 
@@ -708,8 +1583,6 @@ class ExcelCompiler:
 
         def add_node_to_graph(node):
             self.dep_graph.add_node(node)
-            self.dep_graph.nodes[node]['sheet'] = node.sheet
-            self.dep_graph.nodes[node]['label'] = node.address.coordinate
 
             # stick in queue to add edges
             self.graph_todos.append(node)
@@ -720,7 +1593,74 @@ class ExcelCompiler:
             self.cell_map[str(excel_cell.address)] = a_cell
             return [a_cell]
 
+        def build_block_range(excel_range):
+            a_range = _ConstantBlockRange(excel_range, excel=self.excel)
+            self.cell_map[str(excel_range.address)] = a_range
+
+            added = [a_range]
+            sheet = excel_range.address.sheet
+            first_col, first_row = (
+                excel_range.address.col_idx, excel_range.address.row)
+            columns = [list(values) for values in zip(*excel_range.values)]
+            for col_offset, formulas in enumerate(zip(*excel_range.formula)):
+                prefix = f'{sheet}!{get_column_letter(first_col + col_offset)}'
+                for row_offset, formula in enumerate(formulas):
+                    address = f'{prefix}{first_row + row_offset}'
+                    a_cell = self.cell_map.get(address)
+                    if a_cell is None and formula:
+                        a_cell = self.Cell(
+                            address, columns[col_offset][row_offset],
+                            formula, self.excel)
+                        self.cell_map[address] = a_cell
+                        added.append(a_cell)
+                    if a_cell is not None:
+                        a_range.cells.append(a_cell)
+                        columns[col_offset][row_offset] = None
+            self._constants.add(a_range, columns)
+            return added
+
+        def build_sparse_range(excel_range):
+            a_range = _SparseRange(excel_range, excel=self.excel)
+            self.cell_map[str(excel_range.address)] = a_range
+
+            added = [a_range]
+            address = excel_range.address
+            for offset, formula in excel_range.formula.items():
+                addr = AddressCell(
+                    (address.col_idx + offset[1], address.row + offset[0]) * 2,
+                    sheet=address.sheet)
+                a_cell = self.cell_map.get(addr.address)
+                if a_cell is None and formula:
+                    a_cell = self.Cell(
+                        addr, excel_range.values[offset], formula, self.excel)
+                    self.cell_map[addr.address] = a_cell
+                    added.append(a_cell)
+                if a_cell is None:
+                    a_range.constants[offset] = excel_range.values[offset]
+
+            # the cells in the range which are already built, populated or not
+            first_row, last_row = address.start.row, address.end.row
+            first_col, last_col = address.start.col_idx, address.end.col_idx
+            a_range.cells.extend(
+                a_cell for a_cell in self.cell_map.values()
+                if isinstance(a_cell, _Cell) and
+                a_cell.address.sheet == address.sheet and
+                not a_cell.address.is_range and
+                first_row <= a_cell.address.row <= last_row and
+                first_col <= a_cell.address.col_idx <= last_col)
+            self._constants.add_sparse(a_range)
+            return added
+
         def build_range(excel_range):
+            if isinstance(excel_range, ExcelOpxWrapper.SparseRangeData):
+                return build_sparse_range(excel_range)
+
+            if (isinstance(excel_range.formula, tuple) and
+                    excel_range.address.size.height *
+                    excel_range.address.size.width >=
+                    self.constant_block_min_size):
+                return build_block_range(excel_range)
+
             a_range = _CellRange(excel_range, excel=self.excel)
             self.cell_map[str(excel_range.address)] = a_range
 
@@ -738,14 +1678,20 @@ class ExcelCompiler:
             return added
 
         self.log.debug(f'_make_cells: {address}')
-        excel_data = self.excel.get_range(address)
+        if not address.is_range and self._build_constant_cell(address):
+            return
+
+        excel_data = address.is_range and self.excel.get_sparse_range(
+            address) or self.excel.get_range(address)
         if address.is_range:
             if excel_data.address != address:
                 # if the actual data returned is not the same as the address
-                # given, then use a reference
-                self.cell_map[str(address)] = self.Cell(
+                # given, then use a reference, which depends on the range
+                ref_cell = self.Cell(
                     address, formula=REF_FORMAT.format(excel_data.address),
                     excel=self.excel)
+                self.cell_map[str(address)] = ref_cell
+                add_node_to_graph(ref_cell)
 
             self.range_todos.append(str(excel_data.address))
             new_nodes = build_range(excel_data)
@@ -778,20 +1724,75 @@ class ExcelCompiler:
                     self._evaluate_range(bounded_addr)
                 data = bounded_addr_cell.value
 
+            elif isinstance(cell_range, _SparseRange):
+                data = self._sparse_range_value(cell_range)
+
+            elif isinstance(cell_range, _ConstantBlockRange):
+                data = self._block_range_value(cell_range)
+
             elif cell_range.formula is None:
-                data = tuple(
+                data = RangeValue(
                     tuple(self._evaluate(addr.address) for addr in row)
                     for row in cell_range.addresses
                 )
             else:
                 # CSE Array Formula
                 data = self.eval(cell_range, cell_range.address)
-            self.log.info(f"Range {cell_range.address} evaluated to '{data}'")
+            # lazy formatting, the value of a large range is slow to format
+            self.log.info("Range %s evaluated to '%s'", cell_range.address, data)
 
             cell_range.value = data
 
         return cell_range.value
 
+    def _block_range_value(self, cell_range):
+        """The value of a range, from its constants and its cells"""
+        columns = self._constants.values(cell_range.address)
+        first_col, first_row = cell_range.address.col_idx, cell_range.address.row
+        for cell in cell_range.cells:
+            columns[cell.address.col_idx - first_col][
+                cell.address.row - first_row] = self._evaluate(cell.address.address)
+        return RangeValue(zip(*columns))
+
+    def _sparse_range_value(self, cell_range):
+        """The value of a sparse range, from its constants and its cells"""
+        values = dict(cell_range.constants)
+        first_col, first_row = cell_range.address.col_idx, cell_range.address.row
+        for cell in cell_range.cells:
+            offset = (cell.address.row - first_row,
+                      cell.address.col_idx - first_col)
+            value = self._evaluate(cell.address.address)
+            if value is None:
+                values.pop(offset, None)
+            else:
+                values[offset] = value
+        return RangeValue.from_sparse(cell_range.address.size, values)
+
+    def _build_constant_cell(self, address):
+        """ Build a cell for a constant kept in the blocks of large ranges
+
+        The cell becomes a precedent of the ranges, so a `set_value` to
+        the cell resets them.
+
+        :return: the new cell, or None if the address is not in a block,
+            or already has a cell
+        """
+        address = AddressCell(address)
+        block_ranges = self._constants.ranges_containing(address)
+        if not block_ranges or address.address in self.cell_map:
+            return None
+
+        self.log.debug(f'Building {address} from a block')
+        a_cell = self.Cell(address, value=self._constants.value(address),
+                           excel=self.excel)
+        self.cell_map[address.address] = a_cell
+        for block_range in block_ranges:
+            block_range.cells.append(a_cell)
+            self.dep_graph.add_edge(a_cell, block_range)
+        self._topological_orders.clear()
+        self._vector_orders.clear()
+        return a_cell
+
     def _evaluate(self, address):
         """Evaluate a single cell"""
         if address not in self.cell_map:
@@ -823,7 +1824,7 @@ class ExcelCompiler:
                         # INDIRECT() can produce addresses we don't already have loaded
                         self._gen_graph(ref_addr)
 
-                    value = self.cell_map[ref_addr].value
+                    value = self._evaluate(ref_addr)
                 else:
                     self.log.info(
                         f"Cell {cell.address} evaluated to '{value}' ({type(value).__name__})")
@@ -832,13 +1833,227 @@ class ExcelCompiler:
 
         return cell.value
 
-    def _evaluate_non_iterative(self, address):
+    def _topological_order(self, address):
+        """ The cells needed to evaluate an address, each after its precedents
+
+        The order is computed once per address and cached until the graph
+        changes.  If the cells form a cycle, no order exists and an empty
+        order is returned, leaving the work to the recursive evaluator.
+
+        :param address: address str, or None for the entire graph
+        :return: tuple of `_Cell` and `_CellRange`
+        """
+        order = self._topological_orders.get(address)
+        if order is None:
+            if address is None:
+                needed = None
+            else:
+                cell = self.cell_map[address]
+                if cell in self.dep_graph:
+                    needed = self.dep_graph.ancestors(cell)
+                    needed.add(cell)
+                else:
+                    needed = ()
+
+            try:
+                order = tuple(self.dep_graph.topological_sort(needed))
+            except CycleError:
+                order = ()
+            self._topological_orders[address] = order
+        return order
+
+    def _evaluate_in_order(self, address):
+        """ Evaluate the cells needed for an address, in topological order
+
+        :param address: address str, or None for the entire graph
+        """
+        if self.vectorize:
+            order = self._vector_order(address)
+        else:
+            order = self._topological_order(address)
+
+        for cell in order:
+            if isinstance(cell, _VectorRun):
+                self._evaluate_vector_run(cell)
+            elif cell.needs_calc:
+                self._evaluate(cell.address.address)
+
+    def _vector_order(self, address):
+        """ The topological order, with each run of copied formulas as one
+
+        :param address: address str, or None for the entire graph
+        :return: tuple of `_Cell`, `_CellRange` and `_VectorRun`
+        """
+        order = self._vector_orders.get(address)
+        if order is None:
+            order = self._order_with_runs(self._topological_order(address))
+            self._vector_orders[address] = order
+        return order
+
+    def _vector_runs(self, cells):
+        """ Find the runs of a formula copied down a column
+
+        :param cells: cells in topological order
+        :return: dict of cell to its `_VectorRun`
+        """
+        copies = collections.defaultdict(list)
+        for cell in cells:
+            if isinstance(cell, _Cell) and isinstance(
+                    cell.address, AddressCell) and cell.python_code:
+                template = cell.formula.code_template[0]
+                copies[cell.sheet, cell.address.col_idx, template].append(cell)
+
+        vector_lambdas = {}
+        runs = {}
+        for (sheet, col_idx, template), copied in copies.items():
+            copied.sort(key=lambda c: c.address.row)
+            run = []
+            for cell in copied + [None]:
+                if cell is not None and run and (
+                        cell.address.row == run[-1].address.row + 1):
+                    run.append(cell)
+                    continue
+
+                # a cell which refers to another copy is not part of a run
+                members = set(run)
+                if len(run) >= _VectorRun.min_length and not any(
+                        precedent in members for member in run
+                        for precedent in self.dep_graph.predecessors(member)):
+                    if template not in vector_lambdas:
+                        try:
+                            vector_lambdas[template] = _VectorRun.build_lambda(
+                                run[0].python_code)
+                        except NotVectorizable as exc:
+                            self.log.debug(
+                                f"Not vectorized: {run[0].address}: {exc}")
+                            vector_lambdas[template] = None
+                    if vector_lambdas[template] is not None:
+                        vector_run = _VectorRun(run, *vector_lambdas[template])
+                        runs.update((member, vector_run) for member in run)
+                run = [cell]
+        return runs
+
+    def _order_with_runs(self, cells):
+        """ Topological order of cells, with each run in place of its cells
+
+        :param cells: cells in topological order
+        :return: tuple of `_Cell`, `_CellRange` and `_VectorRun`
+        """
+        runs = self._vector_runs(cells)
+        while True:
+            steps = {cell: runs.get(cell, cell) for cell in cells}
+            successors = {step: {} for step in steps.values()}
+            num_predecessors = collections.Counter()
+            for cell, step in steps.items():
+                for precedent in self.dep_graph.predecessors(cell):
+                    precedent_step = steps.get(precedent, step)
+                    if precedent_step is not step and (
+                            step not in successors[precedent_step]):
+                        successors[precedent_step][step] = None
+                        num_predecessors[step] += 1
+
+            ready = collections.deque(
+                s for s in successors if not num_predecessors[s])
+            order = []
+            while ready:
+                order.append(ready.popleft())
+                for successor in successors[order[-1]]:
+                    num_predecessors[successor] -= 1
+                    if not num_predecessors[successor]:
+                        ready.append(successor)
+
+            if len(order) == len(successors):
+                return tuple(order)
+
+            # runs in a cycle through other cells, expand them into cells
+            ordered = set(order)
+            runs = {cell: run for cell, run in runs.items() if run in ordered}
+
+    def _evaluate_vector_run(self, run, cells=None):
+        """ Evaluate cells of a run as NumPy arrays
+
+        The cells whose precedents are not all numbers, or which do not
+        evaluate to a finite number, are evaluated by the scalar evaluator.
+
+        :param run: `_VectorRun`
+        :param cells: cells of the run to evaluate, default those which
+            need calc
+        """
+        if cells is None:
+            selected = [cell.needs_calc for cell in run.cells]
+        else:
+            cells = set(cells)
+            selected = [cell in cells for cell in run.cells]
+        cells = list(it.compress(run.cells, selected))
+        if not cells:
+            return
+
+        if run.references is None:
+            # for each address, the cell referenced by every copy
+            addresses = [cell.formula.code_template[1] for cell in run.cells]
+            for address in set(it.chain.from_iterable(addresses)):
+                if address not in self.cell_map:
+                    self._gen_graph(address)
+            run.references = [
+                tuple(self.cell_map[address] for address in column)
+                for column in zip(*addresses)]
+
+        not_vectorized = np.zeros(len(cells), dtype=bool)
+        columns = {}
+
+        def value(cell):
+            if cell.needs_calc:
+                return self._evaluate(cell.address.address)
+            return cell.value
+
+        def resolve_cell(addr):
+            if addr not in columns:
+                references = run.references[run.addresses.index(addr)]
+                if references.count(references[0]) == len(references):
+                    columns[addr] = value(references[0])
+                else:
+                    columns[addr] = _VectorRun.to_vector(
+                        [value(cell) for cell in
+                         it.compress(references, selected)],
+                        not_vectorized)
+            return columns[addr]
+
+        try:
+            result = np.asarray(run.vector_lambda(resolve_cell))
+            if result.dtype.kind not in 'biuf':
+                raise NotVectorizable(f'Result of {result.dtype}')
+            result = np.broadcast_to(result, (len(cells), ))
+            not_vectorized |= ~finite_mask(result)
+        except NotVectorizable as exc:
+            self.log.debug(f"Not vectorized: {run.cells[0].address}: {exc}")
+            not_vectorized[:] = True
+            result = None
+
+        for i, cell in enumerate(cells):
+            if not not_vectorized[i]:
+                cell.value = result[i].item()
+        for cell in it.compress(cells, not_vectorized):
+            self._evaluate(cell.address.address)
+
+    def _evaluate_non_iterative(self, address, recalculate_dirty=True):
         """ evaluate a cell or cells in the spreadsheet
 
         :param address: str, AddressRange, AddressCell or a tuple or list
             or iterable of these three
+        :param recalculate_dirty: If cells have been changed by `set_value`,
+            recalculate their dependents with `recalculate_dirty` first.
+            Otherwise reset the dependents and recalculate only as needed.
+            Only with `topological=True`, otherwise `set_value` has already
+            reset the dependents.
         :return: evaluated value/values
         """
+        if self._dirty_cells:
+            if recalculate_dirty:
+                self.recalculate_dirty()
+            else:
+                dirty_cells, self._dirty_cells = self._dirty_cells, set()
+                self._reset_dirty(dirty_cells)
+
         if str(address) not in self.cell_map:
             if list_like(address):
                 if not isinstance(address, (tuple, list)):
@@ -858,6 +2073,11 @@ class ExcelCompiler:
             if address.address not in self.cell_map:
                 self._gen_graph(address)
 
+        if self.topological and not self.cycles and self.cell_map[str(address)].needs_calc:
+            self._evaluate_in_order(str(address))
+        elif self.cycles and self.cell_map[str(address)].needs_calc:
+            self._evaluate_components(str(address))
+
         result = self._evaluate(str(address))
         if isinstance(result, tuple):
             # trim excess dimensions
@@ -886,12 +2106,260 @@ class ExcelCompiler:
         iterations = iterations or self.cycles['iterations'] or 10000
         tolerance = tolerance or self.cycles['tolerance'] or 0.01
 
-        progress_tracker = iterative_eval_tracker(iterations, tolerance)
+        # start afresh, as set_value does not reset the cells with cycles
+        iterative_eval_tracker(iterations, tolerance).inc_iteration_number()
+        return self._evaluate_non_iterative(address)
+
+    def _component_order(self, address):
+        """ The strongly connected components of the cells for an address
+
+        The components are found once per address, and cached with the
+        topological orders, which are not used with cycles, until the graph
+        changes.
+
+        :param address: address str
+        :return: tuple of (cells, entries) for each component, each after
+            the components of its precedents.  `entries` is None if the
+            component is not a cycle, else the cells of the cycle needed by
+            cells outside of it, or the cell of the address itself.
+        """
+        order = self._topological_orders.get(address)
+        if order is None:
+            cell = self.cell_map[address]
+            order = []
+            if cell in self.dep_graph:
+                needed = self.dep_graph.ancestors(cell)
+                needed.add(cell)
+                for component in self.dep_graph.strongly_connected_components(
+                        needed):
+                    entries = None
+                    if len(component) > 1 or self.dep_graph.has_edge(
+                            component[0], component[0]):
+                        members = set(component)
+                        entries = [
+                            member for member in component
+                            if member is cell or any(
+                                dependent in needed and dependent not in members
+                                for dependent in self.dep_graph.successors(member))]
+                    order.append((component, entries))
+            self._topological_orders[address] = order = tuple(order)
+        return order
+
+    def _evaluate_components(self, address):
+        """ Evaluate the cells needed for an address, iterating only the cycles
+
+        The cells which are not in a cycle are evaluated once, in topological
+        order.  Each cycle is then iterated on its own, until none of its
+        cells changes by more than the tolerance, or for the number of
+        iterations, before the cells which depend on it are evaluated.
+
+        :param address: address str
+        """
         while True:
-            progress_tracker.inc_iteration_number()
-            results = self._evaluate_non_iterative(address)
-            if progress_tracker.done:
-                return results
+            for cells, entries in self._component_order(address):
+                if entries is None:
+                    cell = cells[0]
+                    if isinstance(cell, _CellRange) and (
+                            not iterative_eval_tracker.is_calced(cell)):
+                        # ranges are recalculated once per evaluation
+                        iterative_eval_tracker.calced(cell)
+                        cell.value = None
+                    self._evaluate(cell.address.address)
+
+                elif any(cell.needs_calc for cell in cells):
+                    self._iterate_cycle(cells, entries)
+
+            if address in self._topological_orders:
+                return
+
+            # INDIRECT() or OFFSET() added to the graph, evaluate what is new
+
+    def _iterate_cycle(self, cells, entries):
+        """ Iterate one cycle, until it converges or for the iterations
+
+        Each iteration evaluates the entries of the cycle, which evaluate
+        the rest of the cycle recursively.  With `gauss_seidel` the cells
+        are instead evaluated one by one, each after as many of its
+        precedents as possible, and the cells not yet evaluated provide
+        their value from the previous iteration.  The accelerations then
+        extrapolate the values of the cycle from its iterations.
+
+        :param cells: the cells of the cycle
+        :param entries: the cells of the cycle needed outside of it
+        """
+        method = self.cycles.get('method', 'fixed_point')
+        if method == 'gauss_seidel':
+            sweep = self._gauss_seidel_order(cells, entries)
+        else:
+            sweep = entries
+        accelerator = _CycleAccelerator(method)
+        value_cells = [cell for cell in cells if not isinstance(cell, _CellRange)]
+
+        for iteration in iterative_eval_tracker.iterate(cells):
+            for cell in cells:
+                if isinstance(cell, _CellRange):
+                    cell.value = None
+            previous = [cell.value for cell in value_cells]
+
+            if method == 'gauss_seidel':
+                for cell in value_cells:
+                    iterative_eval_tracker.calced(cell)
+                for cell in sweep:
+                    if isinstance(cell, _CellRange):
+                        cell.value = None
+                    else:
+                        iterative_eval_tracker.uncalced(cell)
+                    self._evaluate(cell.address.address)
+            else:
+                for entry in sweep:
+                    self._evaluate(entry.address.address)
+
+                # and the cells not needed by the values selected, eg: by IF()
+                for cell in value_cells:
+                    if not iterative_eval_tracker.is_calced(cell):
+                        self._evaluate(cell.address.address)
+
+            latest = [cell.value for cell in value_cells]
+            if not iterative_eval_tracker.done:
+                if method == 'linear':
+                    values = iteration == 1 and self._solve_linear_cycle(
+                        cells, value_cells) or None
+                else:
+                    values = accelerator.extrapolate(previous, latest)
+                if values is not None:
+                    for cell, value in zip(value_cells, values):
+                        cell.extrapolate(value)
+
+        convergence = CycleConvergence(
+            iteration, accelerator.residual(previous, latest),
+            iterative_eval_tracker.converged)
+        first = min(value_cells, key=lambda cell: (
+            cell.address.sheet, cell.address.row, cell.address.col_idx))
+        converged = self.cycle_convergence.get(first.address.address)
+        if not (iteration == 1 and convergence.converged and
+                converged and converged.converged):
+            # a converged cycle is confirmed by one iteration, keep the
+            # iterations which converged it
+            self.cycle_convergence[first.address.address] = convergence
+        self.log.info("Cycle at %s: %s", first.address, convergence)
+
+    def _solve_linear_cycle(self, cells, value_cells):
+        """ Solve a cycle in one step, if its formulas are affine in its cells
+
+        The formulas are evaluated with the cells of the cycle held at their
+        values, and then with each cell moved in turn, evaluating only its
+        dependents, to find the matrix of the cycle.  The solution is
+        checked against the formulas, so the cycles which are not linear
+        are left to the iterations.
+
+        :param cells: the cells of the cycle
+        :param value_cells: the cells of the cycle which are not ranges
+        :return: list of the values solving the cycle, or None
+        """
+        latest = [cell.value for cell in value_cells]
+        if not all(map(_CycleAccelerator._is_number, latest)):
+            return None
+
+        index = {cell: i for i, cell in enumerate(value_cells)}
+        ranges = {cell for cell in cells if isinstance(cell, _CellRange)}
+
+        def held(values, to_evaluate):
+            """The formulas of cells, with the cycle held at the values"""
+            for cell, value in zip(value_cells, values):
+                cell.extrapolate(value)
+                iterative_eval_tracker.calced(cell)
+            for a_range in ranges:
+                a_range.value = None
+            evaluated = []
+            for cell in to_evaluate:
+                iterative_eval_tracker.uncalced(cell)
+                evaluated.append(self._evaluate(cell.address.address))
+                cell.extrapolate(values[index[cell]])
+            if all(map(_CycleAccelerator._is_number, evaluated)):
+                return np.array(evaluated, dtype=float)
+
+        def dependents(cell):
+            """The cells of the cycle using a cell, directly or by ranges"""
+            found, todo = set(), [cell]
+            while todo:
+                for dependent in self.dep_graph.successors(todo.pop()):
+                    if dependent in index:
+                        found.add(dependent)
+                    elif dependent in ranges:
+                        todo.append(dependent)
+            return list(found)
+
+        try:
+            x = np.array(latest, dtype=float)
+            base = held(x, value_cells)
+            if base is None:
+                return None
+
+            matrix = np.zeros((len(x), len(x)))
+            for i, cell in enumerate(value_cells):
+                using = dependents(cell)
+                rows = [index[dependent] for dependent in using]
+                step = max(abs(x[i]), 1.0)
+                moved = x.copy()
+                moved[i] += step
+                probe = held(moved, using)
+                if probe is None:
+                    return None
+                matrix[rows, i] = (probe - base[rows]) / step
+
+            with np.errstate(all='ignore'):
+                solved = np.linalg.solve(
+                    np.eye(len(x)) - matrix, base - matrix @ x)
+            if not np.isfinite(solved).all():
+                return None
+
+            check = held(solved, value_cells)
+            if check is None or np.abs(check - solved).max() >= (
+                    iterative_eval_tracker.tolerance):
+                return None
+            return solved.tolist()
+
+        except np.linalg.LinAlgError:
+            return None
+
+        finally:
+            held(latest, ())
+
+    def _gauss_seidel_order(self, cells, entries):
+        """ The cells of a cycle, each after as many of its precedents as
+        possible, by a depth first search from the entries
+
+        :param cells: the cells of the cycle
+        :param entries: the cells of the cycle needed outside of it
+        :return: list of the cells
+        """
+        members = set(cells)
+        order = []
+        seen = set(entries)
+        for entry in entries:
+            stack = [(entry, self.dep_graph.predecessors(entry))]
+            while stack:
+                cell, precedents = stack[-1]
+                for precedent in precedents:
+                    if precedent in members and precedent not in seen:
+                        seen.add(precedent)
+                        stack.append(
+                            (precedent, self.dep_graph.predecessors(precedent)))
+                        break
+                else:
+                    stack.pop()
+                    order.append(cell)
+        return order
+
+    def _is_volatile(self, cell):
+        """Does the formula of the cell call a volatile function"""
+        if not cell.formula:
+            return False
+        if self._volatile_names is None:
+            self._volatile_names = volatile_names(
+                ExcelFormula.lib_modules(self._plugin_modules))
+        return not self._volatile_names.isdisjoint(
+            _called_functions(cell.formula.python_code))
 
     def _gen_graph(self, seed, recursed=False):
         """Given a starting point (e.g., A6, or A3:B7) on a particular sheet,
@@ -929,11 +2397,18 @@ class ExcelCompiler:
 
     def _process_gen_graph(self):
 
+        if self.graph_todos:
+            # new nodes and edges invalidate the evaluation orders
+            self._topological_orders.clear()
+            self._vector_orders.clear()
+
         while self.graph_todos:
             # connect the dependant cells in the graph
             dependant = self.graph_todos.pop()
 
             self.log.debug(f"Handling {dependant.address}")
+            if self._is_volatile(dependant):
+                self._volatile_cells.add(dependant)
 
             for precedent_address in dependant.needed_addresses:
                 if precedent_address.address not in self.cell_map:
@@ -942,16 +2417,21 @@ class ExcelCompiler:
                 self.dep_graph.add_edge(
                     self.cell_map[precedent_address.address], dependant)
 
-        # calc the values for ranges
+        # calc the values for ranges, after their precedents if topological.
+        # With cycles the ranges are evaluated with their components.
         try:
             for range_todo in reversed(self.range_todos):
+                if self.cycles:
+                    break
+                if self.topological:
+                    self._evaluate_in_order(range_todo)
                 self._evaluate_range(range_todo)
         finally:
             self.range_todos = []
 
         self.log.info(
-            f"Graph construction done, {len(self.dep_graph.nodes())} nodes, "
-            f"{len(self.dep_graph.edges())} edges, "
+            f"Graph construction done, {self.dep_graph.number_of_nodes()} nodes, "
+            f"{self.dep_graph.number_of_edges()} edges, "
             f"{len(self.cell_map)} self.cell_map entries"
         )
 
@@ -1010,7 +2490,7 @@ class ExcelCompiler:
 
 class _CellBase:
 
-    value = None
+    __slots__ = ('formula', 'excel', 'address', 'value')
 
     def __init__(self, address=None, formula='', excel=None):
         formula_is_python_code = excel is None or isinstance(
@@ -1024,6 +2504,14 @@ class _CellBase:
         self.excel = excel
         self.address = AddressRange(address)
 
+    def __getstate__(self):
+        state = slots_getstate(self)
+        state['excel'] = None
+        return state
+
+    def __setstate__(self, state):
+        slots_setstate(self, state)
+
     @property
     def sheet(self):
         return self.address.sheet
@@ -1048,9 +2536,52 @@ class _CellBase:
             return self.value == value
 
 
+class _VectorRun:
+    """Copies of a formula, in consecutive rows of a column"""
+
+    # runs shorter than this are left to the scalar evaluator
+    min_length = 4
+
+    def __init__(self, cells, vector_lambda, addresses):
+        self.cells = tuple(cells)
+        self.vector_lambda = vector_lambda
+        self.addresses = addresses
+        self.references = None
+
+    @staticmethod
+    def build_lambda(python_code):
+        """ Vector lambda for the python code of a copy of the formula
+
+        :return: vector lambda, addresses in the python code
+        """
+        return (build_vector_lambda(python_code),
+                python_code_template(python_code)[1])
+
+    @staticmethod
+    def to_vector(values, not_vectorized):
+        """ Array of the values of a referenced cell, for each copy
+
+        Empty cells are zero.  A copy which references a value that is not
+        a number is flagged in `not_vectorized`.
+        """
+        if all(isinstance(value, bool) for value in values):
+            return np.array(values, dtype=bool)
+
+        vector = np.zeros(len(values))
+        for i, value in enumerate(values):
+            if isinstance(value, Number) and not isinstance(
+                    value, (bool, complex)):
+                vector[i] = value
+            elif value is not None:
+                not_vectorized[i] = True
+        return vector
+
+
 class _CellRange(_CellBase):
     # TODO: only supports rectangular ranges
 
+    __slots__ = ('_addresses', 'size')
+
     def __init__(self, data, excel=None):
         formula = None
         if data.formula and isinstance(data.formula, str):
@@ -1062,20 +2593,27 @@ class _CellRange(_CellBase):
         if not self.address.sheet:
             raise ValueError(f"Must pass in a sheet: {self.address}")
 
-        self.addresses = data.address.resolve_range
+        self._addresses = None
         self.size = data.address.size
         self.value = None
 
-    def __getstate__(self):
-        state = dict(self.__dict__)
-        state['excel'] = None
-        return state
+    def __setstate__(self, state):
+        # the addresses are rebuilt when needed
+        self._addresses = None
+        super().__setstate__(state)
 
     def __repr__(self):
         return str(self.address)
 
     __str__ = __repr__
 
+    @property
+    def addresses(self):
+        """The AddressCell of each cell, as a tuple of rows"""
+        if self._addresses is None:
+            self._addresses = self.address.resolve_range
+        return self._addresses
+
     def __iter__(self):
         return flatten(self.addresses)
 
@@ -1097,7 +2635,177 @@ class _CellRange(_CellBase):
         )
 
 
+class _ConstantBlockRange(_CellRange):
+    """Range whose constant cells are kept in `_ConstantColumns`
+
+    Only the cells in the range which have a formula, or which are also
+    referenced on their own, are built as a `_Cell`.  These are the
+    `cells` of the range, and are its precedents in the graph.
+    """
+
+    __slots__ = ('cells', )
+
+    def __init__(self, data, excel=None):
+        super().__init__(data, excel=excel)
+        self.cells = []
+
+    @property
+    def needed_addresses(self):
+        return tuple(cell.address for cell in self.cells)
+
+
+class _SparseRange(_ConstantBlockRange):
+    """Unbounded or sparse range, with only its populated constants
+
+    The constants are a dict of the (row, column) offset in the range to
+    the value, and the value of the range is a sparse `RangeValue`.
+    """
+
+    __slots__ = ('constants', )
+
+    def __init__(self, data, excel=None):
+        super().__init__(data, excel=excel)
+        self.constants = {}
+
+
+class _ConstantColumns:
+    """The constant cells of large ranges, stored by sheet and column
+
+    The values of a column are kept as blocks of consecutive rows, each a
+    list of values, in a list sorted by the first row of the block.  The
+    blocks of overlapping ranges are merged.  Cells in the blocks which
+    are built as a `_Cell` are placeholders, the `_Cell` has the value.
+    """
+
+    def __init__(self):
+        # (sheet, col_idx) -> [[first_row, values], ...]
+        self.columns = {}
+
+        # the ranges whose constants are in the columns
+        self.ranges = []
+
+        # the sparse ranges, which keep their own constants
+        self.sparse_ranges = []
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.__dict__.setdefault('sparse_ranges', [])
+
+    def __len__(self):
+        return sum(len(values) for blocks in self.columns.values()
+                   for _, values in blocks)
+
+    def add(self, a_range, columns):
+        """Add the values of each column in the range"""
+        address = a_range.address
+        for col_idx, values in enumerate(columns, start=address.col_idx):
+            self._add_block(address.sheet, col_idx, address.row, list(values))
+        self.ranges.append(a_range)
+
+    def add_sparse(self, a_range):
+        """Add a sparse range, which has its constants"""
+        self.sparse_ranges.append(a_range)
+
+    def _add_block(self, sheet, col_idx, first_row, values):
+        last_row = first_row + len(values) - 1
+        blocks = []
+        for block in self.columns.get((sheet, col_idx), ()):
+            block_first, block_values = block
+            block_last = block_first + len(block_values) - 1
+            if block_last + 1 < first_row or last_row + 1 < block_first:
+                blocks.append(block)
+            else:
+                # merge the overlapping or adjacent block
+                merged_first = min(first_row, block_first)
+                merged = [None] * (
+                    max(last_row, block_last) - merged_first + 1)
+                merged[block_first - merged_first:
+                       block_last - merged_first + 1] = block_values
+                merged[first_row - merged_first:
+                       last_row - merged_first + 1] = values
+                first_row, values = merged_first, merged
+                last_row = first_row + len(values) - 1
+        blocks.append([first_row, values])
+        self.columns[sheet, col_idx] = sorted(blocks, key=lambda b: b[0])
+
+    def _block(self, sheet, col_idx, row):
+        for first_row, values in self.columns.get((sheet, col_idx), ()):
+            if first_row <= row < first_row + len(values):
+                return first_row, values
+        raise KeyError(f'{sheet}!{col_idx},{row} is not in a block')
+
+    def values(self, address):
+        """The values of a range address, as a list per column"""
+        first_row, last_row = address.start.row, address.end.row
+        columns = []
+        for col_idx in range(address.start.col_idx, address.end.col_idx + 1):
+            block_first, values = self._block(address.sheet, col_idx, first_row)
+            columns.append(values[first_row - block_first:
+                                  last_row - block_first + 1])
+        return columns
+
+    def _sparse_ranges_containing(self, address):
+        return [a_range for a_range in self.sparse_ranges
+                if a_range.address.sheet == address.sheet and
+                address in a_range.address]
+
+    def value(self, address):
+        """The value of a cell address"""
+        try:
+            first_row, values = self._block(
+                address.sheet, address.col_idx, address.row)
+            return values[address.row - first_row]
+        except KeyError:
+            for a_range in self._sparse_ranges_containing(address):
+                offset = (address.row - a_range.address.row,
+                          address.col_idx - a_range.address.col_idx)
+                return a_range.constants.get(offset)
+            raise
+
+    def ranges_containing(self, address):
+        """The ranges which contain a cell address"""
+        ranges = self._sparse_ranges_containing(address)
+        try:
+            self._block(address.sheet, address.col_idx, address.row)
+        except KeyError:
+            return ranges
+        return [a_range for a_range in self.ranges
+                if a_range.address.sheet == address.sheet and
+                address in a_range.address] + ranges
+
+    def all_ranges(self):
+        return self.ranges + self.sparse_ranges
+
+    def items(self, a_range):
+        """(address str, value) for each constant of a range"""
+        address = a_range.address
+        if isinstance(a_range, _SparseRange):
+            for (row, col), value in a_range.constants.items():
+                yield AddressCell((address.col_idx + col, address.row + row,
+                                   address.col_idx + col, address.row + row),
+                                  sheet=address.sheet).address, value
+            return
+
+        for col_idx, values in enumerate(
+                self.values(address), start=address.start.col_idx):
+            prefix = f'{address.sheet}!{get_column_letter(col_idx)}'
+            for row, value in enumerate(values, start=address.start.row):
+                yield f'{prefix}{row}', value
+
+    def subset(self, ranges):
+        """A copy of the columns with only these ranges"""
+        constants = _ConstantColumns()
+        for a_range in ranges:
+            if isinstance(a_range, _SparseRange):
+                constants.add_sparse(a_range)
+            else:
+                constants.add(a_range, self.values(a_range.address))
+        return constants
+
+
 class _Cell(_CellBase):
+    __slots__ = ('id', )
+
     ctr = 0
     serialize = True
 
@@ -1114,11 +2822,6 @@ class _Cell(_CellBase):
         # every cell has a unique id
         self.id = _Cell.next_id()
 
-    def __getstate__(self):
-        state = dict(self.__dict__)
-        state['excel'] = None
-        return state
-
     def __repr__(self):
         return f"{self.address} -> {self.formula or self.value}"
 
@@ -1135,27 +2838,30 @@ class _CycleCell(_Cell):
     For non iterative (non-cyclic) excel sheets we use reset() (set value
     to None), then calc anything that is None.  But for iterative (cyclic)
     excel sheets the inputs to a cell could potentially change anytime, so
-    we need to calc everything all the time.
+    each evaluation recalculates the cells it needs.
 
-    While it would be possible to break things done further to cyclic and
-    non-cyclic sections of the graph, and then only iterate on the cyclic
-    sections, implemented here is a simpler algorithm:
+    The needed cells are broken into strongly connected components (see
+    `ExcelCompiler._evaluate_components`).  The cells not in a cycle are
+    evaluated once.  Each cycle is iterated on its own, with:
 
-    1. Start at the top of eval tree (cell to evaluate)
+    1. Start at the entry of the cycle (the cell needed outside of it)
     2. Mark the cell in question as being a work in progress (WIP)
     3. Eval (ie: calc the lambda for) the cell.  The will cause other
        cells to be evaluated
     4. If the value of a  cell that is WIP is needed, then we have a loop.
        Use the previous value, and do not descend any farther on the tree.
     5. After evaluating a cell, check if the value changed by more that
-       the allowed tolerance, if so note the cell as needing more evals
+       the allowed tolerance, if so note the cycle as needing more evals
     """
 
+    __slots__ = ('_value', '_prev_value', 'wip')
+
     def __init__(self, *args, **kwargs):
         self._value = None
         self._prev_value = None
-        self.wip = False
+        self.wip = None  # while being built
         super().__init__(*args, **kwargs)
+        self.wip = False
 
     @property
     def value(self):
@@ -1166,6 +2872,11 @@ class _CycleCell(_Cell):
 
     @value.setter
     def value(self, a_value):
+        if self.wip is None:
+            # the value the cell is built with is not a calculation
+            self._value = a_value
+            return
+
         iterative_eval_tracker.calced(self)
         self.wip = False
         self._value = a_value
@@ -1181,6 +2892,106 @@ class _CycleCell(_Cell):
     def needs_calc(self):
         return not self.wip and not iterative_eval_tracker.is_calced(self)
 
+    def extrapolate(self, a_value):
+        """Replace the value of the latest iteration, to converge faster"""
+        self._value = a_value
+
+
+class _CycleAccelerator:
+    """Extrapolate the values of a cycle from its iterations
+
+    Only the cells which are numbers before and after an iteration are
+    extrapolated, the others keep the value of the iteration.
+    """
+
+    # iterations used by the anderson acceleration
+    anderson_depth = 5
+
+    def __init__(self, method):
+        self.method = method
+        self.history = []
+        self.numbers = None
+
+    @staticmethod
+    def _is_number(value):
+        return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+    @classmethod
+    def residual(cls, previous, latest):
+        """The largest change of a number in an iteration"""
+        return max((abs(b - a) for a, b in zip(previous, latest)
+                    if cls._is_number(a) and cls._is_number(b)), default=0.0)
+
+    def extrapolate(self, previous, latest):
+        """ The values of the cycle for the next iteration
+
+        :param previous: values of the cells before the iteration
+        :param latest: values of the cells after the iteration
+        :return: list of the values, or None to keep the latest values
+        """
+        extrapolator = getattr(self, f'_{self.method}', None)
+        if extrapolator is None:
+            return None
+
+        numbers = tuple(i for i, (a, b) in enumerate(zip(previous, latest))
+                        if self._is_number(a) and self._is_number(b))
+        if numbers != self.numbers:
+            # start again if different cells are numbers
+            self.numbers = numbers
+            self.history.clear()
+        if not numbers:
+            return None
+
+        x = np.array([previous[i] for i in numbers], dtype=float)
+        g = np.array([latest[i] for i in numbers], dtype=float)
+        with np.errstate(all='ignore'):
+            extrapolated = extrapolator(x, g)
+        if extrapolated is None:
+            return None
+
+        values = list(latest)
+        for i, value, fallback in zip(numbers, extrapolated.tolist(), g.tolist()):
+            values[i] = value if math.isfinite(value) else fallback
+        return values
+
+    def _aitken(self, x, g):
+        """Aitken's delta-squared, from every second pair of iterations"""
+        if not self.history:
+            self.history.append((x, g))
+            return None
+        x0, x1 = self.history.pop()
+        delta = g - x1
+        denominator = delta - (x1 - x0)
+        return np.where(denominator != 0,
+                        g - delta * delta / np.where(denominator, denominator, 1),
+                        g)
+
+    def _secant(self, x, g):
+        """The secant of the residual of each cell, from its last two values"""
+        residual = g - x
+        self.history.append((x, residual))
+        if len(self.history) < 2:
+            return None
+        (x0, residual0), _ = self.history
+        del self.history[0]
+        denominator = residual - residual0
+        return np.where(
+            denominator != 0,
+            x - residual * (x - x0) / np.where(denominator, denominator, 1),
+            g)
+
+    def _anderson(self, x, g):
+        """Anderson acceleration, from the last `anderson_depth` iterations"""
+        self.history.append((x, g))
+        if len(self.history) < 2:
+            return None
+        del self.history[:-self.anderson_depth - 1]
+        xs, gs = (np.array(values).T for values in zip(*self.history))
+        residuals = gs - xs
+        gamma = np.linalg.lstsq(
+            np.diff(residuals), residuals[:, -1], rcond=None)[0]
+        return g - np.diff(gs) @ gamma
+
 
 class _CompiledImporter:
     """Emulate the excel_wrapper for serialized files"""
@@ -1191,6 +3002,7 @@ class _CompiledImporter:
             'filename', filename.rsplit('.', maxsplit=1)[0])
         self.cell_map = file_data['cell_map']
         self.compiler = None
+        self._sheet_cells = None
 
     def get_range(self, address):
         cell = self._get_cell(address)
@@ -1215,9 +3027,51 @@ class _CompiledImporter:
 
             cells = [[self._get_cell(addr) for addr in row]
                      for row in addresses]
-            values = [[c.values for c in row] for row in cells]
+            formulas = tuple(tuple(c.formula for c in row) for row in cells)
+            values = tuple(tuple(c.values for c in row) for row in cells)
+
+            return ExcelOpxWrapper.RangeData(address, formulas, values)
+
+    def get_sparse_range(self, address):
+        """The populated cells of an unbounded, or a large and sparse, range"""
+        if address.is_unbounded_range:
+            formula = self._get_cell(address).formula
+            assert formula.startswith(REF_START)
+            assert formula.endswith(REF_END)
+            address = AddressRange(formula[len(REF_START):-len(REF_END)])
+
+        elif address.size.height * address.size.width < (
+                ExcelOpxWrapper.sparse_min_size) or (
+                self._get_cell(address).formula):
+            # small, or a CSE Array Formula
+            return None
 
-            return ExcelOpxWrapper.RangeData(address, None, values)
+        if self._sheet_cells is None:
+            # index the cells of the file by sheet
+            self._sheet_cells = {}
+            for addr in self.cell_map:
+                addr = AddressRange(addr)
+                if not addr.is_range:
+                    self._sheet_cells.setdefault(addr.sheet, []).append(addr)
+
+        first_row, last_row = address.start.row, address.end.row
+        first_col, last_col = address.start.col_idx, address.end.col_idx
+        formulas, values = {}, {}
+        for addr in self._sheet_cells.get(address.sheet, ()):
+            if first_row <= addr.row <= last_row and (
+                    first_col <= addr.col_idx <= last_col):
+                cell = self._get_cell(addr)
+                if cell.formula or cell.values is not None and (
+                        not isinstance(cell.values, _Cell)):
+                    offset = addr.row - first_row, addr.col_idx - first_col
+                    formulas[offset] = cell.formula
+                    values[offset] = cell.values
+
+        if len(values) > ExcelOpxWrapper.sparse_max_density * (
+                address.size.height * address.size.width):
+            return None
+        return ExcelOpxWrapper.SparseRangeData(
+            address, formulas, dict(sorted(values.items())))
 
     def _get_cell(self, address):
         cell_value = self.cell_map.get(str(address))
@@ -8,18 +8,25 @@
 #   https://www.gnu.org/licenses/gpl-3.0.en.html
 
 import ast
+import copy
 import importlib
 import logging
 import marshal
 import math
+import re
 import sys
 import tokenize as tk
+import weakref
+from types import CodeType
 
 import openpyxl.formula.tokenizer as tokenizer
 from networkx.classes.digraph import DiGraph
 from networkx.exception import NetworkXError
+from openpyxl.formula.translate import Translator
+from openpyxl.utils import column_index_from_string
 
 from pycel.excelutil import (
+    AddressCell,
     AddressMultiAreaRange,
     AddressRange,
     build_operator_operand_fixup,
@@ -27,16 +34,33 @@ from pycel.excelutil import (
     EMPTY,
     ERROR_CODES,
     in_array_formula_context,
+    MAX_COL,
+    MAX_ROW,
     NAME_ERROR,
     PyCelException,
+    slots_getstate,
+    slots_setstate,
     uniqueify,
 )
-from pycel.lib.function_helpers import load_functions
+from pycel.lib.function_helpers import FUNC_META, load_functions
 from pycel.lib.function_info import func_status_msg
 
 
 ADDR_FUNCS_NAMES = '_R_', '_C_', '_REF_'
 
+# a call of an address function with a constant address, split() on this
+# gives: [code, func, address, code, func, address, ..., code]
+ADDRESS_LITERAL_RE = re.compile(r'(?<![\w.])(_R_|_C_|_REF_)\("([^"\\]*)"\)')
+TEMPLATE_PARAM_RE = re.compile(r'_[AS]\d+_$')
+
+A1_REFERENCE_RE = re.compile(
+    r'^(?P<sheet>.+!)?(?:'
+    r'\$?[A-Z]{1,3}\$?[0-9]+(?::\$?[A-Z]{1,3}\$?[0-9]+)?|'
+    r'\$?[A-Z]{1,3}:\$?[A-Z]{1,3}|'
+    r'\$?[0-9]+:\$?[0-9]+)$', re.IGNORECASE)
+
+A1_PART_RE = re.compile(r'(\$?)([A-Z]*)(\$?)([0-9]*)$', re.IGNORECASE)
+
 
 class FormulaParserError(PyCelException):
     """Error during parsing"""
@@ -406,6 +430,17 @@ class FunctionNode(ASTNode):
         "xor": "xor_",
     }
 
+    # functions whose params, from this index on, are evaluated only if
+    # needed, see `lazy_wrapper`
+    lazy_funcs = {
+        "choose": 1,
+        "if": 1,
+        "iferror": 1,
+        "ifna": 1,
+        "ifs": 1,
+        "switch": 1,
+    }
+
     def __init__(self, *args):
         super(FunctionNode, self).__init__(*args)
         self.num_args = 0
@@ -432,10 +467,25 @@ class FunctionNode(ASTNode):
         handler = getattr(self, f'func_{func}', None)
         if handler is not None:
             return handler()
+        elif func in self.lazy_funcs:
+            return f"{self.func_map.get(func, func)}(" \
+                   f"{self._lazy_emit(self.lazy_funcs[func])})"
         else:
             # map to the correct name
             return f"{self.func_map.get(func, func)}({self.comma_join_emit()})"
 
+    def _lazy_emit(self, lazy_from):
+        """Emit the params, those which may not be needed as lambdas"""
+        def emit(i, node):
+            code = node.emit
+            if i >= lazy_from and (not isinstance(node, OperandNode) or (
+                    isinstance(node, RangeNode) and
+                    ADDRESS_LITERAL_RE.fullmatch(code))):
+                return f'lambda: {code}'
+            return code
+
+        return ', '.join(emit(i, node) for i, node in enumerate(self.children))
+
     @staticmethod
     def func_pi():
         # constant, no parens
@@ -476,16 +526,59 @@ class FunctionNode(ASTNode):
         return f'column({self._build_reference})'
 
     def func_offset(self):
+        resolved = self._resolved_offset()
+        if resolved is not None:
+            return resolved
         to_emit = self.comma_join_emit().split(')', 1)[1]
         return f'offset({self._build_reference}{to_emit})'
 
     def func_indirect(self):
+        resolved = self._resolved_indirect()
+        if resolved is not None:
+            return resolved
         to_emit = list(c.emit for c in self.children)
         if len(to_emit) == 1:
             to_emit.append('True')
         to_emit.append(f'"{self.cell.sheet}"')
         return f'indirect({", ".join(to_emit)})'
 
+    def _resolved_offset(self):
+        """ Static reference for OFFSET() of a reference by constants, or None
+        """
+        children = self.children
+        if not 3 <= len(children) <= 5 or not isinstance(
+                children[0], RangeNode):
+            return None
+        match = ADDRESS_LITERAL_RE.fullmatch(children[0].emit)
+        args = _literal_values(children[1:])
+        if match is None or args is None:
+            return None
+
+        args += (None, ) * (4 - len(args))
+        if not all(_is_whole_number(arg) for arg in args[:2]) or not all(
+                arg is None or _is_whole_number(arg) and arg >= 1
+                for arg in args[2:]):
+            return None
+        reference = AddressRange.create(match.group(2))
+        if not reference.has_sheet:
+            return None
+        from pycel.lib.lookup import offset
+        return _emit_reference(offset(reference, *args))
+
+    def _resolved_indirect(self):
+        """ Static reference for INDIRECT() of constant text, or None """
+        args = _literal_values(self.children)
+        if args is None or not 1 <= len(args) <= 2 or not isinstance(
+                args[0], str) or args[0] in ERROR_CODES or not (
+                len(args) == 1 or isinstance(args[1], (int, float)) and args[1]):
+            return None
+        from pycel.lib.lookup import indirect
+        address = indirect(args[0], sheet=self.cell and self.cell.sheet or '')
+        if isinstance(address, (AddressCell, AddressRange)) and (
+                not address.has_sheet):
+            return None
+        return _emit_reference(address)
+
     SUBTOTAL_FUNCS = {
         1: 'average',
         2: 'count',
@@ -519,6 +612,687 @@ class FunctionNode(ASTNode):
         return f'{func}({to_emit})'
 
 
+def _literal_values(nodes):
+    """ The values of nodes which are literals, or operators of literals
+
+    The operators are evaluated with the same fixup as at runtime.
+
+    :param nodes: `ASTNode`s, eg: the arguments of a function
+    :return: tuple of the values, or None if any node is not constant
+    """
+    values = []
+    for node in nodes:
+        if isinstance(node, RangeNode) or not isinstance(
+                node, (OperandNode, OperatorNode)):
+            return None
+        try:
+            operator_wrapper = OperatorWrapper()
+            tree = operator_wrapper.visit(ast.parse(node.emit, mode='eval'))
+        except Exception:
+            return None
+        if operator_wrapper.names:
+            return None
+        code = compile(ast.fix_missing_locations(tree), '', 'eval')
+        values.append(eval(code, dict(
+            excel_operator_operand_fixup=_literal_operand_fixup)))
+    return tuple(values)
+
+
+def _is_whole_number(value):
+    return isinstance(value, (int, float)) and not isinstance(
+        value, bool) and float(value).is_integer()
+
+
+def _emit_reference(address):
+    """Python code for a reference, or an error, resolved at compile time"""
+    if isinstance(address, (AddressCell, AddressRange)):
+        template = '_R_("{}")' if address.is_range else '_C_("{}")'
+        return template.format(address)
+    return f'"{address}"'
+
+
+_literal_operand_fixup = build_operator_operand_fixup(lambda *args: None)
+
+
+class _UnboundCell:
+    """Stand in for a referenced cell, which is not bound, needs calc"""
+    value = None
+
+
+_UNBOUND_CELL = _UnboundCell()
+
+
+def python_code_template(python_code):
+    """ Split the python code for a formula into a template and addresses
+
+    Each constant address passed to `_C_`, `_R_` or `_REF_` is replaced
+    with a parameter, `_A0_`, `_A1_`, etc., so that formulas which differ
+    only in the addresses they reference have the same template.
+
+    :param python_code: python code for a formula
+    :return: (template python code, tuple of unique addresses)
+    """
+    parts = ADDRESS_LITERAL_RE.split(python_code)
+    params = {}
+    for i in range(2, len(parts), 3):
+        param = params.setdefault(sys.intern(parts[i]), f'_A{len(params)}_')
+        parts[i - 1] = f'{parts[i - 1]}({param})'
+        parts[i] = ''
+
+    # interned, since the copies of a formula have the same template
+    return sys.intern(''.join(parts)), tuple(params)
+
+
+def _r1c1_formula_key(formula, address):
+    """ The tokens of a formula, with A1 references as relative R1C1
+
+    Copies of a formula, as from a fill down, have the same key.
+    """
+    def r1c1(reference):
+        col_abs, col, row_abs, row = A1_PART_RE.match(reference).groups()
+        result = ''
+        if row:
+            row = int(row)
+            result = f'R{row}' if row_abs else f'R[{row - address.row}]'
+        if col:
+            col = column_index_from_string(col.upper())
+            result += f'C{col}' if col_abs else f'C[{col - address.col_idx}]'
+        return result
+
+    key = []
+    for token in Tokenizer(formula).items:
+        value = token.value
+        if token.matches(type_=Token.OPERAND, subtype=Token.RANGE) and (
+                A1_REFERENCE_RE.match(value)):
+            sheet, bang, value = value.rpartition('!')
+            value = sheet + bang + ':'.join(
+                r1c1(ref) for ref in value.split(':'))
+        key.append(value)
+    return tuple(key)
+
+
+class _TemplateCell:
+    """Stand in for a cell, to parse a formula at another address"""
+
+    def __init__(self, address, excel):
+        self.address = address
+        self.excel = excel
+
+    @property
+    def sheet(self):
+        return self.address.sheet
+
+
+class _FormulaTemplate:
+    """ The python code for copies of a formula, at an origin cell
+
+    Built by generating the python code for the formula at its origin, and
+    again at the origin offset by one row and one column.  Any address
+    which moved with the offset is relative, and is moved by the offset
+    from the origin when the template is instantiated at another cell.
+    """
+
+    def __init__(self, origin, parts, addresses):
+        self.origin = origin
+        self.parts = parts
+        self.addresses = addresses
+
+    @classmethod
+    def build(cls, formula, python_code):
+        """ Template from a formula, and its python code, or None
+
+        :param formula: `ExcelFormula` for the origin cell
+        :param python_code: python code for the formula at the origin
+        :return: `_FormulaTemplate` or None if the code is not relocatable
+        """
+        origin = formula.cell.address
+        try:
+            offset_address = origin.address_at_offset(1, 1)
+            offset_formula = ExcelFormula(
+                Translator(formula.base_formula, origin=origin.coordinate)
+                .translate_formula(offset_address.coordinate),
+                cell=_TemplateCell(offset_address, formula.cell.excel))
+            offset_parts = ADDRESS_LITERAL_RE.split(offset_formula.python_code)
+        except Exception:
+            return None
+
+        # a range can be a single cell at the origin, so _C_ and _R_ match
+        parts = ADDRESS_LITERAL_RE.split(python_code)
+        if len(parts) != len(offset_parts) or any(
+                part != offset_parts[i] and not (
+                    i % 3 == 1 and {part, offset_parts[i]} == {'_C_', '_R_'})
+                for i, part in enumerate(parts) if i % 3 != 2):
+            return None
+
+        addresses = []
+        for address, offset in zip(parts[2::3], offset_parts[2::3]):
+            try:
+                address = AddressRange(address)
+                offset = AddressRange(offset)
+            except Exception:
+                return None
+            if not isinstance(address, (AddressCell, AddressRange)) or (
+                    not isinstance(offset, (AddressCell, AddressRange)) or
+                    address.sheet != offset.sheet):
+                return None
+
+            # each of start column, start row, end column, end row moves
+            # by one (relative) or not at all (absolute)
+            moves = (offset.start.col_idx - address.start.col_idx,
+                     offset.start.row - address.start.row,
+                     offset.end.col_idx - address.end.col_idx,
+                     offset.end.row - address.end.row)
+            if not set(moves) <= {0, 1}:
+                return None
+            addresses.append((address, moves))
+
+        template = cls(origin, parts, tuple(addresses))
+        if template.python_code(offset_address) != offset_formula.python_code:
+            return None  # pragma: no cover
+        return template
+
+    def python_code(self, address):
+        """ The python code for the formula copied to address
+
+        :param address: `AddressCell` for the copy of the formula
+        :return: python code, or None if a reference moved off the sheet
+        """
+        row_inc = address.row - self.origin.row
+        col_inc = address.col_idx - self.origin.col_idx
+        parts = list(self.parts)
+        for i, (ref, moves) in enumerate(self.addresses):
+            bounds = (
+                ref.start.col_idx + moves[0] * col_inc,
+                ref.start.row + moves[1] * row_inc,
+                ref.end.col_idx + moves[2] * col_inc,
+                ref.end.row + moves[3] * row_inc,
+            )
+            if any(move and not 0 < bound <= limit for move, bound, limit in
+                   zip(moves, bounds, (MAX_COL, MAX_ROW) * 2)):
+                return None
+            bounds = tuple(bound or None for bound in bounds)
+            if bounds[:2] == bounds[2:] and None not in bounds:
+                ref = AddressCell(bounds, sheet=ref.sheet)
+            else:
+                ref = AddressRange(bounds, sheet=ref.sheet)
+            if parts[i * 3 + 1] != '_REF_':
+                parts[i * 3 + 1] = '_R_' if ref.is_range else '_C_'
+            parts[i * 3 + 2] = f'("{ref.address}")'
+        return ''.join(parts)
+
+
+class _CompiledTemplate:
+    """Compiled code for a python code template, shared by formulas"""
+
+    __slots__ = ('code', 'names', 'not_folded', 'marshalled', '__weakref__')
+
+    def __init__(self, template_code, code, names, not_folded=frozenset()):
+        self.code = code
+        self.names = names
+        self.not_folded = not_folded
+
+        # the state saved with each formula, one tuple shared by them all
+        self.marshalled = (
+            template_code, marshal.dumps(code), names, not_folded)
+
+
+def _relocate_code(code, filename, lineno):
+    """ Copy of code, and its nested code, at another filename and line
+
+    Shares the bytecode, only the locations reported in tracebacks change.
+    The lambdas compiled for a formula start on the first line of its code.
+    """
+    line_inc = lineno - next(
+        c.co_firstlineno for c in code.co_consts if isinstance(c, CodeType))
+
+    def relocate(code, line_inc=line_inc):
+        return code.replace(
+            co_filename=filename,
+            co_firstlineno=code.co_firstlineno + line_inc,
+            co_consts=tuple(relocate(c) if isinstance(c, CodeType) else c
+                            for c in code.co_consts),
+        )
+
+    # the module code only appends the outer lambda, leave its lines be
+    return relocate(code, line_inc=0)
+
+
+class OperatorWrapper(ast.NodeTransformer):
+    """Apply excel consistent type conversions, fetch dependant names"""
+
+    def __init__(self):
+        self.names = set()
+
+    def visit_Name(self, node):
+        """ Gather up all names needed """
+        node = ast.NodeTransformer.generic_visit(self, node)
+        self.names.add(node.id)
+        return node
+
+    def visit_Compare(self, node):
+        """ change the compare node to a function node """
+        node = ast.NodeTransformer.generic_visit(self, node)
+        return self.replace_op(
+            node, node.left, node.ops[0], node.comparators[0])
+
+    def visit_BinOp(self, node):
+        """ change the BinOP node to a function node """
+        node = ast.NodeTransformer.generic_visit(self, node)
+        if isinstance(node.op, ast.BitAnd) and self.is_addr_and(node):
+            return node
+        return self.replace_op(node, node.left, node.op, node.right)
+
+    def visit_UnaryOp(self, node):
+        """ change the UnaryOp node to a function node """
+        node = ast.NodeTransformer.generic_visit(self, node)
+        left = ast.Str(EMPTY)
+        return self.replace_op(node, left, node.op, node.operand)
+
+    def replace_op(self, node, left, node_op, right):
+        """ change the compare node to a function node """
+
+        op = ast.Str(s=type(node_op).__name__)
+        return ast.Call(
+            func=ast.Name(id='excel_operator_operand_fixup',
+                          ctx=ast.Load()),
+            args=[left, op, right],
+            keywords=[],
+            lineno=getattr(node, 'lineno', 1),
+            col_offset=getattr(node, 'col_offset', 0),
+        )
+
+    @staticmethod
+    def is_addr_and(node):
+        # reference intersection does not get fixup
+        return (isinstance(node.left, ast.Call) and
+                getattr(node.left.func, 'id', None) == '_REF_' and
+                isinstance(node.right, ast.Call) and
+                getattr(node.right.func, 'id', None) == '_REF_'
+                )
+
+
+class ConstantFolder(ast.NodeTransformer):
+    """Fold operators and pure functions of literals into constants
+
+    Applied after `OperatorWrapper`, the operators are evaluated with the
+    same fixup as at runtime, and the functions are the lib functions of
+    the default modules, with their meta applied.  Results which are
+    errors are left to be evaluated, and logged, at runtime.
+
+    :param not_folded: names of the functions not to fold, eg: the
+        functions defined by plugins, see `plugin_functions`
+    """
+
+    # pure functions of scalars, by their name in the python code
+    functions = frozenset((
+        'abs_', 'average', 'ceiling', 'concat', 'concatenate', 'cos', 'date',
+        'datevalue', 'day', 'degrees', 'edate', 'eomonth', 'even', 'exp',
+        'fact', 'floor', 'int_', 'left', 'len_', 'ln', 'log', 'log10',
+        'lower', 'max_', 'mid', 'min_', 'mod', 'month', 'odd', 'power',
+        'product', 'radians', 'right', 'round_', 'rounddown', 'roundup',
+        'sign', 'sin', 'sqrt', 'substitute', 'sum_', 'tan', 'text', 'trim',
+        'trunc', 'upper', 'value', 'year',
+    ))
+
+    # the lib functions, loaded as needed
+    _name_space = {}
+
+    def __init__(self, not_folded=frozenset()):
+        self.not_folded = not_folded
+        self.folded = 0
+
+    @classmethod
+    def plugin_functions(cls, plugins):
+        """The names of the functions folded, which the plugins define"""
+        if not plugins:
+            return frozenset()
+        modules = set(ExcelFormula.lib_modules(plugins)) - set(
+            ExcelFormula.lib_modules())
+        return frozenset(name for name in cls.functions
+                         if any(hasattr(module, name) for module in modules))
+
+    def visit_Name(self, node):
+        if node.id == 'pi':
+            return self.constant(node, math.pi)
+        return node
+
+    def visit_Call(self, node):
+        node = ast.NodeTransformer.generic_visit(self, node)
+        func = getattr(node.func, 'id', None)
+        if node.keywords or func in self.not_folded or not (
+                func == 'excel_operator_operand_fixup' or
+                func in self.functions):
+            return node
+
+        args = []
+        for arg in node.args:
+            if type(arg).__name__ not in (
+                    'Constant', 'NameConstant', 'Num', 'Str'):
+                return node
+            args.append(next(getattr(arg, attr) for attr in ('value', 'n', 's')
+                             if hasattr(arg, attr)))
+
+        try:
+            if func == 'excel_operator_operand_fixup':
+                value = _literal_operand_fixup(*args)
+            else:
+                if func not in self._name_space:
+                    load_functions((func, ), self._name_space,
+                                   ExcelFormula.lib_modules())
+                value = self._name_space[func](*args)
+        except Exception:
+            return node
+        return self.constant(node, value)
+
+    def constant(self, node, value):
+        """A constant node for value, if it is a number, str or bool"""
+        if hasattr(value, 'item') and not isinstance(value, (list, tuple)):
+            # eg: numpy scalars
+            value = value.item()
+        if type(value) not in (bool, int, float, str) or value in ERROR_CODES or (
+                type(value) is float and not math.isfinite(value)):
+            return node
+        self.folded += 1
+        return ast.copy_location(ast.Constant(value=value), node)
+
+
+class _NotConstant(Exception):
+    """The value of a param depends on a cell which is not constant"""
+
+
+class DeadBranchEliminator(ast.NodeTransformer):
+    """Drop the params of IF(), CHOOSE() and friends which are not needed
+
+    Applied to the python code of a formula.  When the params which select
+    the result depend only on literals and constant cells, the function's
+    `needed_params` is evaluated, and the params it does not need are
+    replaced with None, which is how `lazy_wrapper` passes them.
+
+    :param constant_value: function of an address returning the value of
+        the cell, or raising KeyError if the cell is not constant
+    :param plugins: module paths for plugin lib functions
+    """
+
+    def __init__(self, constant_value, plugins=None):
+        self.constant_value = constant_value
+        self.modules = ExcelFormula.lib_modules(plugins)
+        self.not_folded = ConstantFolder.plugin_functions(plugins)
+        self.eliminated = 0
+
+    def visit_Call(self, node):
+        node = ast.NodeTransformer.generic_visit(self, node)
+        func = getattr(node.func, 'id', None)
+        lazy_from = next((
+            lazy_from for name, lazy_from in FunctionNode.lazy_funcs.items()
+            if FunctionNode.func_map.get(name, name) == func), None)
+        if lazy_from is None or node.keywords:
+            return node
+
+        meta = next((getattr(getattr(module, func), FUNC_META, None)
+                     for module in self.modules if hasattr(module, func)), None)
+        needed_params = meta and meta.get('needed_params')
+        if needed_params is None:
+            return node
+
+        values = {}
+
+        def param(i, arg):
+            def value():
+                if i not in values:
+                    values[i] = self.value(
+                        arg.body if isinstance(arg, ast.Lambda) else arg)
+                return values[i]
+            return value
+
+        try:
+            needed = needed_params(
+                *(param(i, arg) for i, arg in enumerate(node.args)))
+        except _NotConstant:
+            return node
+
+        if needed is None:
+            return node
+        dropped = [i for i in range(lazy_from, len(node.args))
+                   if i not in needed and i not in values]
+        if not dropped:
+            return node
+
+        self.eliminated += len(dropped)
+        args = []
+        for i, arg in enumerate(node.args):
+            if i in dropped:
+                arg = ast.Constant(value=None)
+            elif i in values:
+                arg = ast.Constant(value=values[i])
+            args.append(arg)
+        return ast.copy_location(ast.Call(
+            func=node.func, args=args, keywords=[]), node)
+
+    def value(self, node):
+        """The value of a param, or raise _NotConstant"""
+        constant_value = self.constant_value
+
+        class CellValues(ast.NodeTransformer):
+            def visit_Call(self, node):
+                func = getattr(node.func, 'id', None)
+                if func in ('_R_', '_REF_'):
+                    raise _NotConstant()
+                elif func == '_C_':
+                    try:
+                        value = constant_value(node.args[0].s)
+                    except KeyError:
+                        raise _NotConstant()
+                    if hasattr(value, 'item'):
+                        # eg: numpy scalars
+                        value = value.item()
+                    if type(value) not in (bool, int, float, str, type(None)):
+                        raise _NotConstant()
+                    return ast.copy_location(ast.Constant(value=value), node)
+                return ast.NodeTransformer.generic_visit(self, node)
+
+        tree = CellValues().visit(copy.deepcopy(ast.Expression(body=node)))
+        tree = ConstantFolder(self.not_folded).visit(
+            OperatorWrapper().visit(tree))
+        if type(tree.body).__name__ not in (
+                'Constant', 'NameConstant', 'Num', 'Str'):
+            raise _NotConstant()
+        return next(getattr(tree.body, attr) for attr in ('value', 'n', 's')
+                    if hasattr(tree.body, attr))
+
+
+class CommonSubexpressions:
+    """Find the calls which are repeated in the python code of formulas
+
+    The calls are of the functions below, which return a value, and not an
+    array, outside of array formulas, if the params listed for each are
+    values.  The calls may not reference cells with `_REF_`, or call the
+    excluded functions, eg: volatile functions.
+
+    :param excluded: names of the functions whose calls are not repeated
+    """
+
+    # by their name in the python code, the params which must be values
+    functions = {
+        'average': slice(0),
+        'averageif': slice(1, 2),
+        'averageifs': slice(2, None, 2),
+        'count': slice(0),
+        'counta': slice(0),
+        'countblank': slice(0),
+        'countif': slice(1, 2),
+        'countifs': slice(1, None, 2),
+        'hlookup': slice(0, 1),
+        'lookup': slice(0, 1),
+        'match': slice(0, 1),
+        'max_': slice(0),
+        'maxifs': slice(2, None, 2),
+        'min_': slice(0),
+        'minifs': slice(2, None, 2),
+        'sum_': slice(0),
+        'sumif': slice(1, 2),
+        'sumifs': slice(2, None, 2),
+        'sumproduct': slice(0),
+        'vlookup': slice(0, 1),
+    }
+
+    def __init__(self, excluded=()):
+        self.excluded = frozenset(excluded) | {'_REF_'}
+        self.replaced = 0
+
+    def key(self, node):
+        """The python code of a call which may be repeated, else None"""
+        if not (isinstance(node, ast.Call) and
+                getattr(node.func, 'id', None) in self.functions):
+            return None
+        for child in ast.walk(node):
+            if isinstance(child, ast.Call) and (
+                    not isinstance(child.func, ast.Name) or
+                    child.func.id in self.excluded or child.keywords):
+                return None
+        if not all(map(self.is_value, node.args[self.functions[node.func.id]])):
+            return None
+        try:
+            return python_code_from_ast(node)
+        except NotImplementedError:
+            return None
+
+    def is_value(self, node):
+        """Is the node a value, not an array, outside of array formulas"""
+        if isinstance(node, ast.Call):
+            return node.func.id == '_C_' or self.key(node) is not None
+        elif isinstance(node, ast.BinOp):
+            return self.is_value(node.left) and self.is_value(node.right)
+        elif isinstance(node, ast.Compare):
+            return self.is_value(node.left) and self.is_value(
+                node.comparators[0])
+        elif isinstance(node, ast.UnaryOp):
+            return self.is_value(node.operand)
+        return type(node).__name__ in (
+            'Constant', 'NameConstant', 'Num', 'Str')
+
+    def _count(self, node, keys, counts):
+        key = self.key(node)
+        if key is not None and (keys is None or key in keys):
+            counts[key] = counts.get(key, 0) + 1
+            if keys is not None:
+                return
+        for child in ast.iter_child_nodes(node):
+            self._count(child, keys, counts)
+
+    def repeated(self, trees, min_count=2):
+        """ The calls repeated in the trees, and not only inside each other
+
+        :param trees: the ast of the python code of each formula
+        :param min_count: the number of times a call must be repeated
+        :return: set of the python code of the repeated calls
+        """
+        counts = {}
+        for tree in trees:
+            self._count(tree, None, counts)
+        keys = {key for key, count in counts.items() if count >= min_count}
+
+        while keys:
+            # count the calls inside the repeated calls once
+            counts = {}
+            for tree in trees:
+                self._count(tree, keys, counts)
+            for key in keys:
+                for arg in ast.parse(key, mode='eval').body.args:
+                    self._count(arg, keys, counts)
+            repeated = {key for key in keys if counts.get(key, 0) >= min_count}
+            if repeated == keys:
+                break
+            keys = repeated
+        return keys
+
+    def replace(self, node, references, root=True):
+        """ Replace the calls with references
+
+        :param node: ast node
+        :param references: dict of the python code of a call to its node
+        :param root: if False, the node itself is not replaced
+        :return: the node, with the calls replaced
+        """
+        key = root and self.key(node)
+        if key in references:
+            self.replaced += 1
+            return ast.copy_location(copy.deepcopy(references[key]), node)
+        for field, value in ast.iter_fields(node):
+            if isinstance(value, list):
+                setattr(node, field, [
+                    self.replace(item, references)
+                    if isinstance(item, ast.AST) else item for item in value])
+            elif isinstance(value, ast.AST):
+                setattr(node, field, self.replace(value, references))
+        return node
+
+
+_PYTHON_OPS = {
+    ast.Add: '+', ast.Sub: '-', ast.Mult: '*', ast.Div: '/', ast.Pow: '**',
+    ast.BitAnd: '&', ast.Eq: '==', ast.NotEq: '!=', ast.Lt: '<',
+    ast.LtE: '<=', ast.Gt: '>', ast.GtE: '>=', ast.UAdd: '+', ast.USub: '-',
+}
+
+
+def _operand_code(node):
+    """Python code for an operand, in parentheses if it is an operator"""
+    code = python_code_from_ast(node)
+    if isinstance(node, (ast.BinOp, ast.Compare, ast.UnaryOp)):
+        return f'({code})'
+    return code
+
+
+def python_code_from_ast(node):
+    """ Generate python code from the ast of a compiled formula
+
+    Only the node types found in the python code for formulas are supported.
+
+    :param node: an ast node
+    :return: python code as a str
+    """
+    if isinstance(node, ast.Expression):
+        return python_code_from_ast(node.body)
+
+    elif isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and (
+            not node.keywords):
+        args = ', '.join(python_code_from_ast(arg) for arg in node.args)
+        return f'{node.func.id}({args})'
+
+    elif isinstance(node, ast.Name):
+        return node.id
+
+    elif isinstance(node, ast.Lambda) and not node.args.args:
+        return f'lambda: {python_code_from_ast(node.body)}'
+
+    elif isinstance(node, (ast.Tuple, ast.List)):
+        items = ', '.join(python_code_from_ast(elt) for elt in node.elts)
+        if isinstance(node, ast.List):
+            return f'[{items}]'
+        return f'({items},)' if len(node.elts) == 1 else f'({items})'
+
+    elif isinstance(node, ast.BinOp) and type(node.op) in _PYTHON_OPS:
+        return (f'{_operand_code(node.left)} {_PYTHON_OPS[type(node.op)]} '
+                f'{_operand_code(node.right)}')
+
+    elif isinstance(node, ast.Compare) and all(
+            type(op) in _PYTHON_OPS for op in node.ops):
+        return ' '.join([_operand_code(node.left)] + [
+            f'{_PYTHON_OPS[type(op)]} {_operand_code(comparator)}'
+            for op, comparator in zip(node.ops, node.comparators)])
+
+    elif isinstance(node, ast.UnaryOp) and type(node.op) in _PYTHON_OPS:
+        return f'{_PYTHON_OPS[type(node.op)]}{_operand_code(node.operand)}'
+
+    elif type(node).__name__ in ('Constant', 'NameConstant', 'Num', 'Str'):
+        # ast.Constant, or ast.NameConstant, ast.Num and ast.Str before 3.8
+        value = next(getattr(node, attr) for attr in ('value', 'n', 's')
+                     if hasattr(node, attr))
+        return repr(value)
+
+    raise NotImplementedError(
+        f'Python code generation for {type(node).__name__}')
+
+
 class ExcelFormula:
     """Take an Excel formula and compile it to Python code."""
 
@@ -534,6 +1308,19 @@ class ExcelFormula:
         'math',
     )
 
+    # templates of the python code for copies of a formula, per workbook,
+    # keyed by sheet and the formula with relative R1C1 references
+    _formula_templates = weakref.WeakKeyDictionary()
+
+    # compiled code, shared by the formulas with the same python template
+    _compiled_templates = weakref.WeakValueDictionary()
+
+    __slots__ = (
+        'base_formula', 'cell', 'lineno', 'filename', 'compiled_lambda', 'msg',
+        '_python_code', '_rpn', '_ast', '_needed_addresses', '_code_template',
+        '_compiled_python', '_compiled_template', '_marshalled_python',
+    )
+
     def __init__(self, formula, cell=None, formula_is_python_code=False):
         if formula_is_python_code:
             self.base_formula = None
@@ -549,7 +1336,9 @@ class ExcelFormula:
         self._rpn = None
         self._ast = None
         self._needed_addresses = None
+        self._code_template = None
         self._compiled_python = None
+        self._compiled_template = None
         self._marshalled_python = None
         self.compiled_lambda = None
         self.msg = None
@@ -565,14 +1354,23 @@ class ExcelFormula:
         self.python_code
 
         # Throw everything away except the python code
-        state = dict(self.__dict__)
+        state = slots_getstate(self)
         remove_names = 'compiled_lambda _compiled_python _ast _rpn ' \
-                       'base_formula _needed_addresses'
+                       'base_formula _needed_addresses _compiled_template ' \
+                       '_code_template'
         for to_remove in remove_names.split():
             if to_remove in state:  # pragma: no branch
                 state[to_remove] = None
         return state
 
+    def __setstate__(self, state):
+        # older pickles may not have all of the current slots
+        for name in self.__slots__:
+            setattr(self, name, None)
+        self.lineno = 1
+        self.filename = ''
+        slots_setstate(self, state)
+
     @property
     def rpn(self):
         if self._rpn is None:
@@ -609,29 +1407,105 @@ class ExcelFormula:
     def python_code(self):
         """Use the ast to generate python code"""
         if self._python_code is None:
-            if self.ast is None:
-                self._python_code = ''
-            else:
-                self._python_code = self.ast.emit
+            self._python_code = self._templated_python_code()
+            if self._python_code is None:
+                self._python_code = '' if self.ast is None else self.ast.emit
         return self._python_code
 
+    def _templated_python_code(self):
+        """ Python code from the template for the copies of this formula
+
+        The first copy of a formula is parsed, and builds the template.
+
+        :return: python code, or None if there is no usable template
+        """
+        excel = getattr(self.cell, 'excel', None)
+        address = getattr(self.cell, 'address', None)
+        if excel is None or not isinstance(address, AddressCell) or (
+                '[' in self.base_formula):
+            # structured references depend on the table containing the cell
+            return None
+
+        try:
+            templates = self._formula_templates.setdefault(excel, {})
+            key = address.sheet, _r1c1_formula_key(self.base_formula, address)
+        except Exception:
+            return None
+
+        if key not in templates:
+            templates[key] = None
+            python_code = '' if self.ast is None else self.ast.emit
+            if python_code:
+                templates[key] = _FormulaTemplate.build(self, python_code)
+            return python_code
+
+        template = templates[key]
+        return template and template.python_code(address)
+
+    @property
+    def code_template(self):
+        """The python code template and addresses, see `python_code_template`"""
+        if self._code_template is None:
+            self._code_template = python_code_template(self.python_code)
+        return self._code_template
+
     @property
     def compiled_python(self):
-        """ Using the Python code, generate compiled python code"""
+        """ Using the Python code, generate compiled python code
+
+        Formulas with the same python code template share the compiled code,
+        which is passed the addresses of each formula when loaded.
+        """
+        return self.compile_python()
+
+    def compile_python(self, not_folded=frozenset()):
+        """ The compiled python code, see `compiled_python`
+
+        :param not_folded: names of the functions not to fold into constants
+        :return: compiled code, needed names, addresses
+        """
+        if self._compiled_python is not None and (
+                self._compiled_template.not_folded != not_folded):
+            self._compiled_python = None
         if self._compiled_python is None and self.python_code:
-            if self._marshalled_python is not None:
+            template_code, addresses = self.code_template
+            key = template_code, not_folded
+            template = self._compiled_templates.get(key)
+            if template is None and self._marshalled_python is not None:
                 try:
-                    marshalled, names = self._marshalled_python
-                    self._compiled_python = marshal.loads(marshalled), names
+                    marshalled_code, marshalled, names, marshalled_not_folded = \
+                        self._marshalled_python
+                    if marshalled_code == template_code and (
+                            marshalled_not_folded == not_folded):
+                        template = _CompiledTemplate(
+                            template_code, marshal.loads(marshalled), names,
+                            not_folded)
                 except Exception:
-                    self._marshalled_python = None
-                    return self.compiled_python
-            else:
+                    pass
+            if template is None:
                 try:
-                    self._compile_python_ast()
+                    template = _CompiledTemplate(
+                        template_code, *self._compile_python_ast(
+                            template_code, len(addresses),
+                            not_folded=not_folded), not_folded)
                 except Exception as exc:
                     raise FormulaParserError(
                         f"Failed to compile expression {self.python_code}: {exc}")
+            self._compiled_templates[key] = template
+            self._compiled_template = template
+            self._marshalled_python = template.marshalled
+
+            code = template.code
+            if self.filename or self.lineno != 1:
+                # place the code at the line of the formula in its text file
+                filename = self.filename or __file__
+                if hasattr(code, 'replace'):
+                    code = _relocate_code(code, filename, self.lineno)
+                else:  # pragma: no cover
+                    code = self._compile_python_ast(
+                        template_code, len(addresses), filename,
+                        not_folded)[0]
+            self._compiled_python = code, template.names, addresses
 
         return self._compiled_python
 
@@ -821,9 +1695,26 @@ class ExcelFormula:
         assert 1 == len(stack)
         return stack[0]
 
+    @classmethod
+    def lib_modules(cls, plugins=None):
+        """The modules of the lib functions, the plugins ahead of the defaults
+
+        :param plugins: module paths for plugin lib functions
+        :return: tuple of modules
+        """
+        if plugins is None:
+            modules = ()
+        elif isinstance(plugins, str):
+            modules = (plugins, )
+        else:
+            modules = tuple(plugins)
+        return tuple(importlib.import_module(m)
+                     for m in modules + cls.default_modules)
+
     @classmethod
     def build_eval_context(cls, evaluate, evaluate_range,
-                           logger=None, plugins=None):
+                           logger=None, plugins=None, cell_map=None,
+                           referenced=None):
         """eval with namespace management.  Will auto import needed functions
 
         Used like:
@@ -834,17 +1725,20 @@ class ExcelFormula:
         :param evaluate_range: a function to evaluate a range address
         :param logger: a logger to use (defaults to pycel)
         :param plugins: module paths for plugin lib functions
+        :param cell_map: dict of address to cells and ranges with a `value`.
+            When a formula is loaded, its references are bound to these, and
+            a value which is not None is used without calling `evaluate`.
+        :param referenced: a function called with each address returned
+            by a volatile function, eg: OFFSET()
         :return: a function to evaluate a compiled expression from build_ast
         """
 
-        if plugins is None:
-            modules = ()
-        elif isinstance(plugins, str):
-            modules = (plugins, )
-        else:
-            modules = tuple(plugins)
-        modules = tuple(importlib.import_module(m)
-                        for m in modules + cls.default_modules)
+        def bind_cell(address):
+            cell = None if cell_map is None else cell_map.get(address)
+            return _UNBOUND_CELL if cell is None else cell
+
+        modules = cls.lib_modules(plugins)
+        not_folded = ConstantFolder.plugin_functions(plugins)
 
         logger = logger or logging.getLogger('pycel')
         error_messages = []
@@ -877,32 +1771,40 @@ class ExcelFormula:
                 raise exc(error_msg)
             return error_msg
 
-        def load_function(excel_formula, name_space):
-            """exec the code into our address space"""
+        # one name space is shared by all of the formulas, so that each
+        # function is loaded, and wrapped per its meta, only once.
+        # The compiled expressions can call these functions if
+        # referencing other cells or a range of cells
+        name_space = dict(
+            _C_=evaluate,
+            _R_=evaluate_range,
+            _REF_=AddressRange.create,
+            _REFERENCED_=referenced,
+            pi=math.pi,
+        )
 
-            # the compiled expressions can call these functions if
-            # referencing other cells or a range of cells
-            name_space['_C_'] = evaluate
-            name_space['_R_'] = evaluate_range
-            name_space['_REF_'] = AddressRange.create
-            name_space['pi'] = math.pi
+        # function to fixup the operands
+        name_space['excel_operator_operand_fixup'] = \
+            build_operator_operand_fixup(capture_error_state)
 
-            # function to fixup the operands
-            name_space['excel_operator_operand_fixup'] = \
-                build_operator_operand_fixup(capture_error_state)
+        def load_function(excel_formula):
+            """exec the code into our address space"""
 
             # hook for the execed code to save the resulting lambda
             name_space['lambdas'] = lambdas = []
 
-            # get the compiled code and needed names
-            compiled, names = excel_formula.compiled_python
+            # get the compiled code, needed names and referenced addresses
+            compiled, names, addresses = excel_formula.compile_python(
+                not_folded)
 
-            # load the needed names
+            # load the needed names, which are not already loaded
             not_found = load_functions(names, name_space, modules)
 
-            # exec the code to define the lambda
+            # exec the code to define the lambda, and bind the cells
             exec(compiled, name_space, name_space)
-            excel_formula.compiled_lambda = lambdas[0]
+            excel_formula.compiled_lambda = lambdas[0](*(
+                arg for address in addresses
+                for arg in (bind_cell(address), address)))
             del name_space['lambdas']
             return not_found
 
@@ -910,7 +1812,7 @@ class ExcelFormula:
             """ Call the compiled lambda to evaluate the cell """
 
             if excel_formula.compiled_lambda is None:
-                missing = load_function(excel_formula, locals())
+                missing = load_function(excel_formula)
                 if missing:
                     msg_fmt = 'Function {} is not implemented. '
                     excel_formula.msg = '\n'.join(
@@ -942,77 +1844,74 @@ class ExcelFormula:
 
         return eval_func
 
-    def _compile_python_ast(self):
-        """ Compile the python code into a lambda for execution
+    def _compile_python_ast(self, template_code, num_addresses, filename=None,
+                            not_folded=frozenset()):
+        """ Compile a python code template into a lambda for execution
 
         ### Traceback will show this line if not loaded from a text file
 
         If the compiler has been loaded from (json, yaml, etc) then python
         expression will be shown in any tracebacks instead of the above
-        """
-        local_line = sys._getframe().f_lineno - 6
 
-        source_code = f"lambdas.append(lambda: {self.python_code})"
-        kwargs = dict(mode='exec', filename=self.filename or __file__)
+        :param template_code: python code from `python_code_template`
+        :param num_addresses: number of address parameters in the template
+        :param filename: place the code at `self.lineno` in this file
+        :param not_folded: names of the functions not to fold into constants
+        :return: compiled code, needed names
+        """
+        local_line = sys._getframe().f_lineno - 11
+
+        # the addresses, and the cells and ranges at those addresses, are
+        # passed to an outer lambda, to be bound when the lambda is loaded
+        params = ', '.join(
+            f'_S{i}_, _A{i}_' for i in range(num_addresses))
+        source_code = f"lambdas.append(lambda {params}: " \
+                      f"lambda: {template_code})"
+        kwargs = dict(mode='exec', filename=filename or __file__)
         tree = ast.parse(source_code, **kwargs)
-        ast.increment_lineno(tree, (self.lineno - 1) or local_line)
-
-        names = set()
-
-        # edit the ast with a few changes to be more excel like
-
-        class OperatorWrapper(ast.NodeTransformer):
-            """Apply excel consistent type conversions, fetch dependant names"""
+        ast.increment_lineno(
+            tree, self.lineno - 1 if filename else local_line)
 
-            def visit_Name(self, node):
-                """ Gather up all names needed """
-                node = ast.NodeTransformer.generic_visit(self, node)
-                names.add(node.id)
-                return node
-
-            def visit_Compare(self, node):
-                """ change the compare node to a function node """
-                node = ast.NodeTransformer.generic_visit(self, node)
-                return self.replace_op(
-                    node, node.left, node.ops[0], node.comparators[0])
-
-            def visit_BinOp(self, node):
-                """ change the BinOP node to a function node """
+        # modify the ast tree to convert Compare and BinOp to Call
+        operator_wrapper = OperatorWrapper()
+        tree = operator_wrapper.visit(tree)
+        names = operator_wrapper.names
+
+        # fold the literal subexpressions into constants
+        constant_folder = ConstantFolder(not_folded)
+        tree = constant_folder.visit(tree)
+        if constant_folder.folded:
+            names = {node.id for node in ast.walk(tree)
+                     if isinstance(node, ast.Name)} - {
+                'excel_operator_operand_fixup'}
+        names = {name for name in names if not TEMPLATE_PARAM_RE.match(name)}
+
+        class CellBinder(ast.NodeTransformer):
+            """Use the value of a bound cell, if it does not need calc"""
+
+            def visit_Call(self, node):
                 node = ast.NodeTransformer.generic_visit(self, node)
-                if isinstance(node.op, ast.BitAnd) and self.is_addr_and(node):
+                param = getattr(node.func, 'id', None) in ('_C_', '_R_') and \
+                    len(node.args) == 1 and \
+                    getattr(node.args[0], 'id', '')
+                if not (param and param.startswith('_A')):
                     return node
-                return self.replace_op(node, node.left, node.op, node.right)
-
-            def visit_UnaryOp(self, node):
-                """ change the UnaryOp node to a function node """
-                node = ast.NodeTransformer.generic_visit(self, node)
-                left = ast.Str(EMPTY)
-                return self.replace_op(node, left, node.op, node.operand)
-
-            def replace_op(self, node, left, node_op, right):
-                """ change the compare node to a function node """
-
-                op = ast.Str(s=type(node_op).__name__)
-                return ast.Call(
-                    func=ast.Name(id='excel_operator_operand_fixup',
-                                  ctx=ast.Load()),
-                    args=[left, op, right],
-                    keywords=[],
-                    lineno=node.lineno,
-                    col_offset=node.col_offset,
+                slot = f'_S{param[2:]}'
+
+                def slot_value():
+                    return ast.Attribute(
+                        value=ast.Name(id=slot, ctx=ast.Load()),
+                        attr='value', ctx=ast.Load())
+
+                return ast.IfExp(
+                    test=ast.Compare(
+                        left=slot_value(), ops=[ast.IsNot()],
+                        comparators=[ast.NameConstant(value=None)]),
+                    body=slot_value(),
+                    orelse=node,
                 )
 
-            def is_addr_and(self, node):
-                # reference intersection does not get fixup
-                return (isinstance(node.left, ast.Call) and
-                        node.left.func.id == '_REF_' and
-                        isinstance(node.right, ast.Call) and
-                        node.right.func.id == '_REF_'
-                        )
-
-        # modify the ast tree to convert Compare and BinOp to Call
-        tree = ast.fix_missing_locations(OperatorWrapper().visit(tree))
+        tree = ast.fix_missing_locations(CellBinder().visit(tree))
 
         # compile the tree
-        self._compiled_python = compile(tree, **kwargs), names
-        self._marshalled_python = marshal.dumps(self._compiled_python[0]), names
+        return compile(tree, **kwargs), names
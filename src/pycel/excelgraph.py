@@ -0,0 +1,527 @@
+# -*- coding: UTF-8 -*-
+#
+# Copyright 2011-2019 by Dirk Gorissen, Stephen Rauch and Contributors
+# All rights reserved.
+# This file is part of the Pycel Library, Licensed under GPLv3 (the 'License')
+# You may not use this work except in compliance with the License.
+# You may obtain a copy of the Licence at:
+#   https://www.gnu.org/licenses/gpl-3.0.en.html
+
+"""
+Compact dependency graph for the cells and ranges of a workbook.
+
+Each node is given an integer id in the order it is added.  The edges are
+kept as arrays of ids in compressed sparse row (CSR) form, once for the
+precedents and once for the dependents of each node, so that a graph with
+millions of cells needs a few bytes per edge instead of the dicts per node
+and per edge of a `networkx.DiGraph`.  Edges added since the arrays were
+last built are kept in small per node lists, and merged into the arrays in
+bulk.  Traversals of many nodes (ancestors, descendants and topological
+sorts) are done over the arrays with NumPy.
+"""
+
+import array
+import itertools as it
+
+import networkx as nx
+import numpy as np
+
+from pycel.excelutil import PyCelException
+
+
+class NodeNotFound(PyCelException, KeyError):
+    """Node is not in the graph"""
+
+    def __str__(self):
+        return str(self.args[0]) if self.args else ''
+
+
+class CycleError(PyCelException):
+    """The graph has a cycle, so there is no topological order"""
+
+
+class _Adjacency:
+    """ Neighbor ids of each node, in CSR form plus pending additions
+
+    ``indices[indptr[i]:indptr[i + 1]]`` are the neighbors of node ``i``
+    when the arrays were built, and ``pending[i]`` those added since.  The
+    arrays are `array.array`, which are quicker than NumPy to slice one node
+    at a time, with NumPy views of them for traversals of many nodes.
+    ``runtime[i]`` are the neighbors by runtime edges, which are never
+    merged into the arrays, as they are replaced.
+    """
+
+    __slots__ = ('indptr', 'indices', 'np_indptr', 'np_indices',
+                 'num_built', 'pending', 'num_pending', 'runtime')
+
+    def __init__(self, indptr=None, indices=None):
+        if indptr is None:
+            indptr, indices = (0, ), ()
+        self.indptr = array.array(
+            'q', np.asarray(indptr, dtype=np.int64).tobytes())
+        self.indices = array.array(
+            'i', np.asarray(indices, dtype=np.int32).tobytes())
+        self.np_indptr = np.frombuffer(self.indptr, dtype=np.int64)
+        self.np_indices = np.frombuffer(self.indices, dtype=np.int32)
+        self.num_built = len(self.indptr) - 1
+        self.pending = {}
+        self.num_pending = 0
+        self.runtime = {}
+
+    def __getstate__(self):
+        return self.indptr, self.indices, self.pending, self.num_pending
+
+    def __setstate__(self, state):
+        indptr, indices, pending, num_pending = state
+        self.__init__(indptr, indices)
+        self.pending = pending
+        self.num_pending = num_pending
+
+    def __getitem__(self, node_id):
+        """Neighbor ids of a node, as a list"""
+        if node_id < self.num_built:
+            neighbors = self.indices[
+                self.indptr[node_id]:self.indptr[node_id + 1]].tolist()
+            pending = self.pending.get(node_id)
+            if pending:
+                neighbors.extend(pending)
+        else:
+            neighbors = list(self.pending.get(node_id, ()))
+        if self.runtime:
+            neighbors.extend(self.runtime.get(node_id, ()))
+        return neighbors
+
+    def add(self, src, dst):
+        pending = self.pending.get(src)
+        if pending is None:
+            self.pending[src] = [dst]
+        else:
+            pending.append(dst)
+        self.num_pending += 1
+
+    def edges(self):
+        """All the edges as arrays of source and destination ids"""
+        src = np.repeat(np.arange(self.num_built, dtype=np.int32),
+                        np.diff(self.np_indptr))
+        dst = self.np_indices
+        if self.num_pending:
+            src = np.concatenate((src, np.fromiter(it.chain.from_iterable(
+                it.repeat(node_id, len(neighbors))
+                for node_id, neighbors in self.pending.items()),
+                dtype=np.int32, count=self.num_pending)))
+            dst = np.concatenate((dst, np.fromiter(
+                it.chain.from_iterable(self.pending.values()),
+                dtype=np.int32, count=self.num_pending)))
+        return src, dst
+
+    @classmethod
+    def from_edges(cls, src, dst, num_nodes):
+        """Build the arrays from unique edges sorted by source"""
+        indptr = np.zeros(num_nodes + 1, dtype=np.int64)
+        np.cumsum(np.bincount(src, minlength=num_nodes), out=indptr[1:])
+        return cls(indptr, dst.astype(np.int32, copy=False))
+
+    def gather(self, node_ids):
+        """Neighbor ids of an array of node ids, as an array with repeats"""
+        built = node_ids[node_ids < self.num_built]
+        starts = self.np_indptr[built]
+        lengths = self.np_indptr[built + 1] - starts
+        offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+        neighbors = self.np_indices[offsets + np.arange(len(offsets))]
+        for added in (self.pending, self.runtime):
+            if not added:
+                continue
+            if len(node_ids) <= len(added):
+                added = filter(None, map(added.get, node_ids.tolist()))
+            else:
+                keys = np.fromiter(added, dtype=np.int32, count=len(added))
+                added = map(added.get, keys[np.isin(keys, node_ids)].tolist())
+            added = np.fromiter(it.chain.from_iterable(added), dtype=np.int32)
+            if added.size:
+                neighbors = np.concatenate((neighbors, added))
+        return neighbors
+
+
+class DependencyGraph:
+    """ Directed graph of cell dependencies, edges from precedent to dependent
+
+    The nodes are `_Cell` and `_CellRange` instances.  The methods mirror
+    the subset of `networkx.DiGraph` used by the compiler, and `to_networkx`
+    builds a full `DiGraph` when one is needed, such as for export.
+    """
+
+    # fewest pending edges to merge into the arrays
+    min_pending = 4096
+
+    def __init__(self):
+        self._nodes = []
+        self._ids = {}
+        self._precedents = _Adjacency()
+        self._dependents = _Adjacency()
+
+    def __contains__(self, node):
+        return node in self._ids
+
+    def __len__(self):
+        return len(self._nodes)
+
+    def __iter__(self):
+        return iter(self._nodes)
+
+    def __getstate__(self):
+        self._compact()
+        return dict(nodes=self._nodes, dependents=self._dependents,
+                    runtime=self._precedents.runtime)
+
+    def __setstate__(self, state):
+        self._nodes = state['nodes']
+        self._ids = {node: i for i, node in enumerate(self._nodes)}
+        self._set_edges(*state['dependents'].edges())
+        for dst, srcs in state.get('runtime', {}).items():
+            self._set_runtime(dst, srcs)
+
+    def nodes(self):
+        return list(self._nodes)
+
+    def edges(self):
+        self._compact()
+        src, dst = self._dependents.edges()
+        nodes = self._nodes
+        return [(nodes[s], nodes[d])
+                for s, d in zip(src.tolist(), dst.tolist())]
+
+    def number_of_nodes(self):
+        return len(self._nodes)
+
+    def number_of_edges(self):
+        """Number of edges, duplicates are counted until they are merged"""
+        return len(self._dependents.indices) + self._dependents.num_pending
+
+    def add_node(self, node):
+        """Add a node, if not already in the graph, and return its id"""
+        node_id = self._ids.get(node)
+        if node_id is None:
+            node_id = self._ids[node] = len(self._nodes)
+            self._nodes.append(node)
+        return node_id
+
+    def add_edge(self, precedent, dependent):
+        """ Add an edge, and its nodes if not already in the graph
+
+        Duplicate edges are removed when the pending edges are merged.
+        """
+        src = self.add_node(precedent)
+        dst = self.add_node(dependent)
+        self._dependents.add(src, dst)
+        self._precedents.add(dst, src)
+        if self._dependents.num_pending > max(
+                self.min_pending, len(self._dependents.indices) // 4):
+            self._compact()
+
+    def remove_edges(self, edges):
+        """ Remove edges, the nodes are kept
+
+        :param edges: iterable of (precedent, dependent) in the graph
+        """
+        self._compact()
+        num_nodes = len(self._nodes)
+        to_remove = np.fromiter(
+            (self._id(precedent) * num_nodes + self._id(dependent)
+             for precedent, dependent in edges), dtype=np.int64)
+        src, dst = self._dependents.edges()
+        keep = ~np.isin(src.astype(np.int64) * num_nodes + dst, to_remove)
+        self._set_edges(src[keep], dst[keep])
+
+    def _compact(self):
+        """Merge the pending edges into the arrays, removing duplicates"""
+        num_nodes = len(self._nodes)
+        if self._dependents.num_pending or (
+                self._dependents.num_built != num_nodes):
+            src, dst = self._dependents.edges()
+            edges = np.unique(src.astype(np.int64) * num_nodes + dst)
+            self._set_edges((edges // num_nodes).astype(np.int32),
+                            (edges % num_nodes).astype(np.int32))
+
+    def _set_edges(self, src, dst):
+        """Build the arrays from unique edges, sorted by source"""
+        num_nodes = len(self._nodes)
+        runtime = getattr(self, '_dependents', None) and (
+            self._dependents.runtime, self._precedents.runtime)
+        self._dependents = _Adjacency.from_edges(src, dst, num_nodes)
+        order = np.argsort(dst, kind='stable')
+        self._precedents = _Adjacency.from_edges(
+            dst[order], src[order], num_nodes)
+        if runtime:
+            self._dependents.runtime, self._precedents.runtime = runtime
+
+    def set_runtime_precedents(self, dependent, precedents):
+        """ Replace the runtime edges to a node
+
+        Runtime edges are the references found when evaluating a formula,
+        eg: the cells OFFSET() refers to.  They are followed like the other
+        edges, but are kept apart so they are replaced when the references
+        change.  `edges` and `to_networkx` have only the other edges.
+
+        :param dependent: node of the formula
+        :param precedents: iterable of the nodes it referenced
+        :return: True if the runtime edges changed
+        """
+        dst = self.add_node(dependent)
+        return self._set_runtime(
+            dst, sorted({self.add_node(node) for node in precedents}))
+
+    def _set_runtime(self, dst, srcs):
+        dependents = self._dependents.runtime
+        precedents = self._precedents.runtime
+        if precedents.get(dst, []) == srcs:
+            return False
+
+        for src in precedents.pop(dst, ()):
+            dependents[src].remove(dst)
+            if not dependents[src]:
+                del dependents[src]
+        if srcs:
+            precedents[dst] = srcs
+            for src in srcs:
+                dependents.setdefault(src, []).append(dst)
+        return True
+
+    def _id(self, node):
+        try:
+            return self._ids[node]
+        except KeyError:
+            raise NodeNotFound(f'The node {node} is not in the graph.')
+
+    def _mask(self, node_ids):
+        mask = np.zeros(len(self._nodes), dtype=bool)
+        mask[node_ids] = True
+        return mask
+
+    def _neighbors(self, adjacency, node):
+        node_id = self._ids.get(node)
+        if node_id is None:
+            raise NodeNotFound(f'The node {node} is not in the graph.')
+        if node_id < adjacency.num_built:
+            indptr = adjacency.indptr
+            neighbors = adjacency.indices[indptr[node_id]:indptr[node_id + 1]]
+            if adjacency.num_pending and node_id in adjacency.pending:
+                neighbors = neighbors.tolist() + adjacency.pending[node_id]
+        else:
+            neighbors = adjacency.pending.get(node_id, ())
+        if adjacency.runtime and node_id in adjacency.runtime:
+            neighbors = list(neighbors) + adjacency.runtime[node_id]
+        return map(self._nodes.__getitem__, neighbors)
+
+    def predecessors(self, node):
+        """Iterator over the precedents of a node"""
+        return self._neighbors(self._precedents, node)
+
+    def successors(self, node):
+        """Iterator over the dependents of a node"""
+        return self._neighbors(self._dependents, node)
+
+    def _reachable(self, adjacency, nodes):
+        """Ids of the nodes reachable by a path of one or more edges"""
+        frontier = np.fromiter(
+            (self._id(node) for node in nodes), dtype=np.int32)
+        visited = np.zeros(len(self._nodes), dtype=bool)
+        while frontier.size:
+            neighbors = adjacency.gather(frontier)
+            frontier = np.unique(neighbors[~visited[neighbors]])
+            visited[frontier] = True
+        return np.flatnonzero(visited)
+
+    def ancestors(self, *nodes):
+        """All the nodes with a path to any of the nodes, as a set"""
+        node_list = self._nodes
+        return {node_list[i] for i in self._reachable(
+            self._precedents, nodes).tolist()}
+
+    def descendants(self, *nodes):
+        """All the nodes with a path from any of the nodes, as a set"""
+        node_list = self._nodes
+        return {node_list[i] for i in self._reachable(
+            self._dependents, nodes).tolist()}
+
+    def _node_ids(self, nodes):
+        """Array of the unique ids of the nodes, or of all the nodes"""
+        if nodes is None:
+            return np.arange(len(self._nodes), dtype=np.int32)
+        return np.unique(np.fromiter(
+            (self._id(node) for node in nodes), dtype=np.int32))
+
+    def _peel(self, adjacency, node_ids):
+        """ Peel off the nodes with no remaining neighbors, as Kahn's algorithm
+
+        With the dependents as the adjacency, each node is peeled once all of
+        its precedents have been, so the peeled order is topological.  With
+        the precedents, the sinks are peeled first.
+
+        :param adjacency: `_Adjacency` to follow from each peeled node
+        :param node_ids: array of unique node ids, only the edges between
+            them are considered
+        :return: list of the peeled ids in order, and an array of the ids
+            which could not be peeled, as they are in or after a cycle
+        """
+        if not node_ids.size:
+            return [], node_ids
+
+        in_nodes = self._mask(node_ids)
+        targets = adjacency.gather(node_ids)
+        targets = targets[in_nodes[targets]]
+        num_pending = np.bincount(targets, minlength=len(self._nodes))
+        frontier = node_ids[num_pending[node_ids] == 0]
+
+        order = []
+        while frontier.size:
+            order.append(frontier)
+            if frontier.size < 16:
+                # deep narrow graphs, step node by node
+                ready = []
+                for node_id in frontier.tolist():
+                    for target in adjacency[node_id]:
+                        if in_nodes[target]:
+                            num_pending[target] -= 1
+                            if not num_pending[target]:
+                                ready.append(target)
+                frontier = np.array(ready, dtype=np.int32)
+            else:
+                targets = adjacency.gather(frontier)
+                targets, counts = np.unique(
+                    targets[in_nodes[targets]], return_counts=True)
+                num_pending[targets] -= counts
+                frontier = targets[num_pending[targets] == 0]
+
+        order = np.concatenate(order) if order else node_ids[:0]
+        in_nodes[order] = False
+        return order.tolist(), node_ids[in_nodes[node_ids]]
+
+    def topological_sort(self, nodes=None):
+        """ The nodes, each after all of its precedents
+
+        Only the edges between the given nodes are considered.
+
+        :param nodes: iterable of nodes, or None for the entire graph
+        :return: list of nodes
+        """
+        order, remaining = self._peel(self._dependents, self._node_ids(nodes))
+        if remaining.size:
+            raise CycleError('Graph contains a cycle.')
+        node_list = self._nodes
+        return [node_list[i] for i in order]
+
+    def _tarjan(self, node_ids):
+        """ Tarjan's strongly connected components of the nodes
+
+        :param node_ids: array of unique node ids, only the edges between
+            them are considered
+        :return: list of lists of ids, each component before its precedents
+        """
+        dependents = self._dependents
+        in_nodes = self._mask(node_ids).tolist()
+        index, low = {}, {}
+        stack, on_stack = [], set()
+        components = []
+
+        for root in node_ids.tolist():
+            if root in index:
+                continue
+            index[root] = low[root] = len(index)
+            stack.append(root)
+            on_stack.add(root)
+            work = [(root, iter(dependents[root]))]
+            while work:
+                node_id, neighbors = work[-1]
+                for neighbor in neighbors:
+                    if not in_nodes[neighbor]:
+                        continue
+                    if neighbor not in index:
+                        index[neighbor] = low[neighbor] = len(index)
+                        stack.append(neighbor)
+                        on_stack.add(neighbor)
+                        work.append((neighbor, iter(dependents[neighbor])))
+                        break
+                    elif neighbor in on_stack:
+                        low[node_id] = min(low[node_id], index[neighbor])
+                else:
+                    work.pop()
+                    if work:
+                        parent = work[-1][0]
+                        low[parent] = min(low[parent], low[node_id])
+                    if low[node_id] == index[node_id]:
+                        component = []
+                        while not component or component[-1] != node_id:
+                            component.append(stack.pop())
+                            on_stack.discard(component[-1])
+                        components.append(component)
+        return components
+
+    def strongly_connected_components(self, nodes=None):
+        """ The strongly connected components, each after all of its precedents
+
+        The nodes before and after the cycles are peeled off with NumPy, so
+        only the nodes between cycles are searched one at a time.
+
+        :param nodes: iterable of nodes, or None for the entire graph.  Only
+            the edges between the given nodes are considered.
+        :return: list of lists of nodes.  A component of more than one node,
+            or of one node with an edge to itself, is a cycle.
+        """
+        sources, remaining = self._peel(
+            self._dependents, self._node_ids(nodes))
+        sinks, remaining = self._peel(self._precedents, remaining)
+        components = it.chain(
+            ([node_id] for node_id in sources),
+            reversed(self._tarjan(remaining)),
+            ([node_id] for node_id in reversed(sinks)))
+        node_list = self._nodes
+        return [[node_list[i] for i in component] for component in components]
+
+    def has_edge(self, precedent, dependent):
+        """True if there is an edge from the precedent to the dependent"""
+        return dependent in self.successors(precedent)
+
+    def subgraph(self, nodes):
+        """ A new graph of the nodes, and the edges between them
+
+        :param nodes: iterable of nodes in the graph
+        """
+        self._compact()
+        node_ids = np.unique(np.fromiter(
+            (self._id(node) for node in nodes), dtype=np.int32))
+        new_ids = np.full(len(self._nodes), -1, dtype=np.int32)
+        new_ids[node_ids] = np.arange(len(node_ids), dtype=np.int32)
+        src, dst = self._dependents.edges()
+        keep = (new_ids[src] >= 0) & (new_ids[dst] >= 0)
+
+        graph = DependencyGraph()
+        graph._nodes = [self._nodes[i] for i in node_ids.tolist()]
+        graph._ids = {node: i for i, node in enumerate(graph._nodes)}
+        graph._set_edges(new_ids[src[keep]], new_ids[dst[keep]])
+        for dst, srcs in self._precedents.runtime.items():
+            srcs = [int(new_ids[src]) for src in srcs if new_ids[src] >= 0]
+            if new_ids[dst] >= 0 and srcs:
+                graph._set_runtime(int(new_ids[dst]), srcs)
+        return graph
+
+    def to_networkx(self):
+        """ The graph as a `networkx.DiGraph`
+
+        Each node has `sheet` and `label` attributes, for export.
+        """
+        graph = nx.DiGraph()
+        graph.add_nodes_from(
+            (node, dict(sheet=node.sheet, label=node.address.coordinate))
+            for node in self._nodes)
+        graph.add_edges_from(self.edges())
+        return graph
+
+    @classmethod
+    def from_networkx(cls, graph):
+        """Build from a `networkx.DiGraph`, such as from an older pickle"""
+        dep_graph = cls()
+        for node in graph.nodes():
+            dep_graph.add_node(node)
+        for precedent, dependent in graph.edges():
+            dep_graph.add_edge(precedent, dependent)
+        return dep_graph
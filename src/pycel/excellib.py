@@ -28,6 +28,7 @@ from pycel.excelutil import (
     list_like,
     NA_ERROR,
     NUM_ERROR,
+    RangeValue,
     VALUE_ERROR,
 )
 from pycel.lib.function_helpers import (
@@ -58,6 +59,45 @@ def _numerics(*args, keep_bools=False, to_number=lambda x: x):
         return tuple(x for x in args if isinstance(x, (int, float)))
 
 
+def _range_numerics(*args):
+    """ The numbers in the args as one float64 array, when any are ranges
+
+    Ranges evaluated by the compiler are a `RangeValue`, which keeps its
+    numbers as an array, so aggregates over them are array reductions.
+    The numbers are the same as from `_numerics()`.
+
+    :return: None if no arg is a `RangeValue`, or if the numbers are ints
+        too large to sum exactly as floats, else an error code or a tuple
+        of the float64 array and whether all of the numbers are ints
+    """
+    if len(args) == 1 and isinstance(args[0], list):
+        # the args as passed from `cell_or_other_wrapper`
+        args = args[0]
+    if not any(isinstance(arg, RangeValue) for arg in args):
+        return None
+
+    arrays = []
+    all_integers = True
+    for arg in args:
+        if isinstance(arg, RangeValue):
+            if arg.error is not None:
+                return arg.error
+            arrays.append(arg.numbers)
+            all_integers = all_integers and arg.all_integers
+        else:
+            data = _numerics(arg)
+            if isinstance(data, str):
+                return data
+            arrays.append(np.array(data, dtype=np.float64))
+            all_integers = all_integers and all(
+                isinstance(x, int) for x in data)
+
+    values = arrays[0] if len(arrays) == 1 else np.concatenate(arrays)
+    if all_integers and np.abs(values).sum() > 2 ** 53:
+        return None
+    return values, all_integers
+
+
 @excel_math_func
 def abs_(value1):
     # Excel reference: https://support.microsoft.com/en-us/office/
@@ -343,7 +383,13 @@ def sign(value):
 
 @excel_helper(any_params=True)
 def sum_(*args):
-    data = _numerics(*args)
+    data = _range_numerics(*args)
+    if isinstance(data, tuple):
+        values, all_integers = data
+        total = values.sum()
+        return int(total) if all_integers else float(total)
+
+    data = data or _numerics(*args)
     if isinstance(data, str):
         return data
 
@@ -390,6 +436,17 @@ def sumproduct(*args):
     # Excel reference: https://support.microsoft.com/en-us/office/
     #   SUMPRODUCT-function-16753E75-9F68-4874-94AC-4D2145A2FD2E
 
+    if args and all(isinstance(arg, RangeValue) for arg in args):
+        # ranges from the compiler already have their numbers as arrays
+        error = next((arg.error for arg in args if arg.error), None)
+        if error:
+            return error
+        if len({arg.shape for arg in args}) != 1:
+            return VALUE_ERROR
+        return float(np.sum(np.prod(
+            [np.where(arg.number_mask, arg.floats, 0) for arg in args],
+            axis=0)))
+
     # find any errors
     error = next((i for i in flatten(args) if i in ERROR_CODES), None)
     if error:
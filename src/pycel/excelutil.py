@@ -8,9 +8,11 @@
 #   https://www.gnu.org/licenses/gpl-3.0.en.html
 
 import collections
+import functools
 import itertools as it
 import operator
 import re
+import sys
 import threading
 
 import numpy as np
@@ -105,6 +107,35 @@ PYTHON_AST_OPERATORS = {
 
 COMPARISION_OPS = frozenset(('Eq', 'Lt', 'Gt', 'LtE', 'GtE', 'NotEq'))
 
+# the operators which give the same result for ints and floats as the fixup
+NUMBER_OPERATORS = {
+    op: PYTHON_AST_OPERATORS[op] for op in (
+        'Eq', 'Lt', 'Gt', 'LtE', 'GtE', 'NotEq',
+        'Add', 'Sub', 'Mult', 'Div', 'Pow')
+}
+NUMBER_OPERATORS['USub'] = lambda left_op, right_op: -right_op
+
+# operands of these types take the fast path of the operator fixup
+NUMBER_OPERAND_TYPES = (int, float)
+
+# the numbers from which floats are not exact ints
+MAX_EXACT_FLOAT = 2 ** 53
+
+# the ufuncs for the operators of arrays of numbers
+NUMBER_UFUNCS = {
+    'Eq': np.equal,
+    'Lt': np.less,
+    'Gt': np.greater,
+    'LtE': np.less_equal,
+    'GtE': np.greater_equal,
+    'NotEq': np.not_equal,
+    'Add': np.add,
+    'Sub': np.subtract,
+    'Mult': np.multiply,
+    'Div': np.true_divide,
+    'Pow': np.power,
+}
+
 
 AddressSize = collections.namedtuple('AddressSize', 'height width')
 
@@ -242,10 +273,11 @@ class AddressRange(collections.namedtuple(
 
         coordinate = f'{start.coordinate}:{end.coordinate}'
 
+        # sheet names and coordinates are repeated across many addresses
         format_str = '{0}!{1}' if sheet else '{1}'
         return super(AddressRange, cls).__new__(
             cls, format_str.format(sheet, coordinate),
-            sheet, start, end, coordinate)
+            sys.intern(sheet), start, end, sys.intern(coordinate))
 
     def __contains__(self, address):
         address = AddressCell(address)
@@ -412,9 +444,10 @@ class AddressCell(collections.namedtuple(
         else:
             format_str = '{1}'
 
+        # sheet names and coordinates are repeated across many addresses
         return super(AddressCell, cls).__new__(
             cls, format_str.format(sheet, coordinate),
-            sheet, col_idx, row, coordinate)
+            sys.intern(sheet), col_idx, row, sys.intern(coordinate))
 
     def __contains__(self, address):
         return self == AddressCell(address)
@@ -939,6 +972,233 @@ def uniqueify(seq):
     return tuple(x for x in seq if x not in seen and not seen.add(x))
 
 
+class _ValueTypeCodes(dict):
+    """Map a value type to its RangeValue type code, for any subclasses"""
+
+    def __missing__(self, value_type):
+        if issubclass(value_type, bool):
+            code = RangeValue.BOOL
+        elif issubclass(value_type, int):
+            code = RangeValue.INTEGER
+        elif issubclass(value_type, float):
+            code = RangeValue.NUMBER
+        elif issubclass(value_type, str):
+            code = RangeValue.STRING
+        elif value_type is type(None):
+            code = RangeValue.EMPTY
+        else:
+            code = RangeValue.OTHER
+        self[value_type] = code
+        return code
+
+
+class RangeValue(tuple):
+    """ The value of a range, a tuple of rows of cell values
+
+    The values are also available as NumPy arrays, which are built on first
+    use and kept with the value, so they are built once per recalculation
+    of the range.  The numbers are a float64 array, with the type of each
+    cell in `types`, which has one of the type codes below.  Errors are
+    strings, with an `ERROR` type code.
+    """
+
+    EMPTY, NUMBER, INTEGER, BOOL, STRING, ERROR, OTHER = range(7)
+
+    _type_codes = _ValueTypeCodes()
+
+    def __reduce__(self):
+        # the arrays are not pickled
+        return type(self), (tuple(self), )
+
+    @classmethod
+    def from_sparse(cls, shape, values):
+        """ A range value from the values of its populated cells
+
+        The empty rows are one shared tuple, and the arrays are built from
+        the populated cells only.
+
+        :param shape: (rows, columns) of the range
+        :param values: dict of (row, column) offset to value
+        """
+        height, width = shape
+        populated = dict(sorted(values.items()))
+        rows = [(None, ) * width] * height
+        for row, cells in it.groupby(populated.items(), lambda x: x[0][0]):
+            row_values = [None] * width
+            for (_, col), value in cells:
+                row_values[col] = value
+            rows[row] = tuple(row_values)
+
+        range_value = cls(rows)
+        range_value.__dict__['populated'] = populated
+        return range_value
+
+    @property
+    def populated(self):
+        """For a sparse range, dict of (row, column) offset to value"""
+        return self.__dict__.get('populated')
+
+    def _cached(self, name, build):
+        try:
+            return self.__dict__[name]
+        except KeyError:
+            value = self.__dict__[name] = build()
+            return value
+
+    @property
+    def shape(self):
+        return len(self), len(self[0]) if self else 0
+
+    def _build_populated_types(self):
+        values = tuple(self.populated.values())
+        types = np.fromiter(
+            map(self._type_codes.__getitem__, map(type, values)),
+            dtype=np.int8, count=len(values))
+        for i in np.flatnonzero(types == self.STRING).tolist():
+            if values[i] in ERROR_CODES:
+                types[i] = self.ERROR
+        return types
+
+    @property
+    def populated_types(self):
+        """For a sparse range, the type code of each populated cell"""
+        return self._cached('populated_types', self._build_populated_types)
+
+    def _build_types(self):
+        if self.populated is not None:
+            types = np.full(self.shape, self.EMPTY, dtype=np.int8)
+            if self.populated:
+                rows, cols = zip(*self.populated)
+                types[rows, cols] = self.populated_types
+            return types
+
+        flat = tuple(it.chain.from_iterable(self))
+        types = np.fromiter(
+            map(self._type_codes.__getitem__, map(type, flat)),
+            dtype=np.int8, count=len(flat))
+        for i in np.flatnonzero(types == self.STRING).tolist():
+            if flat[i] in ERROR_CODES:
+                types[i] = self.ERROR
+        return types.reshape(self.shape)
+
+    @property
+    def types(self):
+        """The type code of each cell"""
+        return self._cached('types', self._build_types)
+
+    @property
+    def number_mask(self):
+        """True for the cells which are numbers, bools are not numbers"""
+        return self._cached('number_mask', lambda: (
+            (self.types == self.NUMBER) | (self.types == self.INTEGER)))
+
+    def _build_floats(self):
+        mask = self.number_mask
+        if mask.all():
+            return np.array(self, dtype=np.float64).reshape(self.shape)
+        floats = np.full(self.shape, np.nan)
+        rows, cols = np.nonzero(mask)
+        floats[rows, cols] = [
+            self[row][col] for row, col in zip(rows.tolist(), cols.tolist())]
+        return floats
+
+    @property
+    def floats(self):
+        """The cells as float64, NaN where the cell is not a number"""
+        return self._cached('floats', self._build_floats)
+
+    def _build_numbers(self):
+        if self.populated is None:
+            return self.floats[self.number_mask]
+
+        # sparse, only the populated cells
+        types = self.populated_types
+        return np.fromiter(
+            (value for value, code in zip(self.populated.values(), types)
+             if code == self.NUMBER or code == self.INTEGER),
+            dtype=np.float64,
+            count=int(((types == self.NUMBER) | (types == self.INTEGER)).sum()))
+
+    @property
+    def numbers(self):
+        """The numbers in the range, in row major order"""
+        return self._cached('numbers', self._build_numbers)
+
+    def _build_all_integers(self):
+        types = self.types if self.populated is None else self.populated_types
+        return not (types == self.NUMBER).any()
+
+    @property
+    def all_integers(self):
+        """True if none of the numbers in the range are floats"""
+        return self._cached('all_integers', self._build_all_integers)
+
+    def _build_error(self):
+        if self.populated is not None:
+            errors = np.flatnonzero(self.populated_types == self.ERROR)
+            if len(errors):
+                return next(it.islice(
+                    self.populated.values(), int(errors[0]), None))
+            return None
+
+        errors = np.flatnonzero(self.types == self.ERROR)
+        if len(errors):
+            return self[errors[0] // self.shape[1]][errors[0] % self.shape[1]]
+
+    @property
+    def error(self):
+        """The first error in row major order, or None"""
+        return self._cached('error', self._build_error)
+
+    def _build_objects(self):
+        objects = np.empty(self.shape, dtype=object)
+        for i, row in enumerate(self):
+            objects[i] = row
+        return objects
+
+    @property
+    def objects(self):
+        """The cells as an object array, for values of mixed types"""
+        return self._cached('objects', self._build_objects)
+
+
+@functools.lru_cache(maxsize=None)
+def _slot_descriptors(cls):
+    """The slot descriptors of a class and its bases, by name"""
+    return {name: klass.__dict__[name]
+            for klass in reversed(cls.__mro__)
+            for name in klass.__dict__.get('__slots__', ())
+            if name != '__weakref__'}
+
+
+def slots_getstate(obj):
+    """ The values of the `__slots__` of an object, as a dict for pickling
+
+    Slots which are unset are left out.  The slot descriptors are used
+    directly, so a property which shadows a slot in a subclass is skipped.
+    """
+    state = {}
+    for name, descriptor in _slot_descriptors(type(obj)).items():
+        try:
+            state[name] = descriptor.__get__(obj)
+        except AttributeError:
+            pass
+    return state
+
+
+def slots_setstate(obj, state):
+    """ Restore the `__slots__` of an object from a dict
+
+    The dict can also be the `__dict__` of an object pickled before the
+    class had slots.  Names which are no longer slots are ignored.
+    """
+    descriptors = _slot_descriptors(type(obj))
+    for name, value in state.items():
+        descriptor = descriptors.get(name)
+        if descriptor is not None:
+            descriptor.__set__(obj, value)
+
+
 def is_number(value):
     try:
         float(value)
@@ -1109,6 +1369,9 @@ def find_corresponding_index_generator(rng, criteria):
     check = criteria_parser(criteria)
 
     assert_list_like(rng)
+    if getattr(rng, 'populated', None) is not None and not check(None):
+        # sparse range, where the empty cells do not match
+        return ((r, c) for (r, c), item in rng.populated.items() if check(item))
     return ((r, c) for r, row in enumerate(rng)
             for c, item in enumerate(row) if check(item))
 
@@ -1184,10 +1447,103 @@ class ExcelCmp(collections.namedtuple('ExcelCmp', 'cmp_type value empty')):
         return not self == other
 
 
+def _number_operand(value):
+    """ An operand of an array operator as arrays, if it is numbers
+
+    Numbers too large to be exact as floats are passed to the fixup.
+
+    :param value: a number, or a tuple of rows
+    :return: floats, mask of the elements which are not numbers, and the
+        value, or None if the value is neither a number nor rows
+    """
+    if type(value) in NUMBER_OPERAND_TYPES:
+        if abs(value) < MAX_EXACT_FLOAT:
+            return np.float64(value), np.False_, value
+        return np.float64(np.nan), np.True_, value
+
+    if not isinstance(value, RangeValue):
+        if not (isinstance(value, tuple) and value and all(
+                isinstance(row, tuple) and len(row) == len(value[0])
+                for row in value)):
+            return None
+        value = RangeValue(value)
+    try:
+        floats = value.floats
+    except OverflowError:
+        return None
+    with np.errstate(invalid='ignore'):
+        return floats, ~value.number_mask | (
+            np.abs(floats) >= MAX_EXACT_FLOAT), value
+
+
 def build_operator_operand_fixup(capture_error_state):
 
+    def number_array_fixup(left_op, op, right_op):
+        """ Operators of arrays of numbers as ufuncs
+
+        The elements which are not numbers, or whose result is not finite,
+        eg: division by zero, are passed to the fixup.  As in the fixup,
+        whole floats are ints, so their sums, differences, products and
+        powers are ints, if they are exact.
+
+        :return: the result, or None if the operands are not arrays of numbers
+        """
+        ufunc = NUMBER_UFUNCS.get(op)
+        left = ufunc and _number_operand(left_op)
+        right = left and _number_operand(right_op)
+        if right is None:
+            return None
+
+        left_floats, left_other, left_op = left
+        right_floats, right_other, right_op = right
+        try:
+            shape = np.broadcast(left_floats, right_floats).shape
+        except ValueError:
+            return None
+        if len(shape) != 2:
+            return None
+
+        with np.errstate(all='ignore'):
+            result = ufunc(left_floats, right_floats)
+            to_fixup = np.broadcast_to(left_other | right_other, shape)
+            ints = None
+            if op in ('Add', 'Sub', 'Mult', 'Pow'):
+                ints = (np.floor(left_floats) == left_floats) & (
+                    np.floor(right_floats) == right_floats)
+                if op == 'Pow':
+                    ints &= right_floats >= 0
+            if result.dtype == np.float64:
+                to_fixup = to_fixup | ~np.isfinite(result)
+                if ints is not None:
+                    to_fixup = to_fixup | (
+                        ints & (np.abs(result) >= MAX_EXACT_FLOAT))
+
+        if ints is None or not ints.any():
+            values = result.tolist()
+        else:
+            exact = np.where(ints & ~to_fixup, result, 0).astype(np.int64)
+            if ints.all():
+                values = exact.tolist()
+            else:
+                values = np.where(ints, exact.astype(object),
+                                  result.astype(object)).tolist()
+
+        if to_fixup.any():
+            left_objects, right_objects = (np.broadcast_to(
+                value.objects if isinstance(value, RangeValue)
+                else np.array(value, dtype=object), shape)
+                for value in (left_op, right_op))
+            for row, col in zip(*np.nonzero(to_fixup)):
+                values[row][col] = fixup(
+                    left_objects[row, col], op, right_objects[row, col])
+        return tuple(map(tuple, values))
+
     def array_fixup(left_op, op, right_op):
         """use numpy broadcasting for ranges"""
+        result = number_array_fixup(left_op, op, right_op)
+        if result is not None:
+            return result
+
         # ::TODO:: this needs better error processing to match excel behavior
         left_op = np.array(left_op, dtype=object)
         right_op = np.array(right_op, dtype=object)
@@ -1210,6 +1566,23 @@ def build_operator_operand_fixup(capture_error_state):
             String to Number coercion
             String / Number multiplication
         """
+        if type(right_op) in NUMBER_OPERAND_TYPES and (
+                type(left_op) in NUMBER_OPERAND_TYPES or op == 'USub'):
+            # fast path for numbers, not bools, which need no fixup
+            number_op = NUMBER_OPERATORS.get(op)
+            if number_op is not None:
+                # whole floats are ints, as from coerce_to_number()
+                if type(left_op) is float and left_op.is_integer():
+                    left_op = int(left_op)
+                if type(right_op) is float and right_op.is_integer():
+                    right_op = int(right_op)
+                try:
+                    return number_op(left_op, right_op)
+                except ZeroDivisionError:
+                    capture_error_state(
+                        True, f'Values: {left_op} {op} {right_op}')
+                    return DIV0
+
         left_list, right_list = list_like(left_op), list_like(right_op)
         if not left_list and left_op in ERROR_CODES:
             return left_op
@@ -1291,6 +1664,7 @@ class _IterativeEvalTracker:
 
     def __call__(self, iterations=100, tolerance=0.001):
         self.ns.iteration_number = 0
+        self.ns.todo.clear()
         self.ns.iterations = iterations
         self.ns.tolerance = tolerance
         return self
@@ -1299,10 +1673,15 @@ class _IterativeEvalTracker:
     def tolerance(self):
         return self.ns.tolerance
 
+    @property
+    def converged(self):
+        """No cell changed by more than the tolerance this iteration"""
+        return not self.ns.todo
+
     @property
     def done(self):
         return (self.ns.iteration_number >= self.ns.iterations or
-                not self.ns.todo)
+                self.converged)
 
     def wip(self, cell):
         """Which cells are currently a Work In Progress"""
@@ -1312,6 +1691,10 @@ class _IterativeEvalTracker:
         """Mark which cells have been done this iteration"""
         self.ns.computed.add(cell)
 
+    def uncalced(self, cell):
+        """Forget that a cell has been done this iteration"""
+        self.ns.computed.discard(cell)
+
     def is_calced(self, cell):
         """Which cells have been done this iteration"""
         return cell in self.ns.computed
@@ -1321,5 +1704,25 @@ class _IterativeEvalTracker:
         self.ns.todo.clear()
         self.ns.computed.clear()
 
+    def iterate(self, cells):
+        """ Iterations over the cells of one cycle
+
+        Each iteration forgets only that these cells were done, so the cells
+        outside of the cycle are not recalculated.  The iterations stop when
+        none of the cells changed by more than the tolerance, or after the
+        number of iterations.
+
+        :param cells: the cells of the cycle
+        :return: generator of the iteration numbers
+        """
+        self.ns.iteration_number = 0
+        while True:
+            self.ns.iteration_number += 1
+            self.ns.todo.clear()
+            self.ns.computed.difference_update(cells)
+            yield self.ns.iteration_number
+            if self.done:
+                return
+
 
 iterative_eval_tracker = _IterativeEvalTracker()
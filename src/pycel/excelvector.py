@@ -0,0 +1,230 @@
+# -*- coding: UTF-8 -*-
+#
+# Copyright 2011-2019 by Dirk Gorissen, Stephen Rauch and Contributors
+# All rights reserved.
+# This file is part of the Pycel Library, Licensed under GPLv3 (the 'License')
+# You may not use this work except in compliance with the License.
+# You may obtain a copy of the Licence at:
+#   https://www.gnu.org/licenses/gpl-3.0.en.html
+
+"""
+Evaluate the python code of compiled formulas over NumPy arrays.
+
+Only a small subset of formulas can be evaluated this way: numeric
+arithmetic and comparisons, and a few elementwise functions.  Anything else
+raises `NotVectorizable`, and the caller is expected to fall back to the
+scalar evaluator.  Elements which do not evaluate to a finite number are
+also left for the scalar evaluator, so that excel error semantics are kept.
+"""
+
+import ast
+import math
+from numbers import Number
+
+import numpy as np
+
+from pycel.excelutil import PyCelException, PYTHON_AST_OPERATORS
+
+
+class NotVectorizable(PyCelException):
+    """Formula or operands which can not be evaluated as arrays"""
+
+
+VECTOR_OPERATORS = frozenset((
+    'Add', 'Sub', 'Mult', 'Div', 'Pow',
+    'Eq', 'NotEq', 'Lt', 'Gt', 'LtE', 'GtE',
+))
+
+COMPARISON_OPERATORS = frozenset(('Eq', 'NotEq', 'Lt', 'Gt', 'LtE', 'GtE'))
+
+
+def _vector_operand(value, is_comparison=False):
+    """Check that an operand can be used in array arithmetic"""
+    if isinstance(value, np.ndarray):
+        if value.dtype.kind == 'b' and is_comparison:
+            # excel compares bools above all numbers
+            raise NotVectorizable('Boolean array comparison')
+        if value.dtype.kind not in 'biuf':
+            raise NotVectorizable(f'Array of {value.dtype}')
+        return value
+
+    elif value is None:
+        # empty cells are zero for arithmetic and numeric comparisons
+        return 0
+
+    elif isinstance(value, bool):
+        if is_comparison:
+            raise NotVectorizable('Boolean comparison')
+        return value
+
+    elif isinstance(value, Number) and not isinstance(value, complex):
+        return value
+
+    raise NotVectorizable(f'Operand: {value!r}')
+
+
+def _float_operand(value, is_comparison=False):
+    """Bools and ints are coerced to float, as for scalar arithmetic"""
+    return np.asarray(_vector_operand(value, is_comparison), dtype=float)
+
+
+def vector_operator(left_op, op, right_op):
+    """Apply a binary operator to arrays or scalars"""
+    is_comparison = op in COMPARISON_OPERATORS
+    left_op = _float_operand(left_op, is_comparison)
+    right_op = _float_operand(right_op, is_comparison)
+    with np.errstate(all='ignore'):
+        return PYTHON_AST_OPERATORS[op](left_op, right_op)
+
+
+def vector_unary_operator(op, operand):
+    """Apply a unary operator to arrays or scalars"""
+    return PYTHON_AST_OPERATORS[op](_float_operand(operand))
+
+
+def vector_if(test, true_value, false_value=0):
+    """IF() for numeric values, a bool result would be coerced to float"""
+    test = _vector_operand(test)
+    values = tuple(map(_vector_operand, (true_value, false_value)))
+    if any(isinstance(v, bool) or getattr(v, 'dtype', None) == bool
+           for v in values):
+        raise NotVectorizable('Boolean IF() value')
+    return np.where(test, *values)
+
+
+def _vector_math(func):
+    def wrapper(value):
+        with np.errstate(all='ignore'):
+            return func(_float_operand(value))
+    return wrapper
+
+
+VECTOR_FUNCTIONS = {
+    'abs_': _vector_math(np.abs),
+    'if_': vector_if,
+    'sqrt': _vector_math(np.sqrt),
+}
+
+
+class _VectorTransformer(ast.NodeTransformer):
+    """Rewrite operators into vector function calls, reject anything else"""
+
+    def generic_visit(self, node):
+        raise NotVectorizable(f'Unsupported syntax: {type(node).__name__}')
+
+    def visit_Expression(self, node):
+        return ast.NodeTransformer.generic_visit(self, node)
+
+    def visit_Constant(self, node):
+        return node
+
+    visit_Num = visit_Str = visit_NameConstant = visit_Constant
+
+    def visit_Name(self, node):
+        if node.id not in ('pi', 'True', 'False'):
+            raise NotVectorizable(f'Unsupported name: {node.id}')
+        return node
+
+    def visit_Call(self, node):
+        if not isinstance(node.func, ast.Name) or node.keywords:
+            raise NotVectorizable('Unsupported call')
+
+        if node.func.id == '_C_':
+            if len(node.args) != 1 or _constant_value(node.args[0]) is None:
+                raise NotVectorizable('Non-constant cell reference')
+            return node
+
+        if node.func.id not in VECTOR_FUNCTIONS:
+            raise NotVectorizable(f'Function: {node.func.id}')
+        node.args = [self.visit(arg) for arg in node.args]
+        return node
+
+    def visit_Lambda(self, node):
+        # the params of IF() passed to be evaluated only if needed
+        if node.args.args:
+            raise NotVectorizable('Lambda with arguments')
+        return self.visit(node.body)
+
+    def visit_BinOp(self, node):
+        return self._call('_VOP_', node.left, type(node.op).__name__, node.right)
+
+    def visit_Compare(self, node):
+        if len(node.ops) != 1:
+            raise NotVectorizable('Chained comparison')
+        return self._call(
+            '_VOP_', node.left, type(node.ops[0]).__name__, node.comparators[0])
+
+    def visit_UnaryOp(self, node):
+        op = type(node.op).__name__
+        if op not in ('USub', 'UAdd'):
+            raise NotVectorizable(f'Operator: {op}')
+        return ast.Call(
+            func=ast.Name(id='_VUOP_', ctx=ast.Load()),
+            args=[ast.Str(s=op), self.visit(node.operand)],
+            keywords=[],
+        )
+
+    def _call(self, func, left, op, right):
+        if op not in VECTOR_OPERATORS:
+            raise NotVectorizable(f'Operator: {op}')
+        return ast.Call(
+            func=ast.Name(id=func, ctx=ast.Load()),
+            args=[self.visit(left), ast.Str(s=op), self.visit(right)],
+            keywords=[],
+        )
+
+
+def _constant_value(node):
+    """The value of a str constant node, else None"""
+    value = getattr(node, 'value', getattr(node, 's', None))
+    return value if isinstance(value, str) else None
+
+
+def build_vector_lambda(python_code):
+    """ Compile formula python code to evaluate over arrays
+
+    :param python_code: python code for a formula, as from `ExcelFormula`
+    :return: function taking a function which resolves a cell address to
+        its array or scalar value
+    """
+    try:
+        tree = ast.parse(python_code, mode='eval')
+    except SyntaxError as exc:
+        raise NotVectorizable(str(exc))
+    tree = ast.fix_missing_locations(_VectorTransformer().visit(tree))
+    code = compile(tree, '<vector>', 'eval')
+
+    name_space = dict(VECTOR_FUNCTIONS)
+    name_space.update(
+        _VOP_=vector_operator, _VUOP_=vector_unary_operator, pi=math.pi)
+
+    def vector_lambda(resolve_cell):
+        return eval(code, dict(name_space, _C_=resolve_cell))
+
+    return vector_lambda
+
+
+def to_vector(values):
+    """ Build a 1d array from a sequence of evaluated values
+
+    Numbers become float64, bools become bool, and anything else (strings,
+    errors, tuples, etc) an object array.
+    """
+    if all(isinstance(v, bool) for v in values):
+        return np.array(values, dtype=bool)
+
+    if all(isinstance(v, Number) and not isinstance(v, bool) and
+           not isinstance(v, complex) for v in values):
+        return np.array(values, dtype=float)
+
+    result = np.empty(len(values), dtype=object)
+    for i, value in enumerate(values):
+        result[i] = value
+    return result
+
+
+def finite_mask(result):
+    """For a vector result, which elements are usable as is"""
+    if result.dtype.kind == 'b':
+        return np.ones(result.shape, dtype=bool)
+    return np.isfinite(result)
@@ -14,6 +14,7 @@
 """
 
 import abc
+import bisect
 import collections
 import os
 from unittest import mock
@@ -28,15 +29,33 @@ ARRAY_FORMULA_NAME = '=CSE_INDEX'
 ARRAY_FORMULA_FORMAT = '{}(%s,%s,%s,%s,%s)'.format(ARRAY_FORMULA_NAME)
 
 
+def _worksheet_cells(worksheet):
+    """The cells openpyxl has for a worksheet, a dict by (row, column)
+
+    openpyxl has no public api for only the populated cells, so this reads
+    the private `_cells` of the worksheet.
+    """
+    return worksheet._cells
+
+
 class ExcelWrapper:
     __metaclass__ = abc.ABCMeta
 
     RangeData = collections.namedtuple('RangeData', 'address formula values')
 
+    # The populated cells of a range.  The formula and values are dicts of
+    # the (row, column) offset in the range to the formula or value.
+    SparseRangeData = collections.namedtuple(
+        'SparseRangeData', 'address formula values')
+
     @abc.abstractmethod
     def get_range(self, address):
         """"""
 
+    def get_sparse_range(self, address):
+        """The populated cells of a range, if it is better read sparsely"""
+        return None
+
     @abc.abstractmethod
     def get_used_range(self):
         """"""
@@ -147,6 +166,11 @@ class ExcelOpxWrapper(ExcelWrapper):
     CfRule = collections.namedtuple(
         'CfRule', 'formula priority dxf_id dxf stop_if_true')
 
+    # Unbounded ranges are read as sparse ranges, as are ranges with at
+    # least this many cells, if at most this fraction of them are populated
+    sparse_min_size = 65536
+    sparse_max_density = 0.25
+
     def __init__(self, filename, app=None):
         super(ExcelWrapper, self).__init__()
 
@@ -157,6 +181,7 @@ class ExcelOpxWrapper(ExcelWrapper):
         self.workbook = None
         self.workbook_dataonly = None
         self._max_col_row = {}
+        self._populated_index = {}
 
     def max_col_row(self, sheet):
         if sheet not in self._max_col_row:
@@ -338,6 +363,90 @@ class ExcelOpxWrapper(ExcelWrapper):
             else:
                 return _OpxRange(cells, cells_dataonly, address)
 
+    def get_sparse_range(self, address):
+        """The populated cells of an unbounded, or a large and sparse, range
+
+        :param address: the range address
+        :return: `SparseRangeData`, or None if the range should be read
+            with `get_range`
+
+        The empty cells of the range are not read, so openpyxl does not
+        create them.
+        """
+        if not is_address(address):
+            address = AddressRange(address)
+        if not address.is_range:
+            return None
+
+        if address.has_sheet:
+            sheet = self.workbook[address.sheet]
+            sheet_dataonly = self.workbook_dataonly[address.sheet]
+        else:
+            sheet = self.workbook.active
+            sheet_dataonly = self.workbook_dataonly.active
+
+        if address.is_unbounded_range:
+            address = address & AddressRange(
+                (1, 1, *self.max_col_row(sheet.title)), sheet=sheet.title)
+
+        elif address.size.height * address.size.width < self.sparse_min_size:
+            return None
+
+        top_left = _worksheet_cells(sheet).get(
+            (address.start.row, address.start.col_idx))
+        if top_left is not None and str(top_left.value).startswith(
+                ARRAY_FORMULA_NAME):
+            # the range may be a CSE Array Formula
+            return None
+
+        with mock.patch('openpyxl.worksheet._reader.from_excel',
+                        self.from_excel):
+            sparse_range = self._sparse_range(sheet, sheet_dataonly, address)
+
+        if len(sparse_range.values) > self.sparse_max_density * (
+                address.size.height * address.size.width):
+            return None
+        return sparse_range
+
+    def _populated_rows(self, sheet, sheet_dataonly):
+        """ The rows of the cells of a sheet, sorted, by column
+
+        The cells of both workbooks are indexed once per sheet, so each
+        sparse range only looks up its columns.
+        """
+        if sheet.title not in self._populated_index:
+            columns = collections.defaultdict(list)
+            for row, col in set(_worksheet_cells(sheet)).union(
+                    _worksheet_cells(sheet_dataonly)):
+                columns[col].append(row)
+            self._populated_index[sheet.title] = {
+                col: sorted(rows) for col, rows in columns.items()}
+        return self._populated_index[sheet.title]
+
+    def _sparse_range(self, sheet, sheet_dataonly, address):
+        first_row, last_row = address.start.row, address.end.row
+        first_col, last_col = address.start.col_idx, address.end.col_idx
+        populated = sorted(
+            (row, col) for col, rows in self._populated_rows(
+                sheet, sheet_dataonly).items()
+            if first_col <= col <= last_col
+            for row in rows[bisect.bisect_left(rows, first_row):
+                            bisect.bisect_right(rows, last_row)])
+
+        cells = _worksheet_cells(sheet)
+        cells_dataonly = _worksheet_cells(sheet_dataonly)
+        formulas, values = {}, {}
+        for row, col in populated:
+            cell = cells.get((row, col))
+            formula = '' if cell is None else _OpxRange.cell_to_formula(cell)
+            cell_dataonly = cells_dataonly.get((row, col))
+            value = None if cell_dataonly is None else cell_dataonly.value
+            if formula or value is not None:
+                offset = row - first_row, col - first_col
+                formulas[offset] = formula
+                values[offset] = value
+        return self.SparseRangeData(address, formulas, values)
+
     def get_used_range(self):
         return self.workbook.active.iter_rows()
 
@@ -384,3 +493,11 @@ class ExcelOpxWrapperNoData(ExcelOpxWrapper):
             return self.OpxRange(data)
         else:
             return self.OpxCell(data)
+
+    def get_sparse_range(self, address):
+        data = super().get_sparse_range(address)
+        if data is not None:
+            data = self.SparseRangeData(data.address, data.formula, {
+                offset: self.excel_value(data.formula[offset], value)
+                for offset, value in data.values.items()})
+        return data
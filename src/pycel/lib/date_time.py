@@ -544,6 +544,7 @@ def month(serial_number):
     #   networkdays-intl-function-a9b26239-4f20-46a1-9ab8-4e925bfd5e28
 
 
+@excel_helper(volatile=True)
 def now():
     # Excel reference: https://support.microsoft.com/en-us/office/
     #   now-function-3337fd29-145a-4347-b2e6-20c904739c46
@@ -613,6 +614,7 @@ def timevalue(value):
     return serial_number
 
 
+@excel_helper(volatile=True)
 def today():
     # Excel reference: https://support.microsoft.com/en-us/office/
     #   today-function-5eb3078d-a82c-4736-8930-2f51a028fdd9
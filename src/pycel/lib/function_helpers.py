@@ -11,6 +11,7 @@ import collections
 import functools
 import inspect
 import sys
+from types import LambdaType
 
 from pycel.excelutil import (
     AddressCell,
@@ -19,6 +20,7 @@ from pycel.excelutil import (
     coerce_to_string,
     ERROR_CODES,
     flatten,
+    is_address,
     is_array_arg,
     is_number,
     NUM_ERROR,
@@ -30,6 +32,11 @@ FUNC_META = 'excel_func_meta'
 
 ALL_ARG_INDICES = frozenset(range(512))
 
+# the functions whose params the formulas may pass as functions without
+# arguments, by their name in the python code, see `FunctionNode.lazy_funcs`
+LAZY_PARAM_FUNCTIONS = frozenset(
+    ('choose', 'if_', 'iferror', 'ifna', 'ifs', 'switch'))
+
 star_args = set()
 
 
@@ -39,7 +46,9 @@ def excel_helper(cse_params=None,
                  number_params=None,
                  str_params=None,
                  ref_params=None,
-                 any_params=None):
+                 any_params=None,
+                 volatile=False,
+                 needed_params=None):
     """ Decorator to annotate a function with info on how to process params
 
     All parameters are encoded as:
@@ -57,6 +66,12 @@ def excel_helper(cse_params=None,
     :param number_params: params to coerce to numbers
     :param str_params: params to coerce to strings
     :param ref_params: params which can remain as references
+    :param volatile: the result can change without its params changing,
+        so the cells using the function are recalculated by
+        `ExcelCompiler.recalculate_volatile`
+    :param needed_params: function, passed the params as functions, which
+        returns the indices of the params needed for the result, or None
+        for all.  See `lazy_wrapper`
     :return: decorator
     """
     def mark(f):
@@ -72,6 +87,8 @@ def excel_helper(cse_params=None,
             str_params=str_params,
             ref_params=ref_params,
             any_params=any_params,
+            volatile=volatile,
+            needed_params=needed_params,
         ))
         return f
     return mark
@@ -108,6 +125,10 @@ def apply_meta(f, meta=None, name_space=None):
             all_params = set(range(getattr(getattr(f, '__code__', None), 'co_argcount', 0))
                              ) or ALL_ARG_INDICES
 
+        # report the references returned by volatile functions
+        if meta.get('volatile'):
+            f = referenced_wrapper(f, name_space)
+
         # process error strings
         err_str_params = meta['err_str_params']
         if err_str_params is not None:
@@ -143,6 +164,11 @@ def apply_meta(f, meta=None, name_space=None):
         if any_params:
             f = cell_or_other_wrapper(f, name_space)
 
+        # evaluate only the params needed, eg: the value selected by IF()
+        needed_params = meta.get('needed_params')
+        if needed_params is not None:
+            f = lazy_wrapper(f, needed_params)
+
     return f, meta
 
 
@@ -329,6 +355,26 @@ def refs_wrapper(f, name_space, param_indices=None):
     return wrapper
 
 
+def referenced_wrapper(f, name_space):
+    """wrapper to report the references returned by a volatile function
+
+    The addresses returned, eg: by OFFSET(), are passed to the
+    `_REFERENCED_` function of the name space, if there is one.
+
+    :param f: function to wrap
+    :return: wrapped function
+    """
+    @functools.wraps(f)
+    def wrapper(*args):
+        result = f(*args)
+        if is_address(result):
+            referenced = name_space.get('_REFERENCED_')
+            if referenced is not None:
+                referenced(result)
+        return result
+    return wrapper
+
+
 def cell_or_other_wrapper(f, name_space):
     """wrapper to process ranges AND cells AND regular arguments
 
@@ -336,11 +382,15 @@ def cell_or_other_wrapper(f, name_space):
     :return: wrapped function, with list arguments processed
     """
     _C_ = name_space.get('_C_')
+    _R_ = name_space.get('_R_')
 
     def resolve_args(args):
         for _, arg in enumerate(args):
             if isinstance(arg, AddressCell):
                 yield _C_(arg.address)
+            elif isinstance(arg, AddressRange):
+                # eg: a range returned by OFFSET()
+                yield _R_(arg.address)
             else:
                 yield arg
 
@@ -351,6 +401,56 @@ def cell_or_other_wrapper(f, name_space):
     return wrapper
 
 
+class _LazyParam:
+    """A param, evaluated when it is first called"""
+
+    __slots__ = ('_func', '_value')
+
+    def __init__(self, arg):
+        if isinstance(arg, LambdaType):
+            self._func = arg
+        else:
+            self._func = None
+            self._value = arg
+
+    def __call__(self):
+        if self._func is not None:
+            self._value = self._func()
+            self._func = None
+        return self._value
+
+    @property
+    def evaluated(self):
+        return self._func is None
+
+
+def lazy_wrapper(f, needed_params):
+    """wrapper to evaluate only the params needed for the result
+
+    The generated code for functions like IF() passes the params which may
+    not be needed as functions without arguments.  `needed_params` is
+    passed all of the params, as functions, and returns the indices of
+    the params needed, or None for all.  The params which are neither
+    needed nor already evaluated are passed to `f` as None.
+
+    :param f: function to wrap
+    :param needed_params: function returning the indices of the params needed
+    :return: wrapped function
+    """
+    @functools.wraps(f)
+    def wrapper(*args):
+        if not any(isinstance(arg, LambdaType) for arg in args):
+            return f(*args)
+
+        params = tuple(_LazyParam(arg) for arg in args)
+        needed = needed_params(*params)
+        return f(*(param() if needed is None or i in needed or
+                   param.evaluated else None
+                   for i, param in enumerate(params)))
+
+    return wrapper
+
+
 def built_in_wrapper(f, wrapper_marker, name_space):
     meta = getattr(wrapper_marker(lambda x: x), FUNC_META)  # pragma: no branch
     return apply_meta(f, meta, name_space)[0]
@@ -373,11 +473,25 @@ def load_functions(names, name_space, modules):
                         f, excel_math_func, name_space=name_space)
                 else:
                     f, meta = apply_meta(f, name_space=name_space)
+                    if name in LAZY_PARAM_FUNCTIONS and not (
+                            meta and meta.get('needed_params')):
+                        # eg: a plugin, evaluate all of the params first
+                        f = lazy_wrapper(f, lambda *params: None)
                 name_space[name] = f
 
     return not_found
 
 
+def volatile_names(modules):
+    """The names of the functions marked volatile by `excel_helper`"""
+    names = {}
+    for module in reversed(modules):
+        for name in dir(module):
+            meta = getattr(getattr(module, name), FUNC_META, None)
+            names[name] = bool(meta and meta.get('volatile'))
+    return {name for name, volatile in names.items() if volatile}
+
+
 def load_to_test_module(load_from, load_to_name):
     # dynamic load the lib functions from 'load_from' and apply metadata
     load_to = sys.modules[load_to_name]
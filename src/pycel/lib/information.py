@@ -25,7 +25,7 @@ from pycel.lib.function_helpers import excel_helper
 CELL_INFO_TYPE = ['contents']
 
 
-@excel_helper(cse_params=0, ref_params=1, str_params=0)
+@excel_helper(cse_params=0, ref_params=1, str_params=0, volatile=True)
 def cell(info_type, ref):
     # Excel reference: https://support.microsoft.com/en-us/office/
     #   cell-function-51bd39a5-f338-4dbe-a33f-955d67c2b2cf
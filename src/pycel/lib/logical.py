@@ -20,7 +20,9 @@ from pycel.excelutil import (
     flatten,
     has_array_arg,
     in_array_formula_context,
+    is_address,
     is_array_arg,
+    list_like,
     NA_ERROR,
     VALUE_ERROR,
 )
@@ -47,6 +49,51 @@ def _clean_logical(test):
         return VALUE_ERROR
 
 
+def _is_scalar(value):
+    """Is the value selected on, not an array or a reference"""
+    return not list_like(value) and not is_address(value)
+
+
+def _if_needed(test, *args):
+    # the value selected, unless an array result might be needed
+    test = test()
+    if in_array_formula_context or not _is_scalar(test):
+        return None
+    cleaned = _clean_logical(test)
+    if isinstance(cleaned, str):
+        return {0}
+    return {0, 1 if cleaned else 2}
+
+
+def _iferror_needed(arg, value_if_error, error_codes=ERROR_CODES):
+    arg = arg()
+    if in_array_formula_context or not _is_scalar(arg):
+        return None
+    return {0, 1} if arg in error_codes else {0}
+
+
+def _ifna_needed(arg, value_if_na):
+    return _iferror_needed(arg, value_if_na, error_codes=(NA_ERROR, ))
+
+
+def _ifs_needed(*args):
+    # the tests, in order, until the first which is true and its value
+    if in_array_formula_context:
+        return None
+    if len(args) % 2:
+        return set()
+    for i in range(0, len(args), 2):
+        test = args[i]()
+        if not _is_scalar(test):
+            return None
+        if test in ERROR_CODES or isinstance(test, str) and (
+                test.lower() not in ('true', 'false')):
+            break
+        if test if not isinstance(test, str) else len(test) == 4:
+            return {i + 1}
+    return set()
+
+
 def _clean_logicals(*args):
     """For logicals that take more than one argument, clean via excel rules"""
     values = tuple(flatten(args))
@@ -79,7 +126,8 @@ def and_(*args):
     #   false-function-2d58dfa5-9c03-4259-bf8f-f0ae14346904
 
 
-@excel_helper(cse_params=(0, 1, 2), err_str_params=0)
+@excel_helper(cse_params=(0, 1, 2), err_str_params=0,
+              needed_params=_if_needed)
 def if_(test, true_value, false_value=0):
     # Excel reference: https://support.microsoft.com/en-us/office/
     #   IF-function-69AED7C9-4E8A-4755-A9BC-AA8BBFF73BE2
@@ -92,6 +140,8 @@ def if_(test, true_value, false_value=0):
         return true_value if cleaned else false_value
 
 
+@excel_helper(err_str_params=None, ref_params=-1,
+              needed_params=_iferror_needed)
 def iferror(arg, value_if_error):
     # Excel reference: https://support.microsoft.com/en-us/office/
     #   IFERROR-function-C526FD07-CAEB-47B8-8BB6-63F3E417F611
@@ -103,6 +153,7 @@ def iferror(arg, value_if_error):
         return arg
 
 
+@excel_helper(err_str_params=None, ref_params=-1, needed_params=_ifna_needed)
 def ifna(arg, value_if_na):
     # Excel reference: https://support.microsoft.com/en-us/office/
     #   ifna-function-6626c961-a569-42fc-a49d-79b4951fd461
@@ -114,6 +165,7 @@ def ifna(arg, value_if_na):
         return arg
 
 
+@excel_helper(err_str_params=None, ref_params=-1, needed_params=_ifs_needed)
 def ifs(*args):
     # IFS function
     # Excel 2016
@@ -165,7 +217,27 @@ def or_(*args):
         return any(values)
 
 
-@excel_helper(cse_params=-1)
+def _switch_needed(lookup_value, *args):
+    # the values to match, in order, until the first match and its result
+    lookup_value = lookup_value()
+    if in_array_formula_context or not _is_scalar(lookup_value):
+        return None
+    if lookup_value in ERROR_CODES or len(args) < 2:
+        return set()
+
+    lookup_value = ExcelCmp(lookup_value)
+    for i in range(0, len(args) - 1, 2):
+        to_match = args[i]()
+        if not _is_scalar(to_match):
+            return None
+        if to_match in ERROR_CODES:
+            return set()
+        if ExcelCmp(to_match) == lookup_value:
+            return {i + 2}
+    return {len(args)} if len(args) % 2 else set()
+
+
+@excel_helper(cse_params=-1, needed_params=_switch_needed)
 def switch(lookup_value, *args):
     # Evaluates an expression against a list of values and returns the result
     # corresponding to the first matching value. If there is no match, an optional
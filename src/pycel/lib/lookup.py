@@ -10,6 +10,7 @@
 """
 Python equivalents of Lookup and Reference library functions
 """
+import math
 from bisect import bisect_right
 
 import numpy as np
@@ -21,6 +22,7 @@ from pycel.excelutil import (
     ERROR_CODES,
     ExcelCmp,
     flatten,
+    in_array_formula_context,
     is_address,
     list_like,
     MAX_COL,
@@ -151,7 +153,17 @@ def _match(lookup_value, lookup_array, match_type=1):
     #   areas-function-8392ba32-7a41-43b3-96b0-3695d2ec6152
 
 
-@excel_helper(cse_params=0, number_params=0, err_str_params=0)
+def _choose_needed(index, *args):
+    # the value chosen, unless an array result might be needed
+    index = index()
+    if in_array_formula_context or not isinstance(index, (int, float)) or (
+            isinstance(index, bool)) or not math.isfinite(index):
+        return None
+    return {int(index)}
+
+
+@excel_helper(cse_params=0, number_params=0, err_str_params=0,
+              needed_params=_choose_needed)
 def choose(index, *args):
     # Excel reference: https://support.microsoft.com/en-us/office/
     #   choose-function-fc5c184f-cb62-4ec7-a46e-38653b98f5bc
@@ -302,7 +314,7 @@ def index(array, row_num, col_num=None):
         return array
 
 
-@excel_helper(cse_params=0, number_params=1)
+@excel_helper(cse_params=0, number_params=1, volatile=True)
 def indirect(ref_text, a1=True, sheet=''):
     # Excel reference: https://support.microsoft.com/en-us/office/
     #   indirect-function-474b3a3a-8a26-4f44-b491-92b6306fa261
@@ -379,6 +391,16 @@ def lookup(lookup_value, lookup_array, result_range=None):
 def match(lookup_value, lookup_array, match_type=1):
     # Excel reference: https://support.microsoft.com/en-us/office/
     #   match-function-e8dffd45-c762-47d6-bf89-533f4a37673a
+    populated = getattr(lookup_array, 'populated', None)
+    if match_type == 0 and populated is not None and (
+            _match(lookup_value, (None, ), 0) == NA_ERROR):
+        # sparse range, where the empty cells do not match
+        axis = 1 if len(lookup_array) == 1 else 0
+        cells = [(offset[axis], value) for offset, value in populated.items()
+                 if offset[1 - axis] == 0]
+        result = _match(lookup_value, [value for _, value in cells], 0)
+        return result if result == NA_ERROR else cells[result - 1][0] + 1
+
     if len(lookup_array) == 1:
         lookup_array = lookup_array[0]
     else:
@@ -387,7 +409,8 @@ def match(lookup_value, lookup_array, match_type=1):
     return _match(lookup_value, lookup_array, match_type)
 
 
-@excel_helper(cse_params=(1, 2, 3, 4), ref_params=0, number_params=(1, 2))
+@excel_helper(cse_params=(1, 2, 3, 4), ref_params=0, number_params=(1, 2),
+              volatile=True)
 def offset(reference, row_inc, col_inc, height=None, width=None):
     # Excel reference: https://support.microsoft.com/en-us/office/
     #   offset-function-c8de19ae-dd79-4b9b-a14e-b4d906d11b66
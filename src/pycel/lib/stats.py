@@ -16,7 +16,7 @@ from heapq import nlargest, nsmallest
 import numpy as np
 import statistics as st
 
-from pycel.excellib import _numerics
+from pycel.excellib import _numerics, _range_numerics
 from pycel.excelutil import (
     coerce_to_number,
     DIV0,
@@ -27,6 +27,7 @@ from pycel.excelutil import (
     list_like,
     NA_ERROR,
     NUM_ERROR,
+    RangeValue,
     REF_ERROR,
     VALUE_ERROR,
 )
@@ -63,7 +64,12 @@ def _slope_intercept(Y, X):
 def average(*args):
     # Excel reference: https://support.microsoft.com/en-us/office/
     #   average-function-047bac88-d466-426c-a32b-8f33eb960cf6
-    data = _numerics(*args)
+    data = _range_numerics(*args)
+    if isinstance(data, tuple):
+        values = data[0]
+        return float(values.mean()) if len(values) else DIV0
+
+    data = data or _numerics(*args)
 
     # A returned string is an error code
     if isinstance(data, str):
@@ -181,6 +187,8 @@ def averageifs(average_range, *args):
 def count(*args):
     # Excel reference: https://support.microsoft.com/en-us/office/
     #   COUNT-function-a59cd7fc-b623-4d93-87a4-d23bf411294c
+    if args and all(isinstance(arg, RangeValue) for arg in args):
+        return sum(arg.numbers.size for arg in args)
 
     return sum(1 for x in flatten(args)
                if isinstance(x, (int, float)) and not isinstance(x, bool))
@@ -524,7 +532,15 @@ def linest(Y, X=None, const=None, stats=None):
 def max_(*args):
     # Excel reference: https://support.microsoft.com/en-us/office/
     #   max-function-e0012414-9ac8-4b34-9a47-73e662c08098
-    data = _numerics(*args)
+    data = _range_numerics(*args)
+    if isinstance(data, tuple):
+        values, all_integers = data
+        if not len(values):
+            return 0
+        value = values.max()
+        return int(value) if all_integers else float(value)
+
+    data = data or _numerics(*args)
 
     # A returned string is an error code
     if isinstance(data, str):
@@ -577,7 +593,15 @@ def median(*args):
 def min_(*args):
     # Excel reference: https://support.microsoft.com/en-us/office/
     #   min-function-61635d12-920f-4ce2-a70f-96f202dcc152
-    data = _numerics(*args)
+    data = _range_numerics(*args)
+    if isinstance(data, tuple):
+        values, all_integers = data
+        if not len(values):
+            return 0
+        value = values.min()
+        return int(value) if all_integers else float(value)
+
+    data = data or _numerics(*args)
 
     # A returned string is an error code
     if isinstance(data, str):
@@ -9,6 +9,7 @@
 
 import importlib
 import math
+import types
 
 import pytest
 
@@ -26,6 +27,7 @@ from pycel.lib.function_helpers import (
     excel_helper,
     excel_math_func,
     load_functions,
+    volatile_names,
 )
 
 
@@ -162,3 +164,70 @@ def test_load_functions():
     missing = load_functions(['log'], namespace, modules)
     assert not missing
     assert namespace['log'](DIV0) == DIV0
+
+
+def test_referenced_wrapper():
+    referenced = []
+    name_space = dict(_REFERENCED_=referenced.append)
+
+    def a_test_func(address):
+        return AddressRange.create(address) if '!' in address else address
+
+    func = apply_meta(excel_helper(
+        err_str_params=None, ref_params=-1, volatile=True)(a_test_func),
+        name_space=name_space)[0]
+    assert func('S!A1') == AddressCell('S!A1')
+    assert func('S!A1:B2') == AddressRange('S!A1:B2')
+    assert func(VALUE_ERROR) == VALUE_ERROR
+    assert referenced == [AddressCell('S!A1'), AddressRange('S!A1:B2')]
+
+    # without the name space function, references are not reported
+    del name_space['_REFERENCED_']
+    assert func('S!A1') == AddressCell('S!A1')
+    assert len(referenced) == 2
+
+
+def test_lazy_wrapper():
+    called = []
+
+    def a_test_func(test, *values):
+        return values[test]
+
+    def needed_params(test, *values):
+        return {0, test() + 1}
+
+    def lazy(value):
+        def param():
+            called.append(value)
+            return value
+        return param
+
+    func = apply_meta(excel_helper(
+        err_str_params=None, ref_params=-1, needed_params=needed_params)(
+        a_test_func), name_space={})[0]
+    assert func(1, lazy('a'), lazy('b'), lazy('c')) == 'b'
+    assert called == ['b']
+
+    # the params which are not lazy are passed through
+    assert func(2, 'a', lazy('b'), 'c') == 'c'
+    assert called == ['b']
+    assert func(0, 'a', 'b') == 'a'
+
+
+def test_volatile_names():
+    modules = (
+        importlib.import_module('pycel.lib.date_time'),
+        importlib.import_module('pycel.lib.lookup'),
+        importlib.import_module('math'),
+    )
+    names = volatile_names(modules)
+    assert {'now', 'today', 'offset', 'indirect'} <= names
+    assert not names & {'date', 'index', 'match', 'sqrt'}
+
+    # the first module with a function decides if it is volatile
+    plugin = types.SimpleNamespace(
+        now=excel_helper()(lambda: 1),
+        rand=excel_helper(volatile=True)(lambda: 1))
+    names = volatile_names((plugin, ) + modules)
+    assert 'now' not in names
+    assert {'rand', 'today'} <= names
@@ -261,6 +261,51 @@ def test_switch(expected, test_value):
         assert switch(test_value[0], *(['no-match'] * 200), *test_value[1:]) == expected
 
 
+@pytest.mark.parametrize(
+    'func, args, expected, evaluated', (
+        (if_, (True, 1, 2), 1, {1}),
+        (if_, (False, 1, 2), 2, {2}),
+        (if_, (True, 1), 1, {1}),
+        (if_, ('xyzzy', 1, 2), VALUE_ERROR, set()),
+        (if_, (DIV0, 1, 2), DIV0, set()),
+        (if_, (((True, ), (False, )), 1, 2), ((1, ), (2, )), {1, 2}),
+        (iferror, ('A', 2), 'A', set()),
+        (iferror, (DIV0, 2), 2, {1}),
+        (ifna, (DIV0, 2), DIV0, set()),
+        (ifna, (NA_ERROR, 2), 2, {1}),
+        (ifs, (False, 10, True, 20, True, 30), 20, {2, 3}),
+        (ifs, (True, 10, 'xyzzy', 20), 10, {1}),
+        (ifs, (False, 10, 'xyzzy', 20), VALUE_ERROR, {2}),
+        (ifs, (False, 10, DIV0, 20), DIV0, {2}),
+        (ifs, (False, 10, True), NA_ERROR, set()),
+        (switch, (2, 1, 10, 2, 20, 30), 20, {1, 3, 4}),
+        (switch, (3, 1, 10, 2, 20, 30), 30, {1, 3, 5}),
+        (switch, (3, 1, 10), NA_ERROR, {1}),
+        (switch, (0, 1, VALUE_ERROR, DIV0), DIV0, {1, 3}),
+        (switch, (DIV0, 1, 10), DIV0, set()),
+    )
+)
+def test_lazy_params(func, args, expected, evaluated):
+    called = set()
+
+    def lazy(i, value):
+        def param():
+            called.add(i)
+            return value
+        return param
+
+    lazy_args = (args[0], ) + tuple(
+        lazy(i, arg) for i, arg in enumerate(args[1:], start=1))
+    assert func(*lazy_args) == expected
+    assert called == evaluated
+
+    # in an array formula all of the params are evaluated
+    called.clear()
+    with in_array_formula_context('A1'):
+        func(*lazy_args)
+    assert called == set(range(1, len(args)))
+
+
 @pytest.mark.parametrize(
     'expected, test_value', (
         (False, (False,)),
@@ -20,6 +20,7 @@ from pycel.excelutil import (
     is_address,
     NA_ERROR,
     NUM_ERROR,
+    RangeValue,
     REF_ERROR,
     VALUE_ERROR,
 )
@@ -415,6 +416,10 @@ def test_match(lookup_value, lookup_array, match_type, expected):
     assert match(lookup_value, lookup_row, match_type) == expected
     assert match(lookup_value, lookup_col, match_type) == expected
 
+    sparse_col = RangeValue.from_sparse((len(lookup_array), 1), {
+        (i, 0): value for i, value in enumerate(lookup_array) if value is not None})
+    assert match(lookup_value, sparse_col, match_type) == expected
+
 
 @pytest.mark.parametrize(
     'lookup_array, lookup_value, result1, result0, resultm1', (
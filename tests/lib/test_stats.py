@@ -23,6 +23,7 @@ from pycel.excelutil import (
     NA_ERROR,
     NAME_ERROR,
     NUM_ERROR,
+    RangeValue,
     REF_ERROR,
     VALUE_ERROR,
 )
@@ -170,6 +171,11 @@ def test_countblank(value, expected):
 def test_countif(value, criteria, expected):
     assert countif(value, criteria) == expected
 
+    sparse = RangeValue.from_sparse((len(value), len(value[0])), {
+        (r, c): item for r, row in enumerate(value)
+        for c, item in enumerate(row) if item is not None})
+    assert countif(sparse, criteria) == expected
+
 
 class TestCountIfs:
     # more tests might be welcomed
@@ -415,6 +421,26 @@ def test_max_min(data, max_expected, min_expected):
     assert min_(data) == min_expected
 
 
+@pytest.mark.parametrize(
+    'args', (
+        (((2, None, 'x', 3), ), ),
+        (((-0.1, None, 'x', True), (1.5, 2, 3, 4)), ),
+        (((2, 1), ), 3, True, 'x'),
+        (((2, 1), ), ((2, DIV0), )),
+        (((2, 1), ), VALUE_ERROR),
+        (((2 ** 60, 1), ), ),
+        (((None, 'x'), ), ),
+    )
+)
+def test_range_value_aggregates(args):
+    range_args = tuple(
+        RangeValue(arg) if isinstance(arg, tuple) else arg for arg in args)
+    for func in (average, count, max_, min_):
+        result = func(*range_args)
+        assert result == func(*args)
+        assert isinstance(result, (int, float, str))
+
+
 @pytest.mark.parametrize(
     'data, expected', (
         ([], VALUE_ERROR),
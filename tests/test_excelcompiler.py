@@ -7,12 +7,16 @@
 # You may obtain a copy of the Licence at:
 #   https://www.gnu.org/licenses/gpl-3.0.en.html
 
+import collections
 import copy
+import importlib.util
 import json
 import math
 import os
+import pickle
 import random
 import shutil
+import types
 from pathlib import Path
 from unittest import mock
 
@@ -22,8 +26,21 @@ from openpyxl import Workbook
 from openpyxl.workbook.defined_name import DefinedName
 from ruamel.yaml import YAML
 
-from pycel.excelcompiler import _Cell, _CellRange, ExcelCompiler, Mismatch
-from pycel.excelformula import FormulaParserError, UnknownFunction
+from pycel.excelcompiler import (
+    _Cell,
+    _CellRange,
+    _ConstantBlockRange,
+    _CycleCell,
+    _SparseRange,
+    _VectorRun,
+    ExcelCompiler,
+    Mismatch,
+)
+from pycel.excelformula import (
+    ExcelFormula,
+    FormulaParserError,
+    UnknownFunction,
+)
 from pycel.excelutil import (
     AddressCell,
     AddressRange,
@@ -31,6 +48,7 @@ from pycel.excelutil import (
     list_like,
     NA_ERROR,
     NULL_ERROR,
+    RangeValue,
 )
 from pycel.excelwrapper import ExcelWrapper
 
@@ -310,6 +328,133 @@ def test_trim_cells(excel_compiler):
 
     assert old_value == new_value
 
+    # the removed cells are also removed from the graph
+    assert set(excel_compiler.dep_graph) <= set(excel_compiler.cell_map.values())
+
+
+def test_trim_cells_freeze(tmpdir):
+    wb = Workbook()
+    ws = wb.active
+    ws['A1'] = 'fast'
+    ws['A2'] = '=A1="fast"'
+    ws['A3'] = 5
+    ws['B1'] = '=IF(A2, A3*2, C1+C2)'
+    ws['B2'] = '=CHOOSE(E1, A3+1, C3, C4)'
+    ws['B3'] = '=B1+B2+E2'
+    ws['B4'] = '=IF(A3>1, C3, C4)'
+    ws['B5'] = '=E1*10'
+    ws['C1'] = '=A3*100'
+    ws['C2'] = 7
+    ws['C3'] = '=A3*3'
+    ws['C4'] = '=A3*4'
+    ws['E1'] = '=1+1'
+    ws['E2'] = '=SUM(C2, 10)'
+
+    input_addrs = ['Sheet!A3']
+    output_addrs = ['Sheet!B3', 'Sheet!B4', 'Sheet!B5']
+    excel_compiler = ExcelCompiler(excel=wb)
+    excel_compiler.trim_graph(input_addrs, output_addrs, freeze=True)
+
+    formulas = {address: cell.formula and cell.python_code
+                for address, cell in excel_compiler.cell_map.items()}
+    assert formulas == {
+        'Sheet!A3': None,
+        'Sheet!B1': "if_(True, lambda: _C_('Sheet!A3') * 2, None)",
+        'Sheet!B2': "choose(2, None, lambda: _C_('Sheet!C3'), None)",
+        'Sheet!B3': '(_C_("Sheet!B1") + _C_("Sheet!B2")) + _C_("Sheet!E2")',
+        'Sheet!B4': 'if_(_C_("Sheet!A3") > 1, lambda: _C_("Sheet!C3"), '
+                    'lambda: _C_("Sheet!C4"))',
+        'Sheet!B5': None,
+        'Sheet!C3': '_C_("Sheet!A3") * 3',
+        'Sheet!C4': '_C_("Sheet!A3") * 4',
+        'Sheet!E2': None,
+    }
+
+    # the frozen cells were evaluated, and the dropped params are not edges
+    assert excel_compiler.cell_map['Sheet!E2'].value == 17
+    assert excel_compiler.cell_map['Sheet!B5'].value == 20
+    cell_map = excel_compiler.cell_map
+    assert set(excel_compiler.dep_graph.predecessors(
+        cell_map['Sheet!B2'])) == {cell_map['Sheet!C3']}
+    assert set(excel_compiler.dep_graph) <= set(cell_map.values())
+
+    assert excel_compiler.evaluate(output_addrs) == [42, 15, 20]
+
+    excel_compiler.to_file(str(tmpdir.join('freeze.xlsx')), file_types='yml')
+    excel_compiler = ExcelCompiler.from_file(str(tmpdir.join('freeze.xlsx')))
+    excel_compiler.set_value(input_addrs[0], 1)
+    assert excel_compiler.evaluate(output_addrs) == [22, 4, 20]
+
+
+def test_hoist_subexpressions(tmpdir):
+    wb = Workbook()
+    ws = wb.active
+    for row in range(1, 6):
+        ws[f'A{row}'] = row
+        ws[f'B{row}'] = row % 2
+        ws[f'C{row}'] = f'=A{row}+SUMIFS(A1:A5,B1:B5,1)'
+        ws[f'D{row}'] = (
+            f'=IF(VLOOKUP(2,A1:B5,2,0)>0,VLOOKUP(2,A1:B5,2,0),A{row}*2)')
+    ws['E1'] = '=SUM(C1:D5)'
+    ws['E2'] = '=VLOOKUP(A1,A1:B5,2,0)+VLOOKUP(A2,A1:B5,2,0)+SUM(B1,NOW()*0)'
+    ws['E3'] = '=VLOOKUP(A1,A1:B5,2,0)+VLOOKUP(A2,A1:B5,2,0)+SUM(B1,NOW()*0)'
+
+    excel_compiler = ExcelCompiler(excel=wb)
+    assert excel_compiler.evaluate(('Sheet!E1', 'Sheet!E2')) == (90, 2)
+    excel_compiler.evaluate('Sheet!E3')
+
+    assert excel_compiler.hoist_subexpressions() == {
+        '_subexpressions!A1': "vlookup(2, _R_('Sheet!A1:B5'), 2, 0)",
+        '_subexpressions!A2':
+            "sumifs(_R_('Sheet!A1:A5'), _R_('Sheet!B1:B5'), 1)",
+        '_subexpressions!A3': "vlookup(_C_('Sheet!A1'), _R_('Sheet!A1:B5'), 2, 0)",
+        '_subexpressions!A4': "vlookup(_C_('Sheet!A2'), _R_('Sheet!A1:B5'), 2, 0)",
+    }
+    cell_map = excel_compiler.cell_map
+    assert cell_map['Sheet!C1'].python_code == \
+        "_C_('Sheet!A1') + _C_('_subexpressions!A2')"
+    assert cell_map['Sheet!D1'].python_code == (
+        "if_(_C_('_subexpressions!A1') > 0, lambda: _C_('_subexpressions!A1'),"
+        " lambda: _C_('Sheet!A1') * 2)")
+    assert excel_compiler.hoist_subexpressions() == {}
+
+    # the moved calls are edges of the new cells
+    assert set(excel_compiler.dep_graph.predecessors(cell_map['Sheet!C1'])) == {
+        cell_map['Sheet!A1'], cell_map['_subexpressions!A2']}
+    assert set(excel_compiler.dep_graph.predecessors(
+        cell_map['_subexpressions!A2'])) == {
+        cell_map['Sheet!A1:A5'], cell_map['Sheet!B1:B5']}
+
+    excel_compiler.set_value('Sheet!B2', 1)
+    assert excel_compiler.evaluate(('Sheet!E1', 'Sheet!E2')) == (75, 3)
+
+    # the new cells are only saved when asked for
+    filename = str(tmpdir.join('hoisted.yml'))
+    excel_compiler.to_file(filename)
+    with open(filename) as f:
+        assert '_subexpressions' not in f.read()
+    excel_compiler.to_file(filename, include_subexpressions=True)
+    with open(filename) as f:
+        assert '_subexpressions!A2' in f.read()
+
+    excel_compiler = ExcelCompiler.from_file(filename)
+    excel_compiler.set_value('Sheet!B2', 0)
+    assert excel_compiler.evaluate(('Sheet!E1', 'Sheet!E2')) == (90, 2)
+
+
+def test_dep_graph_from_networkx_pickle(excel_compiler):
+    output_addr = 'trim-range!B2'
+    excel_compiler.evaluate(output_addr)
+    edges = set(excel_compiler.dep_graph.edges())
+
+    # older pickles have a networkx DiGraph
+    excel_compiler.dep_graph = excel_compiler.dep_graph.to_networkx()
+    excel_compiler = pickle.loads(pickle.dumps(excel_compiler))
+    assert len(edges) == excel_compiler.dep_graph.number_of_edges()
+    cell = excel_compiler.cell_map[output_addr]
+    assert len(list(excel_compiler.dep_graph.predecessors(cell))) == len(
+        [e for e in edges if e[1].address.address == output_addr])
+
 
 def test_trim_cells_range(excel_compiler):
     input_addrs = [AddressRange('trim-range!D4:E4')]
@@ -623,6 +768,21 @@ def test_cell_repr(excel):
     assert 'sheet!A1 -> 0' == repr(cell_range)
 
 
+@pytest.mark.parametrize('cell_class', (_Cell, _CycleCell))
+def test_cell_pickle(cell_class):
+    cell = cell_class('sheet!A1', value=2, formula='=B1+1')
+    assert not hasattr(cell, '__dict__')
+
+    loaded = pickle.loads(pickle.dumps(cell))
+    assert (loaded.address, loaded.value, loaded.id) == (
+        cell.address, cell.value, cell.id)
+    assert loaded.formula.python_code == cell.formula.python_code
+    if cell_class is _CycleCell:
+        assert loaded._value == 2
+        assert loaded._prev_value is None
+        assert not loaded.wip
+
+
 def test_gen_gexf(excel_compiler, tmpdir):
     filename = os.path.join(str(tmpdir), 'test.gexf')
     assert not os.path.exists(filename)
@@ -739,6 +899,155 @@ def test_unbounded_countifs():
     assert (2, 9) == excel_compiler.evaluate(output_addrs)
 
 
+def constant_block_workbook():
+    wb = Workbook()
+    ws = wb.active
+    for row in range(1, 11):
+        ws[f'A{row}'] = row
+        ws[f'B{row}'] = row * 10
+    ws['B5'] = '=A5*100'
+    ws['C1'] = '=SUM(A1:B10)'
+    ws['C2'] = '=A3+1'
+    ws['C3'] = '=SUM(A6:A12)'
+    return wb
+
+
+@pytest.mark.parametrize('topological', (False, True))
+@mock.patch.object(ExcelCompiler, 'constant_block_min_size', 4)
+def test_constant_block_range(topological):
+    excel_compiler = ExcelCompiler(
+        excel=constant_block_workbook(), topological=topological)
+    assert 1055 == excel_compiler.evaluate('Sheet!C1')
+
+    # only the formula cell of the range, and the cell it references, are built
+    block_range = excel_compiler.cell_map['Sheet!A1:B10']
+    assert isinstance(block_range, _ConstantBlockRange)
+    assert [c.address.address for c in block_range.cells] == [
+        'Sheet!B5', 'Sheet!A5']
+    assert 'Sheet!A1' not in excel_compiler.cell_map
+
+    # a reference to a constant builds its cell
+    assert 4 == excel_compiler.evaluate('Sheet!C2')
+    assert 3 == excel_compiler.cell_map['Sheet!A3'].value
+    assert excel_compiler.cell_map['Sheet!A3'] in block_range.cells
+
+    # set_value on a constant of a block, without a cell, resets the range
+    excel_compiler.set_value('Sheet!A3', 30)
+    excel_compiler.set_value('Sheet!A4', 40)
+    if topological:
+        excel_compiler.recalculate_dirty()
+    assert (31, 1118) == excel_compiler.evaluate(('Sheet!C2', 'Sheet!C1'))
+
+    # an overlapping range shares the column of constants
+    assert 40 == excel_compiler.evaluate('Sheet!C3')
+    assert len(excel_compiler._constants.columns[('Sheet', 1)]) == 1
+
+    excel_compiler.set_value('Sheet!A7', 70)
+    if topological:
+        excel_compiler.recalculate_dirty()
+    assert (1181, 103) == excel_compiler.evaluate(('Sheet!C1', 'Sheet!C3'))
+
+
+@mock.patch.object(ExcelCompiler, 'constant_block_min_size', 4)
+def test_constant_block_range_serialize(tmpdir):
+    excel_compiler = ExcelCompiler(excel=constant_block_workbook())
+    excel_compiler.filename = os.path.join(tmpdir, 'constant_block')
+    outputs = ('Sheet!C1', 'Sheet!C2', 'Sheet!C3')
+    expected = excel_compiler.evaluate(outputs)
+
+    excel_compiler.to_file(file_types=('pkl', 'yml'))
+    for file_type in ('yml', 'pkl'):
+        loaded = ExcelCompiler.from_file(f'{excel_compiler.filename}.{file_type}')
+        assert expected == loaded.evaluate(outputs)
+        assert 'Sheet!A1' not in loaded.cell_map
+        assert 'Sheet!A3' in loaded.cell_map
+
+        loaded.set_value('Sheet!A2', 20)
+        assert expected[0] + 18 == loaded.evaluate('Sheet!C1')
+
+    excel_compiler.trim_graph(['Sheet!A1'], ['Sheet!C1'])
+    assert 'Sheet!A1' in excel_compiler.cell_map
+    assert 'Sheet!A2' not in excel_compiler.cell_map
+    excel_compiler.set_value('Sheet!A2', 20)
+    assert expected[0] + 18 == excel_compiler.evaluate('Sheet!C1')
+
+
+def sparse_range_workbook():
+    wb = Workbook()
+    ws = wb.active
+    ws['A1'] = 1
+    ws['A2'] = 'x'
+    ws['A3'] = '=B1*2'
+    ws['A100000'] = 4
+    ws['B1'] = 5
+    ws['C1'] = '=SUM(A:A)'
+    ws['C2'] = '=COUNT(A:A)'
+    ws['C3'] = '=COUNTIF(A:A,">1")'
+    ws['C4'] = '=MATCH(4,A:A,0)'
+    ws['C5'] = '=A50000'
+    return wb
+
+
+@pytest.mark.parametrize('topological', (False, True))
+def test_sparse_range(tmpdir, topological):
+    wb = sparse_range_workbook()
+    excel_compiler = ExcelCompiler(excel=wb, topological=topological)
+    outputs = ('Sheet!C1', 'Sheet!C2', 'Sheet!C3', 'Sheet!C4')
+    assert (15, 3, 2, 100000) == excel_compiler.evaluate(outputs)
+
+    # only the populated cells of the column are read and kept
+    sparse_range = excel_compiler.cell_map['Sheet!A1:A100000']
+    assert isinstance(sparse_range, _SparseRange)
+    assert sparse_range.constants == {(0, 0): 1, (1, 0): 'x', (99999, 0): 4}
+    assert len(wb.active._cells) == 10
+    assert sparse_range.value.populated == {
+        (0, 0): 1, (1, 0): 'x', (2, 0): 10, (99999, 0): 4}
+
+    # an empty cell referenced on its own is a precedent of the range
+    assert 0 == excel_compiler.evaluate('Sheet!C5')
+    excel_compiler.set_value('Sheet!A50000', 6)
+    excel_compiler.set_value('Sheet!B1', 1)
+    if topological:
+        excel_compiler.recalculate_dirty()
+    assert (13, 4, 3, 100000) == excel_compiler.evaluate(outputs)
+
+    excel_compiler.set_value('Sheet!A50000', None)
+    if topological:
+        excel_compiler.recalculate_dirty()
+    assert (7, 3, 2, 100000) == excel_compiler.evaluate(outputs)
+
+    excel_compiler.filename = os.path.join(tmpdir, 'sparse_range')
+    excel_compiler.to_file(file_types=('pkl', 'yml'))
+    for file_type in ('yml', 'pkl'):
+        loaded = ExcelCompiler.from_file(f'{excel_compiler.filename}.{file_type}')
+        assert (7, 3, 2, 100000) == loaded.evaluate(outputs)
+        assert isinstance(loaded.cell_map['Sheet!A1:A100000'], _SparseRange)
+        loaded.set_value('Sheet!A1', 11)
+        assert (17, 3, 3, 100000) == loaded.evaluate(outputs)
+
+
+def test_range_value_arrays():
+    wb = Workbook()
+    ws = wb.active
+    for row in range(1, 6):
+        ws[f'A{row}'] = row
+    ws['A6'] = 'x'
+    ws['B1'] = '=SUM(A1:A6)'
+    ws['B2'] = '=SUMPRODUCT(A1:A6,A1:A6)'
+    excel_compiler = ExcelCompiler(excel=wb)
+
+    assert (15, 55.0) == excel_compiler.evaluate(('Sheet!B1', 'Sheet!B2'))
+    value = excel_compiler.cell_map['Sheet!A1:A6'].value
+    assert isinstance(value, RangeValue)
+    assert value.numbers.tolist() == [1, 2, 3, 4, 5]
+
+    # the arrays are rebuilt when the range is recalculated
+    excel_compiler.set_value('Sheet!A6', 6)
+    assert (21, 91.0) == excel_compiler.evaluate(('Sheet!B1', 'Sheet!B2'))
+    value = excel_compiler.cell_map['Sheet!A1:A6'].value
+    assert value.numbers.tolist() == [1, 2, 3, 4, 5, 6]
+
+
 def test_validate_count():
     wb = Workbook()
     ws = wb.active
@@ -936,6 +1245,48 @@ def test_plugins(excel_compiler):
             calc_and_check()
 
 
+def test_plugins_lazy_params():
+    # a plugin of a function whose params may be lambdas, without needed_params
+    plugin = types.ModuleType('lazy_params_plugin')
+    plugin.choose = lambda index, *args: args[int(index) - 1]
+    plugin.if_ = lambda test, true, false=0: true * 10 + false
+
+    wb = Workbook()
+    ws = wb.active
+    ws['A1'] = 2
+    ws['C1'] = 5
+    ws['C2'] = 7
+    ws['B1'] = '=CHOOSE(A1,C1,C2+1)'
+    ws['B2'] = '=IF(A1>1,C1,C2+1)'
+
+    with mock.patch.dict('sys.modules', {plugin.__name__: plugin}):
+        excel_compiler = ExcelCompiler(excel=wb, plugins=plugin.__name__)
+        assert excel_compiler.evaluate('Sheet!B1') == 8
+        assert excel_compiler.evaluate('Sheet!B2') == 58
+
+
+def test_plugins_not_folded():
+    # the functions defined by plugins are not folded into constants
+    plugin = types.ModuleType('folded_plugin')
+    plugin.sqrt = lambda value: 'plugin'
+    plugin.upper = lambda value: 'PLUGIN'
+
+    wb = Workbook()
+    ws = wb.active
+    ws['A1'] = 4
+    ws['B1'] = '=SQRT(4)'
+    ws['B2'] = '=UPPER("a")&"x"'
+    ws['B3'] = '=SQRT(A1)'
+    ws['B4'] = '=ABS(-4)'
+
+    addrs = ('Sheet!B1', 'Sheet!B2', 'Sheet!B3', 'Sheet!B4')
+    assert ExcelCompiler(excel=wb).evaluate(addrs) == (2, 'Ax', 2, 4)
+    with mock.patch.dict('sys.modules', {plugin.__name__: plugin}):
+        excel_compiler = ExcelCompiler(excel=wb, plugins=plugin.__name__)
+        assert excel_compiler.evaluate(addrs) == (
+            'plugin', 'PLUGINx', 'plugin', 4)
+
+
 @pytest.mark.parametrize(
     'a, b, rel, tol, expected', (
         (0, 0, None, None, True),
@@ -1015,8 +1366,10 @@ def test_validate_circular_referenced_tol(
 
 
 def test_validate_circular_referenced(circular_ws):
-    b6_expect = pytest.approx(49.92)
-    b8_expect = pytest.approx(33.41312)
+    # B6 steps by 0.01 each iteration, so it stops on its own tolerance of
+    # 0.01, while the cycle of B1 and B2 iterates on to converge
+    b6_expect = pytest.approx(49.99)
+    b8_expect = pytest.approx(33.3444)
     circular_ws.evaluate('Sheet1!B8', iterations=1)
 
     circular_ws.set_value('Sheet1!B3', 0)
@@ -1082,16 +1435,12 @@ def test_circular_mismatch_warning(
 def test_circular_disabled(fixture_xls_copy):
     excel_compiler = ExcelCompiler(fixture_xls_copy('circular.xlsx'), cycles=False)
 
-    failed_cells = excel_compiler.validate_serialized()
-    assert failed_cells == {
-        'exceptions': {
-            'RecursionError: Do you need to use cycles=True ?': [
-                ('Sheet1!B10', '=IF(B3=0, 0, B10+0.001)',
-                 'Do you need to use cycles=True ?'
-                 )
-            ]
-        }
-    }
+    # the circular references are in the values not selected by IF()
+    assert excel_compiler.validate_serialized() == {}
+
+    excel_compiler.set_value('Sheet1!B3', 1)
+    with pytest.raises(RecursionError, match='Do you need to use cycles=True ?'):
+        excel_compiler.evaluate('Sheet1!B10')
 
 
 def test_circular_order_random(fixture_xls_copy):
@@ -1112,6 +1461,146 @@ def test_circular_order_random(fixture_xls_copy):
         assert (failed_cells, addrs) == ({}, addrs)
 
 
+def test_circular_iterates_only_the_cycle():
+    wb = Workbook()
+    wb.calculation.iterate = True
+    wb.calculation.iterateCount = 100
+    wb.calculation.iterateDelta = 0.0001
+    ws = wb.active
+    ws['A1'] = 1
+    for row in range(2, 51):
+        ws[f'A{row}'] = f'=A{row - 1}+1'
+    ws['B1'] = '=A50+B2*0.5'
+    ws['B2'] = '=B1*0.5'
+    ws['C1'] = '=B1*2'
+    ws['C2'] = '=C1+A1'
+
+    excel_compiler = ExcelCompiler(excel=wb)
+    assert excel_compiler.cycles == {'iterations': 100, 'tolerance': 0.0001}
+    evals = collections.Counter()
+    eval_cell = excel_compiler.eval
+
+    def counting_eval(cell, cse_array_address=None):
+        evals[cell.address.address] += 1
+        return eval_cell(cell, cse_array_address)
+
+    excel_compiler._eval = counting_eval
+    assert excel_compiler.evaluate('Sheet!C2') == pytest.approx(400 / 3 + 1)
+
+    # only the cycle is iterated, the rest is evaluated once
+    assert evals['Sheet!B1'] == evals['Sheet!B2'] > 5
+    del evals['Sheet!B1'], evals['Sheet!B2']
+    assert set(evals.values()) == {1}
+    assert len(evals) == 51
+
+    evals.clear()
+    excel_compiler.set_value('Sheet!A1', 2)
+    assert excel_compiler.evaluate('Sheet!C2') == pytest.approx(408 / 3 + 2)
+    assert evals['Sheet!A50'] == evals['Sheet!C1'] == 1
+
+
+@pytest.mark.parametrize('method', ExcelCompiler.cycle_methods)
+def test_circular_convergence_methods(method):
+    wb = Workbook()
+    wb.calculation.iterate = True
+    wb.calculation.iterateCount = 1000
+    wb.calculation.iterateDelta = 0.000001
+    ws = wb.active
+
+    # interest on the average balance, which converges slowly
+    ws['A1'], ws['A2'] = 1000, 1.8
+    ws['B1'] = '=A1+B3'
+    ws['B2'] = '=(A1+B1)/2'
+    ws['B3'] = '=B2*A2'
+    ws['B4'] = '=B1*2'
+    ws['B5'] = '=B2*2'
+
+    excel_compiler = ExcelCompiler(excel=wb, cycles=dict(method=method))
+    assert excel_compiler.cycles == {
+        'iterations': 1000, 'tolerance': 0.000001, 'method': method}
+    assert excel_compiler.evaluate('Sheet!B4') == pytest.approx(38000)
+
+    convergence = excel_compiler.cycle_convergence['Sheet!B1']
+    assert convergence.converged
+    assert convergence.residual < 0.000001
+    if method in ('fixed_point', 'gauss_seidel'):
+        assert convergence.iterations > 100
+    else:
+        assert convergence.iterations < 20
+
+    # the cycle is reported once, whichever cell of it is evaluated, and
+    # the passes confirming it has converged do not replace the report
+    assert excel_compiler.evaluate('Sheet!B5') == pytest.approx(20000)
+    assert excel_compiler.evaluate('Sheet!B4') == pytest.approx(38000)
+    assert excel_compiler.cycle_convergence == {'Sheet!B1': convergence}
+
+    excel_compiler.set_value('Sheet!A1', 2000)
+    assert excel_compiler.evaluate('Sheet!B4') == pytest.approx(76000)
+
+    # stops at the iterations, without converging
+    excel_compiler.set_value('Sheet!A1', 1000)
+    excel_compiler.evaluate('Sheet!B4', iterations=1)
+    convergence = excel_compiler.cycle_convergence['Sheet!B1']
+    assert convergence.iterations == 1
+    assert not convergence.converged
+    assert convergence.residual > 0.000001
+
+
+def test_circular_linear_solve():
+    wb = Workbook()
+    wb.calculation.iterate = True
+    wb.calculation.iterateCount = 100
+    wb.calculation.iterateDelta = 0.000001
+    ws = wb.active
+
+    # fees as a percentage of a total which includes the fees
+    ws['A1'], ws['A2'] = 1000, 0.02
+    ws['B1'] = '=A1+B2+B3'
+    ws['B2'] = '=B1*A2'
+    ws['B3'] = '=SUM(B1:B2)*0.01'
+    ws['C1'] = '=B1'
+
+    # not linear, left to the iterations
+    ws['D1'] = '=SQRT(D2)+A2'
+    ws['D2'] = '=D1'
+
+    excel_compiler = ExcelCompiler(excel=wb, cycles=dict(method='linear'))
+    total = 1000 / (1 - 0.02 - 0.01 * 1.02)
+    assert excel_compiler.evaluate('Sheet!C1') == pytest.approx(total)
+    assert excel_compiler.cycle_convergence['Sheet!B1'] == (
+        2, pytest.approx(0, abs=1e-9), True)
+
+    excel_compiler.set_value('Sheet!A1', 2000)
+    assert excel_compiler.evaluate('Sheet!C1') == pytest.approx(2 * total)
+    assert excel_compiler.cycle_convergence['Sheet!B1'].iterations == 2
+
+    root = ((1 + (1 + 4 * 0.02) ** 0.5) / 2) ** 2
+    assert excel_compiler.evaluate('Sheet!D1') == pytest.approx(root)
+    convergence = excel_compiler.cycle_convergence['Sheet!D1']
+    assert convergence.converged
+    assert convergence.iterations > 2
+
+
+def test_circular_gauss_seidel_long_cycle():
+    wb = Workbook()
+    ws = wb.active
+    ws['A1'] = '=A1500*0.5+1'
+    for row in range(2, 1501):
+        ws[f'A{row}'] = f'=A{row - 1}'
+    ws['B1'] = 'text'
+    ws['B2'] = '=IF(A1>1,B1,B2)'
+
+    # deeper than the recursion limit allows for the recursive evaluator
+    excel_compiler = ExcelCompiler(excel=wb, cycles=dict(
+        iterations=100, tolerance=0.0001, method='gauss_seidel'))
+    assert excel_compiler.evaluate('Sheet!A1') == pytest.approx(2, abs=0.001)
+    assert excel_compiler.evaluate('Sheet!B2') == 'text'
+
+    with pytest.raises(AssertionError):
+        ExcelCompiler(excel=wb, cycles=dict(
+            iterations=100, tolerance=0.0001, method='newton'))
+
+
 def test_evaluate_after_range_eval_error():
     wb = Workbook()
     ws = wb.active
@@ -1132,3 +1621,523 @@ def test_evaluate_after_range_eval_error():
     with pytest.raises(UnknownFunction):
         excel_compiler.evaluate('A5')
     assert excel_compiler.evaluate('A3') == 'hello'
+
+
+def test_topological_evaluate_deep_chain():
+    wb = Workbook()
+    ws = wb.active
+    ws['A1'] = 1
+    for row in range(2, 1501):
+        ws[f'A{row}'] = f'=A{row - 1}+1'
+
+    # deeper than the recursion limit allows for the recursive evaluator
+    excel_compiler = ExcelCompiler(excel=wb, topological=True)
+    assert excel_compiler.evaluate('Sheet!A1500') == 1500
+
+    excel_compiler.set_value('Sheet!A1', 11)
+    assert excel_compiler.evaluate('Sheet!A1500') == 1510
+
+    excel_compiler.recalculate()
+    assert excel_compiler.evaluate('Sheet!A1500') == 1510
+
+
+def test_topological_matches_recursive(fixture_xls_copy):
+    recursive = ExcelCompiler(fixture_xls_copy('excelcompiler.xlsx'))
+    topological = ExcelCompiler(
+        fixture_xls_copy('excelcompiler.xlsx'), topological=True)
+
+    addrs = [addr for addr in recursive.formula_cells()
+             if not addr.sheet.startswith('Empty')]
+    assert topological.evaluate(addrs) == recursive.evaluate(addrs)
+
+    recursive.set_value('Sheet1!A1', 200)
+    topological.set_value('Sheet1!A1', 200)
+    assert topological.evaluate(addrs) == recursive.evaluate(addrs)
+
+    # the cached orders are reset when the graph changes
+    assert topological._topological_order('Sheet1!D1')
+    assert topological._topological_orders
+    topological.trim_graph(['Sheet1!A1'], ['Sheet1!D1'])
+    assert not topological._topological_orders
+    assert round(topological.evaluate('Sheet1!D1'), 5) == -0.00331
+
+
+def test_vectorize():
+    def build_compiler(**kwargs):
+        wb = Workbook()
+        ws = wb.active
+        ws['H1'] = 2
+        for row in range(1, 9):
+            ws[f'A{row}'] = row % 4
+            ws[f'B{row}'] = {3: 'text', 5: None, 6: True}.get(row, row + 0.5)
+            ws[f'C{row}'] = f'=A{row}*B{row}+$H$1'
+            ws[f'D{row}'] = f'=C{row}/(A{row}-1)'
+            ws[f'E{row}'] = f'=IF(A{row}>1,SQRT(D{row}),-D{row})'
+            ws[f'F{row}'] = f'=A{row}>=B{row}'
+            # each refers to the copy above, so is not a run
+            ws[f'G{row + 1}'] = f'=G{row}+A{row}'
+        ws['G1'] = 1
+        return ExcelCompiler(excel=wb, **kwargs)
+
+    addrs = [f'Sheet!{col}{row}' for col in 'CDEFG' for row in range(1, 9)]
+    recursive = build_compiler()
+    vectorized = build_compiler(vectorize=True)
+    assert vectorized.topological
+    assert vectorized.evaluate(addrs) == recursive.evaluate(addrs)
+
+    order = vectorized._vector_order(addrs[-1])
+    runs = {}
+    for step in vectorized._vector_order(None):
+        if isinstance(step, _VectorRun):
+            runs[step.cells[0].address.column] = len(step.cells)
+    assert runs == dict(C=8, D=8, E=8, F=8)
+    assert not any(isinstance(step, _VectorRun) for step in order)
+
+    # recalculate_dirty evaluates the dirty runs as arrays
+    for address, value in (('Sheet!H1', 3), ('Sheet!A2', 0), ('Sheet!A7', 3)):
+        recursive.set_value(address, value)
+        vectorized.set_value(address, value)
+        assert vectorized.evaluate(addrs) == recursive.evaluate(addrs)
+
+    # pickled compilers evaluate the runs
+    vectorized = pickle.loads(pickle.dumps(vectorized))
+    vectorized.recalculate()
+    recursive.recalculate()
+    assert vectorized.evaluate(addrs) == recursive.evaluate(addrs)
+
+
+def test_recalculate_dirty():
+    wb = Workbook()
+    ws = wb.active
+    ws['A1'] = 1
+    ws['B1'] = '=A1*2'
+    ws['C1'] = '=IF(B1>10,1,0)'
+    ws['D1'] = '=C1+100'
+    ws['E1'] = '=B1+1'
+    ws['F1'] = '=SUM(A1:B1)'
+    ws['G1'] = '=F1*10'
+
+    excel_compiler = ExcelCompiler(excel=wb, topological=True)
+    output_addrs = ['Sheet!D1', 'Sheet!E1', 'Sheet!G1']
+    assert excel_compiler.evaluate(output_addrs) == [100, 3, 30]
+
+    # C1 does not change, so D1 is not recalculated (A1 is read by A1:B1)
+    excel_compiler.set_value('Sheet!A1', 2)
+    assert excel_compiler.cell_map['Sheet!E1'].value == 3
+    with mock.patch.object(excel_compiler, '_evaluate',
+                           wraps=excel_compiler._evaluate) as evaluate:
+        excel_compiler.recalculate_dirty()
+    recalculated = {call[0][0] for call in evaluate.call_args_list}
+    assert recalculated == {
+        'Sheet!A1', 'Sheet!B1', 'Sheet!C1', 'Sheet!E1', 'Sheet!A1:B1', 'Sheet!F1', 'Sheet!G1'}
+    assert excel_compiler.evaluate(output_addrs) == [100, 5, 60]
+
+    # recalculate dirty when evaluating
+    excel_compiler.set_value('Sheet!A1', 20)
+    assert excel_compiler.evaluate(output_addrs) == [101, 41, 600]
+
+    # or reset the dependents and only calculate what is needed
+    excel_compiler.set_value('Sheet!A1', 3)
+    assert excel_compiler.evaluate('Sheet!E1', recalculate_dirty=False) == 7
+    assert excel_compiler.cell_map['Sheet!D1'].value is None
+    assert excel_compiler.evaluate(output_addrs) == [100, 7, 90]
+
+    # without topological, set_value resets the dependents, no cells are dirty
+    excel_compiler = ExcelCompiler(excel=wb)
+    assert excel_compiler.evaluate(output_addrs) == [100, 3, 30]
+    excel_compiler.set_value('Sheet!A1', 2)
+    assert excel_compiler.cell_map['Sheet!E1'].value is None
+    with mock.patch.object(excel_compiler.log, 'warning') as warning:
+        excel_compiler.recalculate_dirty()
+    assert warning.call_count == 1
+    assert excel_compiler.evaluate(output_addrs) == [100, 5, 60]
+
+
+@pytest.mark.parametrize('kwargs', (
+    dict(),
+    dict(topological=True),
+    dict(cycles=dict(iterations=100, tolerance=0.001)),
+))
+def test_recalculate_volatile(kwargs):
+    wb = Workbook()
+    ws = wb.active
+    ws['A1'], ws['A2'], ws['A3'] = 1, 2, 3
+    ws['B1'] = 1
+    ws['C1'] = '=OFFSET(A1,B1,0)'
+    ws['D1'] = '=C1*10'
+    ws['E1'] = '=B1+1'
+    ws['F1'] = '=NOW()'
+    ws['G1'] = '=TODAY()'
+
+    excel_compiler = ExcelCompiler(excel=wb, **kwargs)
+    assert excel_compiler.evaluate(['Sheet!D1', 'Sheet!E1', 'Sheet!F1']) == [
+        20, 2, pytest.approx(excel_compiler.evaluate('Sheet!F1'), abs=1)]
+    assert {cell.address.address for cell in excel_compiler._volatile_cells} == {
+        'Sheet!C1', 'Sheet!F1'}
+
+    # the cell used by OFFSET() is not a precedent, so C1 is not reset
+    excel_compiler.cell_map['Sheet!A2'].value = 5
+    if not excel_compiler.cycles:
+        assert excel_compiler.evaluate('Sheet!D1') == 20
+
+    with mock.patch.object(excel_compiler, '_evaluate',
+                           wraps=excel_compiler._evaluate) as evaluate:
+        excel_compiler.recalculate_volatile()
+    recalculated = {call[0][0] for call in evaluate.call_args_list}
+    assert {'Sheet!C1', 'Sheet!D1', 'Sheet!F1'} <= recalculated
+    assert 'Sheet!G1' not in recalculated
+    if not excel_compiler.cycles:
+        assert 'Sheet!E1' not in recalculated
+    assert excel_compiler.evaluate('Sheet!D1') == 50
+
+    # unchanged volatile cells do not recalculate their dependents
+    with mock.patch.object(excel_compiler, '_evaluate',
+                           wraps=excel_compiler._evaluate) as evaluate:
+        excel_compiler.recalculate_volatile()
+    recalculated = {call[0][0] for call in evaluate.call_args_list}
+    if not excel_compiler.cycles:
+        assert 'Sheet!D1' not in recalculated
+
+    # trimmed cells are no longer volatile
+    excel_compiler.trim_graph(['Sheet!B1'], ['Sheet!E1'])
+    assert {cell.address.address for cell in excel_compiler._volatile_cells} == {
+        'Sheet!C1'}
+
+
+@pytest.mark.parametrize('topological', (False, True))
+def test_runtime_references(topological):
+    wb = Workbook()
+    ws = wb.active
+    for row in range(1, 6):
+        ws[f'A{row}'] = row
+    ws['B1'] = 1
+    ws['C1'] = '=OFFSET(A1,B1,0)'
+    ws['D1'] = '=C1*10+1'
+    ws['E1'] = '=INDIRECT("A" & B1 + 3)'
+    ws['F1'] = '=SUM(OFFSET(A1,0,0,B1,1))'
+
+    excel_compiler = ExcelCompiler(excel=wb, topological=topological)
+    outputs = ['Sheet!D1', 'Sheet!E1', 'Sheet!F1']
+    assert excel_compiler.evaluate(outputs) == [21, 4, 1]
+
+    def runtime_precedents(address):
+        cell = excel_compiler.cell_map[address]
+        return {precedent.address.address
+                for precedent in excel_compiler.dep_graph.predecessors(cell)
+                } - {address.address for address in cell.needed_addresses}
+
+    assert runtime_precedents('Sheet!C1') == {'Sheet!A2'}
+    assert runtime_precedents('Sheet!E1') == {'Sheet!A4'}
+    assert runtime_precedents('Sheet!F1') == set()
+
+    # changing a referenced cell recalculates the cells referencing it
+    excel_compiler.set_value('Sheet!A2', 5)
+    assert excel_compiler.evaluate(outputs) == [51, 4, 1]
+
+    # the runtime edges are replaced when the references change
+    excel_compiler.set_value('Sheet!B1', 2)
+    assert excel_compiler.evaluate(outputs) == [31, 5, 6]
+    assert runtime_precedents('Sheet!C1') == {'Sheet!A3'}
+    assert runtime_precedents('Sheet!E1') == {'Sheet!A5'}
+    assert runtime_precedents('Sheet!F1') == {'Sheet!A1:A2'}
+
+    excel_compiler.set_value('Sheet!A2', 7)
+    if not topological:
+        assert excel_compiler.cell_map['Sheet!D1'].value == 31
+    assert excel_compiler.evaluate(outputs) == [31, 5, 8]
+    excel_compiler.set_value('Sheet!A3', 6)
+    assert excel_compiler.evaluate(outputs) == [61, 5, 8]
+
+
+def test_dynamic_references():
+    wb = Workbook()
+    ws = wb.active
+    for row in range(1, 6):
+        ws[f'A{row}'] = row
+    ws['B1'] = 1
+    ws['C1'] = '=OFFSET(A1,2,0)+INDIRECT("A"&4)'
+    ws['C2'] = '=SUM(OFFSET(A1,0,0,3,1))'
+    ws['C3'] = '=OFFSET(A1,B1,0)'
+    ws['C4'] = '=C1+C2+C3'
+    rates = wb.create_sheet('Rates')
+    rates['B5'] = 0.5
+    ws['C5'] = '=INDIRECT("Rates!B"&5)'
+
+    excel_compiler = ExcelCompiler(excel=wb)
+    assert excel_compiler.evaluate(['Sheet!C4', 'Sheet!C5']) == [15, 0.5]
+
+    # the resolved references are static edges, and are not volatile
+    assert excel_compiler.dynamic_references() == (4, ('Sheet!C3', ))
+    assert excel_compiler._volatile_cells == {
+        excel_compiler.cell_map['Sheet!C3']}
+    assert {a.address for a in excel_compiler.cell_map['Sheet!C1']
+            .needed_addresses} == {'Sheet!A3', 'Sheet!A4'}
+
+    excel_compiler.set_value('Sheet!A4', 10)
+    excel_compiler.set_value('Rates!B5', 2)
+    assert excel_compiler.evaluate(['Sheet!C4', 'Sheet!C5']) == [21, 2]
+
+
+def test_function_names_in_strings():
+    wb = Workbook()
+    ws = wb.active
+    ws['A1'] = '="now()"&"x"'
+    ws['A2'] = '="offset(" & "INDIRECT(A1)"'
+    ws['A3'] = '=LEN("today()")+NOW()*0'
+
+    excel_compiler = ExcelCompiler(excel=wb)
+    assert excel_compiler.evaluate(['Sheet!A1', 'Sheet!A2', 'Sheet!A3']) == [
+        'now()x', 'offset(INDIRECT(A1)', 7]
+
+    # only the calls, not the text, are volatile or dynamic references
+    assert {cell.address.address for cell in excel_compiler._volatile_cells} == {
+        'Sheet!A3'}
+    assert excel_compiler.dynamic_references() == (0, ())
+
+
+def test_lazy_evaluation():
+    wb = Workbook()
+    ws = wb.active
+    ws['A1'] = 1
+    ws['B1'] = '=IF(A1>0, C1, D1)'
+    ws['B2'] = '=CHOOSE(A1, C2, D2)'
+    ws['B3'] = '=SWITCH(A1, 2, D3, 1, C3, D4)'
+    ws['B4'] = '=IFS(A1=2, D5, A1=1, C4)'
+    ws['B5'] = '=IFERROR(C5, D6)'
+    ws['B6'] = '=IFNA(A1, D7)'
+    for row in range(1, 6):
+        ws[f'C{row}'] = f'={row}*10'
+    for row in range(1, 8):
+        ws[f'D{row}'] = f'=-{row}'
+
+    excel_compiler = ExcelCompiler(excel=wb)
+    outputs = [f'Sheet!B{row}' for row in range(1, 7)]
+
+    def evaluated():
+        return {address for address, cell in excel_compiler.cell_map.items()
+                if address.startswith('Sheet!D') and cell.value is not None}
+
+    assert excel_compiler.evaluate(outputs) == [10, 20, 30, 40, 50, 1]
+    assert evaluated() == set()
+
+    # the graph has all of the potential precedents
+    assert {a.address for a in excel_compiler.cell_map['Sheet!B1']
+            .needed_addresses} == {'Sheet!A1', 'Sheet!C1', 'Sheet!D1'}
+
+    excel_compiler.set_value('Sheet!A1', 2)
+    assert excel_compiler.evaluate(outputs) == [10, -2, -3, -5, 50, 2]
+    assert evaluated() == {'Sheet!D2', 'Sheet!D3', 'Sheet!D5'}
+
+
+def test_evaluate_batch():
+    wb = Workbook()
+    ws = wb.active
+    ws['A1'] = 2
+    ws['B1'] = '=A1*3+1'
+    ws['C1'] = '=1/(A1-1)'
+    ws['D1'] = '=IF(B1>10,B1,-B1)'
+    ws['E1'] = '=SUM(A1:B1)'
+    ws['F1'] = '=LEN("abc")+A1'
+    ws['G1'] = 5
+    ws['H1'] = '=G1*2'
+
+    excel_compiler = ExcelCompiler(excel=wb)
+    output_addrs = ['Sheet!B1', 'Sheet!C1', 'Sheet!D1', 'Sheet!E1', 'F1', 'Sheet!H1']
+    scenarios = [0, 1, 2, 3, 10]
+    results = excel_compiler.evaluate_batch(
+        {'Sheet!A1': np.array(scenarios)}, output_addrs)
+    assert set(results) == set(output_addrs)
+    assert results['Sheet!B1'].dtype == float
+    assert results['Sheet!C1'].dtype == object
+
+    # the cell map still holds the base scenario
+    assert excel_compiler.cell_map['Sheet!C1'].value == 1
+
+    expected = []
+    for value in scenarios:
+        excel_compiler.set_value('Sheet!A1', value)
+        expected.append(excel_compiler.evaluate(output_addrs))
+    for i, addr in enumerate(output_addrs):
+        assert list(results[addr]) == [values[i] for values in expected]
+
+    with pytest.raises(ValueError, match='same length'):
+        excel_compiler.evaluate_batch(
+            {'Sheet!A1': np.arange(3), 'Sheet!G1': np.arange(4)}, output_addrs)
+
+    with pytest.raises(ValueError, match='not a valid coordinate'):
+        excel_compiler.evaluate_batch({'Sheet!A1': np.arange(3)}, ['Sheet!A1:B1'])
+
+
+def test_evaluate_batch_cycles():
+    wb = Workbook()
+    ws = wb.active
+    ws['A1'] = 2
+    ws['B1'] = '=A1+C1/2'
+    ws['C1'] = '=B1/2'
+    ws['D1'] = '=B1*10'
+
+    excel_compiler = ExcelCompiler(
+        excel=wb, cycles=dict(iterations=100, tolerance=0.0001))
+    output_addrs = ['Sheet!C1', 'Sheet!D1']
+    scenarios = [0, 1, 3]
+    results = excel_compiler.evaluate_batch(
+        {'Sheet!A1': np.array(scenarios)}, output_addrs)
+
+    # the cell map still holds the base scenario
+    assert excel_compiler.cell_map['Sheet!A1'].value == 2
+    assert excel_compiler.cell_map['Sheet!D1'].value == pytest.approx(80 / 3, abs=0.01)
+
+    for i, value in enumerate(scenarios):
+        assert results['Sheet!C1'][i] == pytest.approx(value * 2 / 3, abs=0.001)
+        assert results['Sheet!D1'][i] == pytest.approx(value * 40 / 3, abs=0.01)
+
+
+def load_python_module(filename):
+    spec = importlib.util.spec_from_file_location('exported', filename)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def test_export_python_module(tmpdir):
+    wb = Workbook()
+    ws = wb.active
+    ws['A1'] = 2
+    ws['B1'] = '=A1*3+1'
+    ws['C1'] = '=1/(A1-1)'
+    ws['D1'] = '=IF(B1>10,B1,-B1)'
+    ws['E1'] = '=SUM(A1:B1)'
+    ws['F1'] = '=LEN("abc")+A1+ROW(A5)'
+    ws['G1'] = 5
+    ws['H1'] = '=G1*2+SQRT(A1)'
+
+    excel_compiler = ExcelCompiler(excel=wb)
+    output_addrs = ['Sheet!B1', 'Sheet!C1', 'Sheet!D1', 'Sheet!E1',
+                    'Sheet!F1', 'Sheet!H1', 'Sheet!G1', 'Sheet!A1']
+    filename = os.path.join(str(tmpdir), 'exported.py')
+    excel_compiler.export_python_module(filename, ['A1'], output_addrs)
+
+    module = load_python_module(filename)
+    assert module.INPUTS == ('Sheet!A1', )
+    assert module.OUTPUTS == tuple(output_addrs)
+
+    with open(filename) as f:
+        source = f.read()
+    assert '_C_(' not in source
+    assert 'pycel.lib.logical' in source
+    assert 'pycel.lib.stats' not in source
+
+    for value in (0, 1, 2, 3, 10):
+        excel_compiler.set_value('Sheet!A1', value)
+        assert module.evaluate(value) == tuple(
+            excel_compiler.evaluate(output_addrs))
+
+
+def test_export_python_module_trimmed(excel_compiler, tmpdir):
+    input_addrs = ['trim-range!D5']
+    output_addrs = ['trim-range!B2']
+    excel_compiler.trim_graph(input_addrs, output_addrs)
+
+    filename = os.path.join(str(tmpdir), 'trimmed.py')
+    excel_compiler.export_python_module(
+        filename, input_addrs, output_addrs, function_name='trimmed')
+    module = load_python_module(filename)
+
+    for value in (-1, 0.5, 20):
+        excel_compiler.set_value(input_addrs[0], value)
+        assert module.trimmed(value) == (excel_compiler.evaluate(output_addrs[0]), )
+
+
+@pytest.mark.parametrize(
+    'formula, message', (
+        ('=OFFSET(A1,C1,1)', 'dynamic references'),
+        ('=INDIRECT("A" & C1)', 'dynamic references'),
+        ('=A1+B1', 'circular references'),
+        ('=NOTAFUNCTION(C1)', 'NOTAFUNCTION is not implemented'),
+    )
+)
+def test_export_python_module_not_supported(formula, message, tmpdir):
+    wb = Workbook()
+    ws = wb.active
+    ws['A1'] = '=B1+1'
+    ws['B1'] = formula
+    excel_compiler = ExcelCompiler(excel=wb)
+    filename = os.path.join(str(tmpdir), 'exported.py')
+    with pytest.raises(Exception, match=message):
+        excel_compiler.export_python_module(filename, [], ['Sheet!A1'])
+
+
+def test_export_python_module_unexported(tmpdir):
+    wb = Workbook()
+    ws = wb.active
+    ws['A1'] = '=B1+C1'
+    ws['B1'] = '=C1*2'
+    ws['C1'] = 1
+    excel_compiler = ExcelCompiler(excel=wb)
+    filename = os.path.join(str(tmpdir), 'unexported.py')
+
+    # the references are found at export, not when the module is run
+    with mock.patch('pycel.excelcompiler.ast.walk', return_value=()):
+        with pytest.raises(ValueError, match=r'not exported: Sheet!B1, Sheet!C1$'):
+            excel_compiler.export_python_module(filename, [], ['Sheet!A1'])
+    assert not os.path.exists(filename)
+
+
+def test_bound_references():
+    wb = Workbook()
+    ws = wb.active
+    ws['A1'] = 1
+    ws['A2'] = 2
+    ws['B1'] = '=A1+SUM(A1:A2)+A1'
+
+    excel_compiler = ExcelCompiler(excel=wb)
+    assert excel_compiler.evaluate('Sheet!B1') == 5
+    formula = excel_compiler.cell_map['Sheet!B1'].formula
+    assert formula.compiled_python[2] == ('Sheet!A1', 'Sheet!A1:A2')
+
+    # the lambda reads the value from the bound cell, not the cell map
+    bound_cell = excel_compiler.cell_map['Sheet!A1']
+    excel_compiler.cell_map['Sheet!A1'] = _Cell('Sheet!A1', value=100)
+    bound_cell.value = 10
+    excel_compiler.cell_map['Sheet!B1'].value = None
+    assert excel_compiler.evaluate('Sheet!B1') == 23
+
+    # a bound cell which needs calc is evaluated via the cell map
+    bound_cell.value = None
+    excel_compiler.cell_map['Sheet!B1'].value = None
+    assert excel_compiler.evaluate('Sheet!B1') == 203
+
+
+def test_formula_templates():
+    wb = Workbook()
+    ws = wb.active
+    for row in range(1, 5):
+        ws[f'A{row}'] = row
+        ws[f'B{row}'] = f'=A{row}*$A$1+SUM(A$1:A{row})+ROW()'
+        ws[f'C{row}'] = f'=SUM(A:A)-B{row}'
+    ws['D1'] = '=B1+A$4'
+
+    excel_compiler = ExcelCompiler(excel=wb)
+    assert excel_compiler.evaluate('Sheet!B4') == 4 * 1 + 10 + 4
+    assert excel_compiler.evaluate('Sheet!C3') == 10 - (3 + 6 + 3)
+    assert excel_compiler.evaluate('Sheet!D1') == 3 + 4
+    excel_compiler.evaluate([f'Sheet!C{row}' for row in range(1, 5)])
+
+    # only the first copy is parsed, the others have the same python code
+    # as the formula parsed at each cell
+    for col in 'BC':
+        formulas = [excel_compiler.cell_map[f'Sheet!{col}{row}'].formula
+                    for row in range(1, 5)]
+        assert sum(formula._ast is not None for formula in formulas) == 1
+        for formula in formulas:
+            parsed = ExcelFormula(formula.base_formula, cell=formula.cell)
+            assert formula.python_code == parsed.ast.emit
+
+    # and share the compiled code, except where A$1:A1 is the cell A1
+    b1, b2, b3 = (excel_compiler.cell_map[f'Sheet!B{row}'].formula
+                  for row in (1, 2, 3))
+    assert b2.compiled_python[0] is b3.compiled_python[0]
+    assert b1.compiled_python[0] is not b2.compiled_python[0]
+    assert b1.compiled_python[2] == ('Sheet!A1', 'Sheet!B1')
+    assert b2.compiled_python[2] == ('Sheet!A2', 'Sheet!A1', 'Sheet!A1:A2',
+                                     'Sheet!B2')
@@ -7,8 +7,10 @@
 # You may obtain a copy of the Licence at:
 #   https://www.gnu.org/licenses/gpl-3.0.en.html
 
+import ast
 import collections
 import logging
+import math
 import os
 import pickle
 from unittest import mock
@@ -17,10 +19,17 @@ import numpy as np
 import pytest
 
 from pycel.excelformula import (
+    _r1c1_formula_key,
     ASTNode,
+    CommonSubexpressions,
+    DeadBranchEliminator,
     ExcelFormula,
     FormulaEvalError,
     FormulaParserError,
+    FunctionNode,
+    OperatorWrapper,
+    python_code_from_ast,
+    python_code_template,
     Token,
     UnknownFunction,
 )
@@ -29,8 +38,10 @@ from pycel.excelutil import (
     DIV0,
     NAME_ERROR,
     NULL_ERROR,
+    NUM_ERROR,
     VALUE_ERROR,
 )
+from pycel.lib.function_helpers import apply_meta, LAZY_PARAM_FUNCTIONS
 
 
 FormulaTest = collections.namedtuple('FormulaTest', 'formula rpn python_code')
@@ -244,9 +255,10 @@ if_inputs = [
         ',0, IF(AND(R[23]C[11]>=55,R[24]C[11]>=20),R53C3,0))))',
         'R13C3|2002|1|6|DATE|>|0|R[41]C[2]|ISERROR|0|R13C3|R[41]C[2]|>=|0|'
         'R[23]C[11]|55|>=|R[24]C[11]|20|>=|AND|R53C3|0|IF|IF|IF|IF',
-        'if_(_C_("C13") > date(2002, 1, 6), 0, if_(iserror(_C_("C42")), 0, '
-        'if_(_C_("C13") >= _C_("C42"), 0, if_(and_('
-        '_C_("L24") >= 55, _C_("L25") >= 20), _C_("C53"), 0))))'),
+        'if_(_C_("C13") > date(2002, 1, 6), 0, lambda: if_(iserror('
+        '_C_("C42")), 0, lambda: if_(_C_("C13") >= _C_("C42"), 0, '
+        'lambda: if_(and_(_C_("L24") >= 55, _C_("L25") >= 20), '
+        'lambda: _C_("C53"), 0))))'),
     FormulaTest(
         '=IF(R[39]C[11]>65,R[25]C[42],ROUND((R[11]C[11]*IF(OR(AND('
         'R[39]C[11]>=55, R[40]C[11]>=20),AND(R[40]C[11]>=20,R11C3="YES")),'
@@ -258,24 +270,26 @@ if_inputs = [
         'R[44]C[11]|R[43]C[11]|IF|*|R[14]C[11]|R[39]C[11]|55|>=|'
         'R[40]C[11]|20|>=|AND|R[40]C[11]|20|>=|R11C3|"YES"|=|AND|OR|'
         'R[45]C[11]|R[43]C[11]|IF|*|+|0|ROUND|IF',
-        'if_(_C_("L40") > 65, _C_("AQ26"), round_((_C_("L12") * if_(or_('
-        'and_(_C_("L40") >= 55, _C_("L41") >= 20), and_(_C_("L41") >= 20, '
-        '_C_("C11") == "YES")), _C_("L45"), _C_("L44"))) + (_C_("L15") * '
-        'if_(or_(and_(_C_("L40") >= 55, _C_("L41") >= 20), and_(_C_("L41") '
-        '>= 20, _C_("C11") == "YES")), _C_("L46"), _C_("L44"))), 0))'),
+        'if_(_C_("L40") > 65, lambda: _C_("AQ26"), lambda: round_(('
+        '_C_("L12") * if_(or_(and_(_C_("L40") >= 55, _C_("L41") >= 20), '
+        'and_(_C_("L41") >= 20, _C_("C11") == "YES")), lambda: _C_("L45"), '
+        'lambda: _C_("L44"))) + (_C_("L15") * if_(or_(and_(_C_("L40") >= 55, '
+        '_C_("L41") >= 20), and_(_C_("L41") >= 20, _C_("C11") == "YES")), '
+        'lambda: _C_("L46"), lambda: _C_("L44"))), 0))'),
     FormulaTest(
         '=IF(AI119="","",E119)',
         'AI119|""|=|""|E119|IF',
-        'if_(_C_("AI119") == "", "", _C_("E119"))'),
+        'if_(_C_("AI119") == "", "", lambda: _C_("E119"))'),
     FormulaTest(
         '=IF(P5=1.0,"NA",IF(P5=2.0,"A",IF(P5=3.0,"B",IF(P5=4.0,"C",'
         'IF(P5=5.0,"D",IF(P5=6.0,"E",IF(P5=7.0,"F",IF(P5=8.0,"G"))))))))',
         'P5|1.0|=|"NA"|P5|2.0|=|"A"|P5|3.0|=|"B"|P5|4.0|=|"C"|P5|5.0|=|'
         '"D"|P5|6.0|=|"E"|P5|7.0|=|"F"|P5|8.0|=|"G"|IF|IF|IF|IF|IF|IF|IF|IF',
-        'if_(_C_("P5") == 1.0, "NA", if_(_C_("P5") == 2.0, "A", '
-        'if_(_C_("P5") == 3.0, "B", if_(_C_("P5") == 4.0, "C", '
-        'if_(_C_("P5") == 5.0, "D", if_(_C_("P5") == 6.0, "E", '
-        'if_(_C_("P5") == 7.0, "F", if_(_C_("P5") == 8.0, "G"))))))))'),
+        'if_(_C_("P5") == 1.0, "NA", lambda: if_(_C_("P5") == 2.0, "A", '
+        'lambda: if_(_C_("P5") == 3.0, "B", lambda: if_(_C_("P5") == 4.0, '
+        '"C", lambda: if_(_C_("P5") == 5.0, "D", lambda: if_(_C_("P5") == '
+        '6.0, "E", lambda: if_(_C_("P5") == 7.0, "F", lambda: if_('
+        '_C_("P5") == 8.0, "G"))))))))'),
 ]
 
 fancy_reference_inputs = [
@@ -303,7 +317,7 @@ fancy_reference_inputs = [
     FormulaTest(
         '=INDIRECT("sheet1!$A$1:$B$2")',
         '"sheet1!$A$1:$B$2"|INDIRECT',
-        'indirect("sheet1!$A$1:$B$2", True, "")'),
+        '_R_("sheet1!A1:B2")'),
     FormulaTest(
         '=INDIRECT("sheet1!$A$1:$B$2", FALSE)',
         '"sheet1!$A$1:$B$2"|FALSE|INDIRECT',
@@ -338,7 +352,8 @@ fancy_reference_inputs = [
     FormulaTest(
         '=IF(configurations!$G$22=3,sizing!$C$303,M14)',
         'configurations!$G$22|3|=|sizing!$C$303|M14|IF',
-        'if_(_C_("configurations!G22") == 3, _C_("sizing!C303"), _C_("M14"))'),
+        'if_(_C_("configurations!G22") == 3, lambda: _C_("sizing!C303"), '
+        'lambda: _C_("M14"))'),
     FormulaTest(
         '=TableX[[#This Row],[COL1]]&"-"&TableX[[#This Row],[COL2]]',
         'TableX[[#This Row],[COL1]]|"-"|&|TableX[[#This Row],[COL2]]|&',
@@ -628,6 +643,20 @@ def test_build_eval_context(result, formula):
     assert eval_context(ExcelFormula(formula)) == pytest.approx(result)
 
 
+def test_build_eval_context_shared_functions():
+    eval_context = ExcelFormula.build_eval_context(lambda x: 1, lambda x: 1)
+    formulas = ExcelFormula('=SUM(A1, 2)'), ExcelFormula('=SUM(A1) + abs(-A1)')
+    with mock.patch('pycel.lib.function_helpers.apply_meta',
+                    wraps=apply_meta) as wrapper:
+        assert [eval_context(f) for f in formulas] == [3, 2]
+
+    # each function is wrapped once, and shared by the formulas
+    wrapped = [call[0][0].__name__ for call in wrapper.call_args_list]
+    assert wrapped == ['sum_', 'abs_']
+    name_spaces = [f.compiled_lambda.__globals__ for f in formulas]
+    assert name_spaces[0] is name_spaces[1]
+
+
 def test_math_wrap():
     eval_context = ExcelFormula.build_eval_context(
         lambda x: None, lambda x: DIV0)
@@ -654,6 +683,166 @@ def test_compiled_python_cache():
     formula._marshalled_python = 'junk'
     assert compiled_python == formula.compiled_python
 
+    # marshalled code from before bound references, rebuild from source
+    formula._compiled_python = None
+    formula._marshalled_python = formula._marshalled_python[:2]
+    assert compiled_python == formula.compiled_python
+
+
+def test_compiled_python_shared():
+    formulas = [ExcelFormula(f'=_C_("S!A{row}") + 1',
+                             formula_is_python_code=True)
+                for row in range(1, 4)]
+    codes = [formula.compiled_python[0] for formula in formulas[:2]]
+    assert codes[0] is codes[1]
+    assert formulas[1].compiled_python[2] == ('S!A2', )
+
+    # the code of a formula from a text file is placed at its line
+    formulas[2].filename = 'a_file'
+    formulas[2].lineno = 10
+    code = formulas[2].compiled_python[0]
+    assert code is not codes[0]
+    assert code.co_code == codes[0].co_code
+    assert code.co_filename == 'a_file'
+    lambda_code = next(c for c in code.co_consts if hasattr(c, 'co_code'))
+    assert lambda_code.co_firstlineno == 10
+
+
+@pytest.mark.parametrize(
+    'formula, result, names', (
+        ('=1/12', 1 / 12, ()),
+        ('=(1+0.05)^(1/365)', 1.05 ** (1 / 365), ()),
+        ('="Q"&1', 'Q1', ()),
+        ('=-1', -1, ()),
+        ('=PI()*2', math.pi * 2, ()),
+        ('=DATE(2020,1,1)', 43831, ()),
+        ('=TEXT(1.5,"0.00")&"x"', '1.50x', ()),
+        ('=1>2', False, ()),
+        ('=IF(TRUE,1+1,2)', 2, ('if_', )),
+        ('=1/0', DIV0, ('excel_operator_operand_fixup', )),
+        ('=SQRT(-1)', NUM_ERROR, ('sqrt', )),
+        ('={1,2}+1', ((2, 3), ), ('excel_operator_operand_fixup', )),
+        ('=LEN("abc")+1', 4, ()),
+    )
+)
+def test_constant_folding(formula, result, names, empty_eval_context):
+    excel_formula = ExcelFormula(formula)
+    code, needed_names, _ = excel_formula.compiled_python
+    for _ in range(2):
+        # the lambda for the formula, in the lambda binding its addresses
+        code = next(c for c in code.co_consts if hasattr(c, 'co_code'))
+    assert code.co_names == names
+    assert needed_names == {'lambdas'} | (set(names) - {
+        'excel_operator_operand_fixup'})
+    assert empty_eval_context(excel_formula) == result
+
+
+@pytest.mark.parametrize(
+    'formula, expected', (
+        ('=IF(A1, B1, C1)', "if_(True, lambda: _C_('S!B1'), None)"),
+        ('=IF(A1*2>5, B1, C1)', "if_(False, None, lambda: _C_('S!C1'))"),
+        ('=IF(A2, B1, C1)', None),
+        ('=IF(A1, B1)', None),
+        ('=IF(A1:A2, B1, C1)', None),
+        ('=CHOOSE(A3, B1, B2+1, C1)',
+         "choose(2, None, lambda: _C_('S!B2') + 1, None)"),
+        ('=SWITCH(A3, 1, B1, 2, B2, C1)',
+         "switch(2, 1, None, 2, lambda: _C_('S!B2'), None)"),
+        ('=SWITCH(A3, A2, B1, 2, B2)', None),
+        ('=IFS(A3=1, B1, A1, B2, A2, C1)',
+         "ifs(False, None, True, lambda: _C_('S!B2'), None, None)"),
+        ('=IFERROR(A4, B1)', None),
+        ('=IFNA(A4, B1)', "ifna('#DIV/0!', None)"),
+        ('=IFERROR(A1, B1)', "iferror(True, None)"),
+        ('=A1+IF(SUM(A3,1)>2, IF(A2, B1, C1), C2)',
+         "_C_('S!A1') + if_(True, lambda: if_(_C_('S!A2'), "
+         "lambda: _C_('S!B1'), lambda: _C_('S!C1')), None)"),
+    )
+)
+def test_dead_branch_elimination(formula, expected, ATestCell):
+    constants = {'S!A1': True, 'S!A3': np.int64(2), 'S!A4': DIV0}
+
+    excel_formula = ExcelFormula(formula, cell=ATestCell('Z', 1, sheet='S'))
+    tree = ast.parse(excel_formula.python_code, mode='eval')
+    eliminator = DeadBranchEliminator(constants.__getitem__)
+    result = python_code_from_ast(eliminator.visit(tree))
+    if expected is None:
+        assert eliminator.eliminated == 0
+        assert result == python_code_from_ast(
+            ast.parse(excel_formula.python_code, mode='eval'))
+    else:
+        assert eliminator.eliminated > 0
+        assert result == expected
+
+
+@pytest.mark.parametrize(
+    'formulas, expected', (
+        (('=SUM(A1:A3)+1', '=SUM(A1:A3)*2'), {"sum_(_R_('S!A1:A3'))"}),
+        (('=SUM(A1:A3)', '=SUM(A1:A2)'), set()),
+        (('=COUNTIF(A1:A3, B1)', '=COUNTIF(A1:A3, B1)'),
+         {"countif(_R_('S!A1:A3'), _C_('S!B1'))"}),
+        (('=COUNTIF(A1:A3, B1:B2)', '=COUNTIF(A1:A3, B1:B2)'), set()),
+        (('=SUM(B1:B2, TODAY())', '=SUM(B1:B2, TODAY())'), set()),
+        (('=SUM(INDEX(A1:A2, 1):A3)', '=SUM(INDEX(A1:A2, 1):A3)'), set()),
+        (('=ROUND(B1, 2)', '=ROUND(B1, 2)'), set()),
+        # only repeated inside the repeated call
+        (('=MAX(SUM(A1:A3), 1)', '=MAX(SUM(A1:A3), 1)'),
+         {"max_(sum_(_R_('S!A1:A3')), 1)"}),
+        (('=MAX(SUM(A1:A3), 1)', '=MAX(SUM(A1:A3), 1)', '=SUM(A1:A3)'),
+         {"max_(sum_(_R_('S!A1:A3')), 1)", "sum_(_R_('S!A1:A3'))"}),
+        (('=VLOOKUP(SUM(A1:A3), B1:C3, 2)', '=VLOOKUP(SUM(A1:A3), B1:C3, 3)'),
+         {"sum_(_R_('S!A1:A3'))"}),
+    )
+)
+def test_common_subexpressions(formulas, expected, ATestCell):
+    trees = tuple(
+        ast.parse(ExcelFormula(formula, cell=ATestCell(
+            'Z', 1, sheet='S')).python_code, mode='eval').body
+        for formula in formulas)
+    finder = CommonSubexpressions(excluded={'today'})
+    repeated = finder.repeated(trees)
+    assert repeated == expected
+
+    references = {code: ast.Name(id='x', ctx=ast.Load())
+                  for code in repeated}
+    for tree in trees:
+        finder.replace(tree, references)
+    assert finder.replaced == (len(formulas) if repeated else 0)
+
+
+@pytest.mark.parametrize(
+    'python_code, expected', (
+        ('1 + 2', ('1 + 2', ())),
+        ('_C_("S!A1") + sum_(_R_("S!A1:B2"), _C_("S!A1"))',
+         ('_C_(_A0_) + sum_(_R_(_A1_), _C_(_A0_))', ('S!A1', 'S!A1:B2'))),
+        ('row(_REF_("S!B2"))', ('row(_REF_(_A0_))', ('S!B2', ))),
+        ('concat("_C_(S!A1)", x._C_("S!A1"))',
+         ('concat("_C_(S!A1)", x._C_("S!A1"))', ())),
+    )
+)
+def test_python_code_template(python_code, expected):
+    assert python_code_template(python_code) == expected
+
+
+@pytest.mark.parametrize(
+    'formula1, address1, formula2, address2, same', (
+        ('=A1+$B$1', 'S!C1', '=A2+$B$1', 'S!C2', True),
+        ('=A1+$B$1', 'S!C1', '=A2+$B$2', 'S!C2', False),
+        ('=SUM(A$1:A1)', 'S!B1', '=SUM(A$1:A5)', 'S!B5', True),
+        ('=SUM(A$1:A1)', 'S!B1', '=SUM(A$1:A5)', 'S!B4', False),
+        ('=SUM(A:A)+S2!B1', 'S!C1', '=SUM(B:B)+S2!C1', 'S!D1', True),
+        ('=SUM(1:1)', 'S!C1', '=SUM(2:2)', 'S!C2', True),
+        ('=A1&"A1"', 'S!C1', '=A2&"A1"', 'S!C2', True),
+        ('=A1&"A1"', 'S!C1', '=A2&"A2"', 'S!C2', False),
+        ('=a_name+A1', 'S!C1', '=a_name+A2', 'S!C2', True),
+        ('=a_name+A1', 'S!C1', '=b_name+A2', 'S!C2', False),
+    )
+)
+def test_r1c1_formula_key(formula1, address1, formula2, address2, same):
+    key1 = _r1c1_formula_key(formula1, AddressCell(address1))
+    key2 = _r1c1_formula_key(formula2, AddressCell(address2))
+    assert (key1 == key2) == same
+
 
 def test_compiled_python_error():
     formula = ExcelFormula('=1 + 2')
@@ -677,6 +866,18 @@ def test_save_to_file(fixture_dir):
     assert formula.python_code == loaded_formula.python_code
 
 
+def test_setstate_from_dict():
+    # formulas pickled before __slots__ have only some of the current slots
+    formula = ExcelFormula.__new__(ExcelFormula)
+    formula.__setstate__(dict(
+        _python_code='_C_("S!A1") + 1', lineno=3, msg=None, base_formula=None))
+    assert formula.lineno == 3
+    assert formula.filename == ''
+    assert formula.needed_addresses == (AddressCell('S!A1'), )
+    assert formula.compiled_python[1] == {'_C_', 'lambdas'}
+    assert not hasattr(formula, '__dict__')
+
+
 def test_init_from_python_code():
     excel_formula1 = ExcelFormula('=B32:B119 + P5')
     assert '_R_("B32:B119") + _C_("P5")' == \
@@ -885,6 +1086,29 @@ def test_row(formula, result, cell, empty_eval_context, ATestCell):
     assert empty_eval_context(ExcelFormula(formula, cell=cell)) == result
 
 
+@pytest.mark.parametrize(
+    'formula, python_code', (
+        ('=OFFSET(A1,0,3)', '_C_("Sheet!D1")'),
+        ('=OFFSET(A1,1+1,1,2,2)', '_R_("Sheet!B3:C4")'),
+        ('=OFFSET(A1:B2,1,0,,1)', '_R_("Sheet!A2:A3")'),
+        ('=OFFSET(A1,-1,0)', '"#REF!"'),
+        ('=SUM(OFFSET(A1,0,0,3,1))', 'sum_(_R_("Sheet!A1:A3"))'),
+        ('=INDIRECT("Rates!B"&5)', '_C_("Rates!B5")'),
+        ('=INDIRECT("A1:B"&2, TRUE)', '_R_("Sheet!A1:B2")'),
+        ('=ROW(INDIRECT("A3:A5"))', 'row(_REF_("Sheet!A3:A5"))'),
+        ('=OFFSET(A1,B1,0)', 'offset(_REF_("Sheet!A1"), _C_("Sheet!B1"), 0)'),
+        ('=OFFSET(A1,"1",0)', 'offset(_REF_("Sheet!A1"), "1", 0)'),
+        ('=OFFSET(A1,0,0,0)', 'offset(_REF_("Sheet!A1"), 0, 0, 0)'),
+        ('=INDIRECT(B1)', 'indirect(_C_("Sheet!B1"), True, "Sheet")'),
+        ('=INDIRECT("R1C1",FALSE)', 'indirect("R1C1", False, "Sheet")'),
+        ('=INDIRECT(1)', 'indirect(1, True, "Sheet")'),
+    )
+)
+def test_resolved_dynamic_references(formula, python_code, ATestCell):
+    cell = ATestCell('C', 3, sheet='Sheet')
+    assert ExcelFormula(formula, cell=cell).python_code == python_code
+
+
 @pytest.mark.parametrize(
     'formula, result', (
         ('=subtotal(01,A1:B3)', 'average(_R_("A1:B3"))'),
@@ -940,6 +1164,13 @@ def test_plugins():
         assert eval_ctx(ExcelFormula('=sum({1,2,3})')) == 6
 
 
+def test_lazy_param_functions():
+    # the functions passed lambdas are wrapped when loaded from plugins
+    assert LAZY_PARAM_FUNCTIONS == {
+        FunctionNode.func_map.get(name, name)
+        for name in FunctionNode.lazy_funcs}
+
+
 def test_unknown_name(empty_eval_context):
     assert NAME_ERROR == empty_eval_context(ExcelFormula('=CE'))
 
@@ -975,7 +1206,7 @@ def test_error_logging(caplog):
     assert 2 == len(caplog.records)
     assert "WARNING" == caplog.records[1].levelname
 
-    message = """return PYTHON_AST_OPERATORS[op](left_op, right_op)
+    message = """return number_op(left_op, right_op)
 ZeroDivisionError: division by zero
 Eval: 1 / 0
 Values: 1 Div 0"""
@@ -1057,3 +1288,46 @@ def test_unknown_function(msg, formula, empty_eval_context):
 
 if __name__ == '__main__':
     dump_parse()
+
+
+@pytest.mark.parametrize(
+    'python_code, expected', (
+        ('sum_(_R_("S!A1:B2"), 1.5)', 'sum_(_R_(\'S!A1:B2\'), 1.5)'),
+        ('((1, "a",), (True, None,),)', "((1, 'a'), (True, None))"),
+        ('(1,)', '(1,)'),
+        ('_C_("S!A1") + -2',
+         "excel_operator_operand_fixup(_C_('S!A1'), 'Add', "
+         "excel_operator_operand_fixup('#EMPTY!', 'USub', 2))"),
+        ('_REF_("S!A1") & _REF_("S!A1:B2")',
+         "_REF_('S!A1') & _REF_('S!A1:B2')"),
+    )
+)
+def test_python_code_from_ast(python_code, expected):
+    operator_wrapper = OperatorWrapper()
+    tree = operator_wrapper.visit(ast.parse(python_code, mode='eval'))
+    result = python_code_from_ast(tree)
+    assert result == expected
+    assert python_code_from_ast(ast.parse(result, mode='eval')) == result
+
+
+@pytest.mark.parametrize(
+    'python_code, expected', (
+        ('(_C_("S!A1") + 1) * -_C_("S!B1")',
+         "(_C_('S!A1') + 1) * (-_C_('S!B1'))"),
+        ('-2 ** 2 / 100', '(-(2 ** 2)) / 100'),
+        ('_C_("S!A1") & "a" != "b"', "(_C_('S!A1') & 'a') != 'b'"),
+        ('(1 < 2) == (_C_("S!A1") >= 3)', "(1 < 2) == (_C_('S!A1') >= 3)"),
+        ('if_(_C_("S!A1") <= 0, lambda: +1, None)',
+         "if_(_C_('S!A1') <= 0, lambda: +1, None)"),
+    )
+)
+def test_python_code_from_ast_operators(python_code, expected):
+    tree = ast.parse(python_code, mode='eval')
+    result = python_code_from_ast(tree)
+    assert result == expected
+    assert ast.dump(ast.parse(result, mode='eval')) == ast.dump(tree)
+
+
+def test_python_code_from_ast_not_supported():
+    with pytest.raises(NotImplementedError, match='Lambda'):
+        python_code_from_ast(ast.parse('lambda x: 1', mode='eval'))
@@ -0,0 +1,237 @@
+# -*- coding: UTF-8 -*-
+#
+# Copyright 2011-2019 by Dirk Gorissen, Stephen Rauch and Contributors
+# All rights reserved.
+# This file is part of the Pycel Library, Licensed under GPLv3 (the 'License')
+# You may not use this work except in compliance with the License.
+# You may obtain a copy of the Licence at:
+#   https://www.gnu.org/licenses/gpl-3.0.en.html
+
+import pickle
+import random
+from unittest import mock
+
+import networkx as nx
+import pytest
+
+from pycel.excelcompiler import _Cell
+from pycel.excelgraph import CycleError, DependencyGraph, NodeNotFound
+
+
+def random_dag(num_nodes=200, num_edges=600, seed=0):
+    rng = random.Random(seed)
+    nodes = [_Cell(f'S!A{i + 1}', value=i) for i in range(num_nodes)]
+    edges = set()
+    while len(edges) < num_edges:
+        src, dst = sorted(rng.sample(range(num_nodes), 2))
+        edges.add((nodes[src], nodes[dst]))
+    return nodes, sorted(edges, key=lambda e: rng.random())
+
+
+@pytest.mark.parametrize('min_pending', (4096, 1))
+def test_matches_networkx(min_pending):
+    nodes, edges = random_dag()
+    graph = DependencyGraph()
+    nx_graph = nx.DiGraph()
+    with mock.patch.object(DependencyGraph, 'min_pending', min_pending):
+        for node in nodes:
+            graph.add_node(node)
+            nx_graph.add_node(node)
+        for precedent, dependent in edges + edges[:10]:
+            graph.add_edge(precedent, dependent)
+            nx_graph.add_edge(precedent, dependent)
+
+    assert graph.number_of_nodes() == nx_graph.number_of_nodes() == len(graph)
+    assert set(graph.edges()) == set(nx_graph.edges())
+    assert graph.number_of_edges() == nx_graph.number_of_edges()
+    for node in nodes[::7]:
+        assert set(graph.predecessors(node)) == set(nx_graph.predecessors(node))
+        assert set(graph.successors(node)) == set(nx_graph.successors(node))
+        assert graph.ancestors(node) == nx.ancestors(nx_graph, node)
+        assert graph.descendants(node) == nx.descendants(nx_graph, node)
+
+    assert graph.descendants(*nodes[:3]) == set().union(
+        *(nx.descendants(nx_graph, node) for node in nodes[:3]))
+
+    def check_order(order, expected_nodes):
+        assert len(order) == len(expected_nodes)
+        assert set(order) == set(expected_nodes)
+        position = {node: i for i, node in enumerate(order)}
+        for precedent, dependent in nx_graph.subgraph(order).edges():
+            assert position[precedent] < position[dependent]
+
+    check_order(graph.topological_sort(), nodes)
+    subset = nodes[::3]
+    check_order(graph.topological_sort(subset), subset)
+    assert graph.topological_sort(()) == []
+
+    sub_graph = graph.subgraph(subset)
+    assert set(sub_graph.edges()) == set(nx_graph.subgraph(subset).edges())
+
+
+def test_deep_chain():
+    nodes = [_Cell(f'S!A{i + 1}', value=i) for i in range(2000)]
+    graph = DependencyGraph()
+    for precedent, dependent in zip(nodes[1:], nodes):
+        graph.add_edge(precedent, dependent)
+
+    assert graph.topological_sort() == nodes[::-1]
+    assert graph.ancestors(nodes[0]) == set(nodes[1:])
+    assert graph.descendants(nodes[-1]) == set(nodes[:-1])
+
+
+def test_cycle():
+    nodes = [_Cell(f'S!A{i + 1}', value=i) for i in range(3)]
+    graph = DependencyGraph()
+    graph.add_edge(nodes[0], nodes[1])
+    graph.add_edge(nodes[1], nodes[2])
+    assert graph.topological_sort() == nodes
+
+    graph.add_edge(nodes[2], nodes[0])
+    with pytest.raises(CycleError):
+        graph.topological_sort()
+    assert graph.topological_sort(nodes[:2]) == nodes[:2]
+
+
+@pytest.mark.parametrize('min_pending', (4096, 1))
+@pytest.mark.parametrize('num_back_edges', (0, 1, 3, 20))
+def test_strongly_connected_components(min_pending, num_back_edges):
+    nodes, edges = random_dag(num_nodes=100, num_edges=200)
+    rng = random.Random(num_back_edges)
+    back_edges = [(nodes[dst], nodes[src]) for src, dst in (
+        sorted(rng.sample(range(len(nodes)), 2))
+        for _ in range(num_back_edges))]
+    back_edges.append((nodes[5], nodes[5]))
+
+    graph = DependencyGraph()
+    nx_graph = nx.DiGraph()
+    with mock.patch.object(DependencyGraph, 'min_pending', min_pending):
+        for precedent, dependent in edges + back_edges:
+            graph.add_edge(precedent, dependent)
+            nx_graph.add_edge(precedent, dependent)
+
+    components = graph.strongly_connected_components()
+    assert set(map(frozenset, components)) == set(
+        map(frozenset, nx.strongly_connected_components(nx_graph)))
+    assert sum(map(len, components)) == len(graph)
+
+    # each component is after the components of its precedents
+    position = {node: i for i, component in enumerate(components)
+                for node in component}
+    for precedent, dependent in nx_graph.edges():
+        assert position[precedent] <= position[dependent]
+
+    assert graph.has_edge(nodes[5], nodes[5])
+    assert not graph.has_edge(nodes[6], nodes[6])
+    subset = nodes[::2]
+    assert set(map(frozenset, graph.strongly_connected_components(subset))) == (
+        set(map(frozenset, nx.strongly_connected_components(
+            nx_graph.subgraph(subset)))))
+
+
+def test_node_not_found():
+    graph = DependencyGraph()
+    node = _Cell('S!A1', value=1)
+    assert node not in graph
+    with pytest.raises(NodeNotFound, match='is not in the graph'):
+        graph.successors(node)
+    with pytest.raises(KeyError):
+        graph.ancestors(node)
+
+
+def test_pickle_and_networkx():
+    nodes, edges = random_dag(num_nodes=20, num_edges=40)
+    graph = DependencyGraph()
+    for precedent, dependent in edges:
+        graph.add_edge(precedent, dependent)
+
+    nx_graph = graph.to_networkx()
+    assert set(nx_graph.edges()) == set(graph.edges())
+    node = edges[0][0]
+    assert nx_graph.nodes[node] == dict(sheet='S', label=node.address.coordinate)
+
+    graph = DependencyGraph.from_networkx(nx_graph)
+    assert set(nx_graph.edges()) == set(graph.edges())
+
+    unpickled = pickle.loads(pickle.dumps(graph))
+    assert len(unpickled) == len(graph)
+    assert {(str(a.address), str(b.address)) for a, b in unpickled.edges()} \
+        == {(str(a.address), str(b.address)) for a, b in graph.edges()}
+    for node in unpickled.nodes():
+        assert len(list(unpickled.predecessors(node))) == len(
+            nx_graph.pred[graph.nodes()[unpickled._ids[node]]])
+
+
+@pytest.mark.parametrize('min_pending', (4096, 1))
+def test_remove_edges(min_pending):
+    nodes, edges = random_dag(num_nodes=20, num_edges=40)
+    graph = DependencyGraph()
+    with mock.patch.object(DependencyGraph, 'min_pending', min_pending):
+        for precedent, dependent in edges:
+            graph.add_edge(precedent, dependent)
+        graph.set_runtime_precedents(nodes[-1], nodes[:2])
+
+        graph.remove_edges(edges[:10])
+        assert set(graph.edges()) == set(edges[10:])
+        assert len(graph) == len(nodes)
+
+        # the runtime edges are kept
+        nx_graph = nx.DiGraph(edges[10:])
+        nx_graph.add_edges_from((node, nodes[-1]) for node in nodes[:2])
+        for node in nx_graph:
+            assert set(graph.predecessors(node)) == set(
+                nx_graph.predecessors(node))
+
+    with pytest.raises(NodeNotFound):
+        graph.remove_edges(((nodes[0], _Cell('S!B1')), ))
+
+
+@pytest.mark.parametrize('min_pending', (4096, 1))
+def test_runtime_precedents(min_pending):
+    nodes = [_Cell(f'S!A{i + 1}', value=i) for i in range(6)]
+    a, b, c, d, e, f = nodes
+    graph = DependencyGraph()
+    with mock.patch.object(DependencyGraph, 'min_pending', min_pending):
+        graph.add_edge(a, b)
+        graph.add_edge(b, c)
+        graph.add_edge(d, e)
+
+        assert graph.set_runtime_precedents(e, (c, a))
+        assert not graph.set_runtime_precedents(e, (a, c))
+        assert set(graph.predecessors(e)) == {a, c, d}
+        assert set(graph.successors(c)) == {e}
+        assert graph.has_edge(c, e)
+        assert graph.descendants(a) == {b, c, e}
+        assert graph.ancestors(e) == {a, b, c, d}
+        order = graph.topological_sort()
+        assert order.index(c) < order.index(e)
+
+        # the runtime edges survive merging the pending edges
+        graph.add_edge(e, f)
+        graph._compact()
+        assert graph.descendants(a) == {b, c, e, f}
+        assert set(graph.edges()) == {(a, b), (b, c), (d, e), (e, f)}
+
+        # and are replaced
+        assert graph.set_runtime_precedents(e, (b, ))
+        assert graph.descendants(a) == {b, c, e, f}
+        assert graph.descendants(c) == set()
+        assert set(graph.successors(b)) == {c, e}
+
+        graph.set_runtime_precedents(a, (f, ))
+        with pytest.raises(CycleError):
+            graph.topological_sort()
+        assert [set(component) for component in
+                graph.strongly_connected_components() if len(component) > 1
+                ] == [{a, b, e, f}]
+        assert graph.set_runtime_precedents(a, ())
+        assert len(graph.topological_sort()) == 6
+
+    unpickled = pickle.loads(pickle.dumps(graph))
+    unpickled_b = unpickled.nodes()[graph._ids[b]]
+    assert {str(node.address) for node in unpickled.successors(unpickled_b)} \
+        == {'S!A3', 'S!A5'}
+
+    subgraph = graph.subgraph((a, b, e, f))
+    assert set(subgraph.successors(b)) == {e}
+    assert subgraph.descendants(a) == {b, e, f}
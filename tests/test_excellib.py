@@ -52,6 +52,7 @@ from pycel.excelutil import (
     NA_ERROR,
     NAME_ERROR,
     NUM_ERROR,
+    RangeValue,
     VALUE_ERROR,
 )
 from pycel.lib.function_helpers import load_to_test_module
@@ -525,6 +526,8 @@ def test_sumifs(data, result):
 )
 def test_sumproduct(args, result):
     assert sumproduct(*args) == result
+    if all(isinstance(arg, tuple) for arg in args):
+        assert sumproduct(*(RangeValue(arg) for arg in args)) == result
 
 
 @pytest.mark.parametrize(
@@ -625,3 +628,23 @@ def test_sum_():
 
     assert DIV0 == sum_(DIV0)
     assert DIV0 == sum_((2, DIV0))
+
+
+@pytest.mark.parametrize(
+    'args', (
+        (((2, None, 'x', 3), ), ),
+        (((-0.1, None, 'x', True), (1.5, 2, 3, 4)), ),
+        (((2, 1), ), 3, True, 'x'),
+        (((2, 1), ), ((2, DIV0), )),
+        (((2, NA_ERROR), ), ((2, DIV0), )),
+        (((2, 1), ), VALUE_ERROR),
+        (((2 ** 60, 1), ), ),
+        ((), ),
+    )
+)
+def test_sum_range_value(args):
+    range_args = tuple(
+        RangeValue(arg) if isinstance(arg, tuple) else arg for arg in args)
+    result = sum_(*range_args)
+    assert result == sum_(*args)
+    assert type(result) is type(sum_(*args))
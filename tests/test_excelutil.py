@@ -9,9 +9,12 @@
 
 import os
 import pickle
+import sys
 import threading
 from collections import namedtuple
+from unittest import mock
 
+import numpy as np
 import pytest
 from openpyxl.utils import quote_sheetname
 
@@ -38,11 +41,15 @@ from pycel.excelutil import (
     list_like,
     MAX_COL,
     MAX_ROW,
+    NA_ERROR,
     NULL_ERROR,
     NUM_ERROR,
     OPERATORS,
     PyCelException,
     range_boundaries,
+    RangeValue,
+    slots_getstate,
+    slots_setstate,
     split_sheetname,
     structured_reference_boundaries,
     uniqueify,
@@ -751,6 +758,90 @@ def test_uniqueify():
     assert (4, 1, 2, 3) == uniqueify((4, 1, 2, 3, 4, 3))
 
 
+def test_slots_state():
+    class Base:
+        __slots__ = ('a', 'b', '__weakref__')
+
+    class Derived(Base):
+        __slots__ = ('_c', )
+
+        @property
+        def b(self):
+            return 'shadowed'
+
+    obj = Derived()
+    obj.a = 1
+    obj._c = 3
+    assert slots_getstate(obj) == dict(a=1, _c=3)
+
+    restored = Derived()
+    slots_setstate(restored, dict(a=1, b=2, _c=3, removed=4))
+    assert slots_getstate(restored) == dict(a=1, b=2, _c=3)
+    assert restored.b == 'shadowed'
+
+
+def test_range_value():
+    value = RangeValue(((1, 2.5, True), (None, 'x', DIV0), (NUM_ERROR, 3, -4)))
+    assert value == ((1, 2.5, True), (None, 'x', DIV0), (NUM_ERROR, 3, -4))
+    assert value.shape == (3, 3)
+    assert value.types.tolist() == [
+        [RangeValue.INTEGER, RangeValue.NUMBER, RangeValue.BOOL],
+        [RangeValue.EMPTY, RangeValue.STRING, RangeValue.ERROR],
+        [RangeValue.ERROR, RangeValue.INTEGER, RangeValue.INTEGER],
+    ]
+    assert value.numbers.tolist() == [1, 2.5, 3, -4]
+    assert value.number_mask.sum() == 4
+    assert value.floats[0, 1] == 2.5
+    assert np.isnan(value.floats[0, 2])
+    assert not value.all_integers
+    assert value.error == DIV0
+    assert value.objects[1, 2] == DIV0
+    assert value.types is value.types
+
+    ints = RangeValue(((1, 2), (3, 4)))
+    assert ints.all_integers
+    assert ints.error is None
+    assert ints.floats.tolist() == [[1, 2], [3, 4]]
+
+    unpickled = pickle.loads(pickle.dumps(value))
+    assert isinstance(unpickled, RangeValue)
+    assert unpickled == value
+    assert 'types' not in unpickled.__dict__
+
+    assert RangeValue(()).numbers.tolist() == []
+
+
+def test_range_value_from_sparse():
+    value = RangeValue.from_sparse(
+        (1000, 2), {(999, 1): 'x', (2, 0): 1, (7, 1): 2.5, (500, 0): True})
+    assert value.shape == (1000, 2)
+    assert value[0] is value[1] == (None, None)
+    assert value[2] == (1, None)
+    assert value[999] == (None, 'x')
+    assert list(value.populated) == [(2, 0), (7, 1), (500, 0), (999, 1)]
+    assert value.numbers.tolist() == [1, 2.5]
+    assert not value.all_integers
+    assert value.error is None
+    assert value.types[7, 1] == RangeValue.NUMBER
+    assert value.number_mask.sum() == 2
+    assert RangeValue(((1, ), )).populated is None
+
+    errors = RangeValue.from_sparse((10, 1), {(3, 0): 1, (5, 0): NA_ERROR})
+    assert errors.error == NA_ERROR
+    assert errors.all_integers
+
+    unpickled = pickle.loads(pickle.dumps(value))
+    assert unpickled == value
+    assert unpickled.populated is None
+
+
+def test_address_strings_interned():
+    sheet = ''.join(('She', 'et'))
+    address = AddressCell(f'{sheet}!B12')
+    assert address.sheet is sys.intern('Sheet')
+    assert address.coordinate is AddressRange('Other!B12').coordinate
+
+
 @pytest.mark.parametrize(
     'data, expected', (
         (AddressCell('A1'), True),
@@ -1315,6 +1406,119 @@ def test_excel_operator_operand_fixup(left_op, op, right_op, expected):
         assert [(True, f'Values: {left_op} {op} {right_op}')] == error_messages
 
 
+@pytest.mark.parametrize(
+    'left_op, op, right_op', [
+        (left_op, op, right_op)
+        for left_op, right_op in (
+            (2, 3), (2.5, -1), (-4, 0.5), (1e30, 2.5), (10.0, 400), (0, 0),
+            (0.0, -1), (3, 3.0))
+        for op in ('Eq', 'Lt', 'Gt', 'LtE', 'GtE', 'NotEq',
+                   'Add', 'Sub', 'Mult', 'Div', 'Pow', 'USub')
+    ]
+)
+def test_excel_operator_operand_fixup_numbers(left_op, op, right_op):
+    error_messages = []
+    fixup = build_operator_operand_fixup(
+        lambda *args: error_messages.append(args))
+    if op == 'USub':
+        left_op = EMPTY
+
+    result = fixup(left_op, op, right_op)
+    with mock.patch('pycel.excelutil.NUMBER_OPERAND_TYPES', ()):
+        expected = fixup(left_op, op, right_op)
+    assert result == expected
+    assert type(result) is type(expected)
+    if expected == DIV0:
+        assert len(error_messages) == 2
+        assert error_messages[0] == error_messages[1]
+
+
+def test_excel_operator_operand_fixup_whole_floats():
+    fixup = build_operator_operand_fixup(lambda *args: None)
+    result = fixup(2.0, 'Mult', 3)
+    assert result == 6
+    assert type(result) is int
+
+    result = fixup(EMPTY, 'USub', 2.0)
+    assert result == -2
+    assert type(result) is int
+
+    result = fixup(10.0, 'Pow', 400)
+    assert result == 10 ** 400
+    assert type(result) is int
+
+    assert type(fixup(2.5, 'Add', 0.5)) is float
+    assert type(fixup(6.0, 'Div', 3)) is float
+
+
+@pytest.mark.parametrize(
+    'left_op, op, right_op', [
+        (left_op, op, right_op)
+        for left_op, right_op in (
+            (((1, 2), (3, 4)), ((1, 2.5), (0, -1))),
+            (((1, 2, 3), ), 2),
+            (1.5, ((1, ), (0, ), (3, ))),
+            (((1, 2), ), ((3, ), (4, ))),
+            (((1, None), (True, 4)), ((DIV0, 2), ('3', 'x'))),
+            (RangeValue(((-8, 0), (1e300, 2))), ((0.5, -1), (10, 2.5))),
+            (((1, 2), ), ((1, 2, 3), )),
+            ((1, 2), ((1, ), )),
+            (((2 ** 60 + 1, 3), (2.0, 2 ** 30 + 1)), ((0, 2), (3, 2))),
+            (((2 ** 62, -(2 ** 62)), (2.0 ** 70, 5)), 3),
+            (((4.0, 2.5), (-3, 0)), ((0.5, 2.0), (-1, 3.0))),
+        )
+        for op in ('Eq', 'Lt', 'Gt', 'LtE', 'GtE', 'NotEq',
+                   'Add', 'Sub', 'Mult', 'Div', 'Pow', 'BitAnd')
+    ]
+)
+def test_excel_operator_operand_fixup_arrays(left_op, op, right_op):
+    error_messages = []
+    fixup = build_operator_operand_fixup(
+        lambda *args: error_messages.append(args))
+
+    with mock.patch('pycel.excelutil.NUMBER_UFUNCS', {}):
+        try:
+            expected = fixup(left_op, op, right_op)
+        except ValueError:
+            expected = ValueError
+        expected_messages = error_messages[:]
+    error_messages.clear()
+
+    if expected is ValueError:
+        with pytest.raises(ValueError):
+            fixup(left_op, op, right_op)
+    else:
+        result = fixup(left_op, op, right_op)
+        assert result == expected
+        if list_like(expected):
+            assert [tuple(map(type, row)) for row in result] == [
+                tuple(map(type, row)) for row in expected]
+    assert error_messages == expected_messages
+
+
+def test_excel_operator_operand_fixup_array_types():
+    fixup = build_operator_operand_fixup(lambda *args: None)
+    result = fixup(((1, 2), ), 'Mult', 3)
+    assert result == ((3, 6), )
+    assert {type(value) for value in result[0]} == {int}
+
+    result = fixup(((1, 2), ), 'Lt', 1.5)
+    assert result == ((True, False), )
+    assert {type(value) for value in result[0]} == {bool}
+
+    result = fixup(((2, 3.0), ), 'Pow', ((2, 2), ))
+    assert result == ((4, 9), )
+    assert {type(value) for value in result[0]} == {int}
+
+    result = fixup(((2, 3), ), 'Pow', -1)
+    assert result == ((0.5, 1 / 3), )
+    assert {type(value) for value in result[0]} == {float}
+
+    result = fixup(((2 ** 60 + 1, ), (2 ** 62, )), 'Add', ((0, ), (2 ** 62, )))
+    assert result == ((2 ** 60 + 1, ), (2 ** 63, ))
+    assert {type(value) for value in flatten(result)} == {int}
+
+
 def test_iterative_eval_tracker():
     assert isinstance(iterative_eval_tracker.ns.todo, set)
 
@@ -1379,3 +1583,27 @@ def test_iterative_eval_tracker():
     do_test_tracker()
     thread.join()
     assert thread.result
+
+
+def test_iterative_eval_tracker_iterate():
+    iterative_eval_tracker(iterations=3, tolerance=0.001)
+    iterative_eval_tracker.calced(1)
+    iterative_eval_tracker.calced(2)
+
+    # only the cells of the cycle are recalculated, until the iterations
+    iterations = []
+    for iteration in iterative_eval_tracker.iterate((2, )):
+        assert iterative_eval_tracker.is_calced(1)
+        assert not iterative_eval_tracker.is_calced(2)
+        iterations.append(iteration)
+        iterative_eval_tracker.calced(2)
+        iterative_eval_tracker.wip(2)
+    assert iterations == [1, 2, 3]
+    assert not iterative_eval_tracker.converged
+
+    # or until no cell changed by more than the tolerance
+    assert list(iterative_eval_tracker.iterate((2, ))) == [1]
+    assert iterative_eval_tracker.converged
+
+    iterative_eval_tracker.uncalced(1)
+    assert not iterative_eval_tracker.is_calced(1)
@@ -0,0 +1,81 @@
+# -*- coding: UTF-8 -*-
+#
+# Copyright 2011-2019 by Dirk Gorissen, Stephen Rauch and Contributors
+# All rights reserved.
+# This file is part of the Pycel Library, Licensed under GPLv3 (the 'License')
+# You may not use this work except in compliance with the License.
+# You may obtain a copy of the Licence at:
+#   https://www.gnu.org/licenses/gpl-3.0.en.html
+
+import numpy as np
+import pytest
+
+from pycel.excelvector import (
+    build_vector_lambda,
+    finite_mask,
+    NotVectorizable,
+    to_vector,
+    vector_operator,
+)
+
+
+@pytest.mark.parametrize(
+    'python_code, expected', (
+        ('_C_("S!A1") + 1', [1, 2, 3]),
+        ('-_C_("S!A1") * _C_("S!B1")', [-0, -4, -8]),
+        ('_C_("S!A1") > 1', [False, False, True]),
+        ('if_(_C_("S!A1") > 0, _C_("S!B1"), 7)', [7, 4, 4]),
+        ('if_(_C_("S!A1") > 0, lambda: _C_("S!B1"), 7)', [7, 4, 4]),
+        ('abs_(1 - _C_("S!A1") * 2)', [1, 1, 3]),
+        ('sqrt(_C_("S!A1") - 1)', [np.nan, 0, 1]),
+        ('_C_("S!A1") / _C_("S!C1")', [np.nan, np.inf, np.inf]),
+    )
+)
+def test_build_vector_lambda(python_code, expected):
+    cells = {'S!A1': np.array([0, 1, 2]), 'S!B1': 4, 'S!C1': None}
+    result = build_vector_lambda(python_code)(cells.get)
+    np.testing.assert_array_equal(result, expected)
+
+
+@pytest.mark.parametrize(
+    'python_code', (
+        'len_("abc")',
+        '_C_("S!A1") & "a"',
+        '_R_("S!A1:B2")',
+        '_C_(_C_("S!B1"))',
+        '1 < _C_("S!A1") < 3',
+        'if_(_C_("S!A1"), True, False)',
+        'if_(_C_("S!A1"), lambda x: 1, 0)',
+        '_C_("S!A1") +',
+    )
+)
+def test_not_vectorizable(python_code):
+    cells = {'S!A1': np.array([0, 1, 2]), 'S!B1': 'S!A1'}
+    with pytest.raises(NotVectorizable):
+        build_vector_lambda(python_code)(cells.get)
+
+
+@pytest.mark.parametrize(
+    'left_op, op, right_op', (
+        ('a', 'Add', np.arange(2)),
+        (np.arange(2), 'Eq', True),
+        (np.array(['a', 'b']), 'Add', 1),
+        (np.array([True]), 'Lt', 1),
+    )
+)
+def test_vector_operator_not_vectorizable(left_op, op, right_op):
+    with pytest.raises(NotVectorizable):
+        vector_operator(left_op, op, right_op)
+
+
+def test_to_vector():
+    assert to_vector([True, False]).dtype == bool
+    assert to_vector([1, 2.5]).dtype == float
+
+    result = to_vector([1, 'a', ((1, 2),)])
+    assert result.dtype == object
+    assert result[2] == ((1, 2),)
+
+    np.testing.assert_array_equal(
+        finite_mask(np.array([1, np.nan, np.inf])), [True, False, False])
+    assert finite_mask(np.array([True, False])).all()
@@ -8,6 +8,7 @@
 #   https://www.gnu.org/licenses/gpl-3.0.en.html
 
 import pytest
+from openpyxl import Workbook
 
 from pycel.excelutil import AddressRange
 from pycel.excelwrapper import (
@@ -220,6 +221,41 @@ def test_get_entire_rows_columns(excel, result_range, expected_range):
     assert result == expected
 
 
+def test_get_sparse_range():
+    wb = Workbook()
+    ws = wb.active
+    ws['A1'] = 1
+    ws['A2'] = '=A1+1'
+    ws['B3'] = 'x'
+    ws['A100000'] = 3
+    excel = ExcelOpxWrapperNoData(wb)
+
+    sparse = excel.get_sparse_range('Sheet!A:A')
+    assert sparse.address == AddressRange('Sheet!A1:A100000')
+    assert sparse.formula == {(0, 0): '', (1, 0): '=A1+1', (99999, 0): ''}
+    assert sparse.values == {(0, 0): 1, (1, 0): None, (99999, 0): 3}
+
+    sparse = excel.get_sparse_range('Sheet!A2:B99999')
+    assert sparse.values == {(0, 0): None, (1, 1): 'x'}
+
+    # the populated cells of each sheet are indexed once, and shared
+    assert excel._populated_index == {'Sheet': {1: [1, 2, 100000], 2: [3]}}
+    sparse = excel.get_sparse_range('Sheet!B1:B99999')
+    assert sparse.values == {(2, 0): 'x'}
+    repeated = excel.get_sparse_range('Sheet!B1:B99999')
+    assert (repeated.address, repeated.formula, repeated.values) == (
+        sparse.address, sparse.formula, sparse.values)
+    assert list(excel._populated_index) == ['Sheet']
+
+    # the empty cells are not created by openpyxl
+    assert len(ws._cells) == 4
+
+    # small, or densely populated, ranges are read with get_range
+    assert excel.get_sparse_range('Sheet!A1:B3') is None
+    assert excel.get_sparse_range('Sheet!1:1') is None
+    assert excel.get_sparse_range('Sheet!A1') is None
+
+
 @pytest.mark.parametrize(
     'address, expecteds',
     (